@@ -0,0 +1,138 @@
+import json
+import os
+
+
+class SheetCache():
+    """
+    Worksheet parts (xl/worksheets/sheetN.xml) rendered by previous dumps,
+    keyed by the fingerprint of the sheet's inputs.
+
+    Each part is stored with its metadata (see `WorkbookPackager`) in
+    `directory`. Use one directory per report: parts that are not used by
+    a dump are removed by `prune`, so the directory only keeps the parts
+    of the previous run.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.used = set()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, fingerprint, extension):
+        return os.path.join(self.directory, f'{fingerprint}.{extension}')
+
+    def get(self, fingerprint):
+        """Return the (xml, meta) part of `fingerprint`, or None."""
+        try:
+            with open(self.path(fingerprint, 'json'), encoding='utf-8') as fd:
+                meta = json.load(fd)
+            with open(self.path(fingerprint, 'xml'), encoding='utf-8') as fd:
+                xml = fd.read()
+        except (OSError, ValueError):
+            return None
+
+        self.used.add(fingerprint)
+        return xml, meta
+
+    def set(self, fingerprint, xml, meta):
+        # the xml first: a part is only valid once its meta is written.
+        with open(self.path(fingerprint, 'xml'), 'w', encoding='utf-8') as fd:
+            fd.write(xml)
+        with open(self.path(fingerprint, 'json'), 'w', encoding='utf-8') as fd:
+            json.dump(meta, fd)
+
+        self.used.add(fingerprint)
+
+    def prune(self):
+        """Remove the parts not used since this cache was opened."""
+        for filename in os.listdir(self.directory):
+            fingerprint, extension = os.path.splitext(filename)
+            if extension in ('.xml', '.json') and fingerprint not in self.used:
+                os.remove(os.path.join(self.directory, filename))
+
+
+class FileReportCache():
+    """
+    Whole xlsx reports, by key, stored in `directory`.
+
+    The directory holds at most `max_size` bytes of reports: the least
+    recently used ones are removed first.
+    """
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        """
+        :param directory: where the reports are stored.
+        :type directory: str
+
+        :param max_size: maximum size of the stored reports, in bytes.
+        :type max_size: int
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.xlsx')
+
+    def get(self, key):
+        """Return the report `key`, as a file open for reading, or None.
+
+        The report is read from the file in chunks: it is never held in
+        memory at once. The caller closes the file.
+        """
+        path = self.path(key)
+        try:
+            fd = open(path, 'rb')
+        except OSError:
+            return None
+
+        try:
+            # the modification time orders the reports by last use.
+            os.utime(path)
+        except OSError:
+            # evicted since it was opened: the open file is still readable.
+            pass
+        return fd
+
+    def set(self, key, content):
+        """Store the report `key`.
+
+        :param content: the report, as bytes or as an iterable of chunks.
+        :type content: bytes or iterable
+        """
+        if isinstance(content, bytes):
+            content = [content]
+
+        # written under another name first: a report being generated
+        # by another process is never read half written.
+        tmp_path = os.path.join(self.directory, f'.{key}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as fd:
+            for chunk in content:
+                fd.write(chunk)
+        os.replace(tmp_path, self.path(key))
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used reports above `max_size`."""
+        reports = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.xlsx'):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            reports.append((stat.st_mtime, stat.st_size, path))
+
+        size = 0
+        for mtime, report_size, path in sorted(reports, reverse=True):
+            size += report_size
+            if size > self.max_size:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
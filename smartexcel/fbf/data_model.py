@@ -1,18 +1,212 @@
+import decimal
+import hashlib
+import io
 import os
-from collections import namedtuple
+import re
 import shutil
 import requests
-import psycopg2
+try:
+    import numpy
+except ImportError:
+    numpy = None
 try:
     import plpy
 except:
     pass
 
-def namedtuplefetchall(cursor):
-    "Return all rows from a cursor as a namedtuple"
-    desc = cursor.description
-    nt_result = namedtuple('Result', [col[0] for col in desc])
-    return [nt_result(*row) for row in cursor.fetchall()]
+from ..payload import ColumnarPayload
+from .db import get_pool
+
+
+# query => plan, in pl/python (see `FbfFloodData.get_plan`). The module,
+# like GD, lives as long as the session.
+PLANS = {}
+
+
+def columnarfetchall(cursor, numeric_fields=()):
+    "Return all rows from a cursor as a ColumnarPayload"
+    fields = [col[0] for col in cursor.description]
+    return ColumnarPayload.from_rows(fields, cursor.fetchall(), numeric_fields)
+
+
+def parse_bool(value):
+    return value == 't'
+
+
+COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+COPY_ESCAPE_RE = re.compile(r'\\(.)')
+
+
+def parse_text(value):
+    """Unescape a value of COPY's text format."""
+    if '\\' not in value:
+        return value
+    return COPY_ESCAPE_RE.sub(
+        lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)),
+        value)
+
+
+# type oid => function converting a value of COPY's text format to the
+# value psycopg2 returns. The queries with columns of other types are not
+# fetched by COPY.
+COPY_CONVERTERS = {
+    16: parse_bool,  # bool
+    18: parse_text,  # char
+    19: parse_text,  # name
+    20: int,  # int8
+    21: int,  # int2
+    23: int,  # int4
+    25: parse_text,  # text
+    26: int,  # oid
+    700: float,  # float4
+    701: float,  # float8
+    1042: parse_text,  # bpchar
+    1043: parse_text,  # varchar
+    1700: decimal.Decimal,  # numeric
+}
+
+PARAMETER_RE = re.compile(r'\$([0-9]+)')
+
+
+def copyfetchall(cursor, query, converters, fields, numeric_fields=()):
+    """Return all rows of `query` as a ColumnarPayload, fetched by
+    `COPY (query) TO STDOUT`.
+
+    The rows are decoded column by column, by the `converters` of the
+    `fields`, as COPY sends them (see `CopyDecoder`): no object is built
+    per row.
+    """
+    decoder = CopyDecoder(converters, [
+        field in numeric_fields
+        for field in fields
+    ])
+    cursor.copy_expert(b'COPY (' + query + b') TO STDOUT', decoder)
+    return ColumnarPayload(fields, decoder.getvalue(), numeric_fields)
+
+
+def decode_copy(data, converters):
+    """Return the columns of the rows `data`, in COPY's text format.
+
+    :param converters: a function converting the values, per column.
+    """
+    decoder = CopyDecoder(converters)
+    decoder.write(data)
+    return decoder.getvalue()
+
+
+# converter => dtype of the NumPy array its numeric values are parsed into
+COPY_DTYPES = {
+    int: 'int64',
+    float: 'float64',
+}
+
+
+class CopyDecoder(io.TextIOBase):
+    """
+    A file `cursor.copy_expert` writes COPY's text format to, decoding the
+    rows as they arrive.
+
+    Only the last, incomplete row of a chunk is kept until the next one.
+    The values of the complete rows are converted column by column, and the
+    numeric columns are parsed straight into NumPy arrays (if NumPy is
+    installed).
+    """
+
+    def __init__(self, converters, numeric=()):
+        """
+        :param converters: a function converting the values, per column.
+        :type converters: list
+
+        :param numeric: whether to parse the column into a NumPy array, per
+            column. A column with a null stays a list of values, as in
+            `to_array`.
+        :type numeric: list
+        """
+        self.converters = converters
+        self.dtypes = [None for convert in converters]
+        if numpy is not None:
+            for index, convert in enumerate(converters):
+                if index < len(numeric) and numeric[index]:
+                    self.dtypes[index] = COPY_DTYPES.get(convert)
+
+        self.columns = [[] for convert in converters]
+        self.rest = ''
+
+    def writable(self):
+        return True
+
+    def write(self, chunk):
+        data = self.rest + chunk
+        end = data.rfind('\n') + 1
+        self.rest = data[end:]
+        self.decode(data[:end])
+        return len(chunk)
+
+    def decode(self, data):
+        if not data:
+            return
+
+        # the values of all the rows, one after the other: tabs and newlines
+        # inside the values are escaped.
+        width = len(self.converters)
+        values = data[:-1].replace('\n', '\t').split('\t')
+        if len(values) != data.count('\n') * width:
+            raise ValueError('The rows do not have the columns of the query.')
+
+        for index, convert in enumerate(self.converters):
+            column = values[index::width]
+            if self.dtypes[index] is not None:
+                if '\\N' not in column:
+                    self.columns[index].append(
+                        numpy.array(column, dtype=self.dtypes[index]))
+                    continue
+
+                # a null: the column is a list from now on, as in `to_array`
+                self.columns[index] = [
+                    value
+                    for array in self.columns[index]
+                    for value in array.tolist()
+                ]
+                self.dtypes[index] = None
+
+            self.columns[index].extend(decode_column(column, convert))
+
+    def column(self, index):
+        if self.dtypes[index] is None or not self.columns[index]:
+            return self.columns[index]
+        return numpy.concatenate(self.columns[index])
+
+    def getvalue(self):
+        """Return the columns of the rows written."""
+        if self.rest:
+            raise ValueError('The last row of the query is incomplete.')
+        return [self.column(index) for index in range(len(self.converters))]
+
+
+def decode_column(values, convert):
+    if '\\N' in values:
+        return [None if value == '\\N' else convert(value) for value in values]
+    return list(map(convert, values))
+
+
+def bind_parameters(cursor, query, params):
+    """Return `query`, with its parameters ($1, $2...) bound by psycopg2."""
+    values = []
+
+    def placeholder(match):
+        values.append(params[int(match.group(1)) - 1])
+        return '%s'
+
+    query = PARAMETER_RE.sub(placeholder, query.replace('%', '%%'))
+    return cursor.mogrify(query, values)
+
+
+def area_code_text(area_code):
+    """Return the text form of an area code, written as an integer when it
+    is one (village codes are read as floats: 3201.0 => '3201')."""
+    if isinstance(area_code, (float, decimal.Decimal)) and area_code == int(area_code):
+        area_code = int(area_code)
+    return str(area_code)
 
 
 class FbfFloodData():
@@ -23,18 +217,61 @@ class FbfFloodData():
         {'id': 3, 'status': 'Stop', 'color': '#FF0000'}
     ]
 
-    def __init__(self, flood_event_id, pl_python_env=None):
+    # table columns read straight from an attribute of the payload rows,
+    # one column at a time (instead of calling `write_*` for each row).
+    column_attributes = {
+        'district_name': 'district_name',
+        'district_code': 'district_code',
+        'sub_district_name': 'sub_district_name',
+        'sub_district_id': 'sub_district_code',
+        'village_name': 'village_name',
+        'total_buildings': 'total_buildings',
+        'flooded_buildings': 'flooded_buildings',
+        'building_count': 'building_count',
+        'flooded_building_count': 'flooded_building_count',
+        'residential_building_count': 'residential_building_count',
+        'residential_flooded_building_count': 'residential_flooded_building_count',
+        'clinic_dr_building_count': 'clinic_dr_building_count',
+        'clinic_dr_flooded_building_count': 'clinic_dr_flooded_building_count',
+    }
+
+    # fields stored in a NumPy array (if available) by `execute_query`
+    numeric_fields = (
+        'total_buildings',
+        'flooded_buildings',
+        'vulnerability_total_score',
+    )
+
+    # area table => (code of the areas, summary of the event's areas, code
+    # of the areas in the summary)
+    area_levels = {
+        'district': ('dc_code', 'mv_flood_event_district_summary', 'district_id'),
+        'sub_district': ('sub_dc_code', 'mv_flood_event_sub_district_summary', 'sub_district_id'),
+        'village': ('village_code', 'mv_flood_event_village_summary', 'village_id'),
+    }
+
+    def __init__(self, flood_event_id, pl_python_env=None, extent_table=None, pool=None, plans=None):
+        """
+        :param plans: where the plans of the queries are kept, in pl/python
+        (e.g. GD). By default, in the module.
+        :param pool: the ConnectionPool of the queries, outside of pl/python.
+        By default, the pool of the process (see `db.get_pool`).
+        :param extent_table: the name of a table keeping the extents of the
+        areas from one report to the next (see `get_area_extents`). It is
+        created if it does not exist.
+        """
         self.flood_event_id = flood_event_id
+        self.extent_table = extent_table
+        self.plans = PLANS if plans is None else plans
+
+        # query => (fields, converters) of its COPY, or None if it can't be
+        # fetched by COPY (see `copy_query`)
+        self.copy_formats = {}
 
         if pl_python_env:
             self.pl_python_env = pl_python_env
         else:
-            self.connection = psycopg2.connect(
-                user = os.environ['DB_USER'],
-                password = os.environ['DB_PASSWORD'],
-                host = os.environ['DB_HOST'],
-                port = os.environ['DB_PORT'],
-                database = os.environ['DB_DATABASE'])
+            self.pool = pool or get_pool()
             self.pl_python_env = False
 
         self.results = {
@@ -42,29 +279,109 @@ class FbfFloodData():
             'districts': self.get_districts(flood_event_id),
         }
 
-    def execute_query(self, query):
+        # level => areas of the level, grouped by the code of their parent
+        # (see `get_children`)
+        self.children = {}
+
+        # area table => extent of the areas, by area code
+        # (see `get_area_extents`)
+        self.extents = {}
+
+        # (table, column) => SQL type of the column (see `get_column_type`)
+        self.column_types = {}
+
+    def execute_query(self, query, params=(), types=(), bulk=False):
+        """Execute `query` and return its rows as a ColumnarPayload.
+
+        The query is prepared once per session, then executed with the
+        `params` ($1, $2...), of the SQL `types`.
+
+        With `bulk`, the rows are fetched by COPY instead (for the queries
+        returning many rows), but in pl/python.
+        """
         if self.pl_python_env:
-            res = plpy.execute(query)
+            res = plpy.execute(self.get_plan(query, types), list(params))
             try:
                 fields = list(res[0].keys())
-
-                def_meta_res = namedtuple('Result', ', '.join(fields))
-
-                results = [
-                    def_meta_res(*list(res[index].values()))
-                    for index in range(0, len(res))
-                ]
             except IndexError:
-                results = []
+                fields = []
+
+            results = ColumnarPayload(
+                fields,
+                [
+                    [row[field] for row in res]
+                    for field in fields
+                ],
+                self.numeric_fields)
             return results
 
         else:
-            with self.connection.cursor() as cursor:
-                cursor.execute(query)
-                results = namedtuplefetchall(cursor)
+            with self.pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    if bulk:
+                        results = self.copy_query(cursor, query, params)
+                        if results is not None:
+                            return results
+
+                    name = self.prepare(connection, cursor, query, types)
+                    if params:
+                        placeholders = ', '.join(['%s'] * len(params))
+                        cursor.execute(f'EXECUTE {name} ({placeholders})', params)
+                    else:
+                        cursor.execute(f'EXECUTE {name}')
+                    results = columnarfetchall(cursor, self.numeric_fields)
 
         return results
 
+    def copy_query(self, cursor, query, params):
+        """Fetch the rows of `query` by COPY, or return None if one of its
+        columns has a type COPY_CONVERTERS does not know."""
+        # COPY does not take parameters, nor a trailing ;
+        bound = bind_parameters(cursor, query.strip().rstrip(';'), params)
+
+        if query not in self.copy_formats:
+            cursor.execute(b'SELECT * FROM (' + bound + b') query LIMIT 0')
+            self.copy_formats[query] = None
+            if all(column.type_code in COPY_CONVERTERS for column in cursor.description):
+                self.copy_formats[query] = (
+                    [column.name for column in cursor.description],
+                    [COPY_CONVERTERS[column.type_code] for column in cursor.description])
+
+        if self.copy_formats[query] is None:
+            return None
+
+        fields, converters = self.copy_formats[query]
+        return copyfetchall(cursor, bound, converters, fields, self.numeric_fields)
+
+    def get_plan(self, query, types):
+        """Return the plan of `query`, prepared by plpy the first time."""
+        key = (query, tuple(types))
+        if key not in self.plans:
+            self.plans[key] = plpy.prepare(query, list(types))
+        return self.plans[key]
+
+    def prepare(self, connection, cursor, query, types):
+        """Prepare `query` on the server, once per connection, and return
+        the name of the prepared statement."""
+        name = statement_name(query, types)
+        prepared = self.pool.prepared_statements(connection)
+        if name not in prepared:
+            if types:
+                cursor.execute(f'PREPARE {name} ({", ".join(types)}) AS {query}')
+            else:
+                cursor.execute(f'PREPARE {name} AS {query}')
+            prepared.add(name)
+        return name
+
+    def execute_statement(self, query):
+        """Execute `query`, which returns no rows, and commit it."""
+        if self.pl_python_env:
+            plpy.execute(query)
+        else:
+            with self.pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(query)
+
     def get_districts(self, flood_event_id):
 
         query = """
@@ -83,13 +400,11 @@ class FbfFloodData():
             WHERE
                 fe.id = summary.flood_event_id
                 and summary.district_id = area.dc_code
-                and fe.id = {flood_event_id}
+                and fe.id = $1
             ;
-        """.format(
-            flood_event_id=flood_event_id
-        )
+        """
 
-        return self.execute_query(query)
+        return self.execute_query(query, [flood_event_id], ['integer'])
 
 
     def get_subdistricts(self, flood_event_id, district_code):
@@ -110,15 +425,15 @@ class FbfFloodData():
             WHERE
                 fe.id = summary.flood_event_id
                 and summary.sub_district_id = area.sub_dc_code
-                and area.dc_code = {district_code}
-                and fe.id = {flood_event_id}
+                and area.dc_code = $2
+                and fe.id = $1
             ;
-        """.format(
-            district_code=district_code,
-            flood_event_id=flood_event_id
-        )
+        """
 
-        return self.execute_query(query)
+        return self.execute_query(
+            query,
+            [flood_event_id, district_code],
+            ['integer', 'bigint'])
 
 
     def get_villages(self, flood_event_id, sub_district_code):
@@ -138,17 +453,95 @@ class FbfFloodData():
             WHERE
                 fe.id = summary.flood_event_id
                 and summary.village_id = area.village_code
-                and area.sub_dc_code = {sub_district_code}
-                and fe.id = {flood_event_id}
+                and area.sub_dc_code = $2
+                and fe.id = $1
             ;
-        """.format(
-            sub_district_code=sub_district_code,
-            flood_event_id=flood_event_id
-        )
+        """
 
-        return self.execute_query(query)
+        return self.execute_query(
+            query,
+            [flood_event_id, sub_district_code],
+            ['integer', 'bigint'])
 
 
+    def get_event_subdistricts(self, flood_event_id):
+        """The sub-districts of all the districts, with their `district_code`."""
+        query = """
+            SELECT
+                area.name as sub_district_name,
+                area.sub_dc_code as sub_district_code,
+                area.dc_code as district_code,
+                summary.total_vulnerability_score as vulnerability_total_score,
+                summary.building_count as total_buildings,
+                summary.flooded_building_count as flooded_buildings,
+                summary.trigger_status as activation_state
+
+            FROM
+                flood_event fe,
+                mv_flood_event_sub_district_summary summary,
+                sub_district area
+            WHERE
+                fe.id = summary.flood_event_id
+                and summary.sub_district_id = area.sub_dc_code
+                and fe.id = $1
+            ;
+        """
+
+        return self.execute_query(query, [flood_event_id], ['integer'], bulk=True)
+
+    def get_event_villages(self, flood_event_id):
+        """The villages of all the sub-districts, with their `sub_district_code`."""
+        query = """
+            SELECT
+                area.name as village_name,
+                area.village_code as village_code,
+                area.sub_dc_code as sub_district_code,
+                summary.total_vulnerability_score as vulnerability_total_score,
+                summary.building_count as total_buildings,
+                summary.flooded_building_count as flooded_buildings,
+                summary.trigger_status as activation_state
+
+            FROM
+                flood_event fe,
+                mv_flood_event_village_summary summary,
+                village area
+            WHERE
+                fe.id = summary.flood_event_id
+                and summary.village_id = area.village_code
+                and fe.id = $1
+            ;
+        """
+
+        return self.execute_query(query, [flood_event_id], ['integer'], bulk=True)
+
+    def get_children(self, level, parent_code):
+        """Return the areas of `level` ('subdistricts' or 'villages') in the
+        parent area `parent_code`.
+
+        The areas of a level are loaded by one query, the first time, then
+        grouped by the code of their parent: the number of queries does not
+        depend on the number of areas.
+        """
+        if level not in self.children:
+            if level == 'subdistricts':
+                areas = self.get_event_subdistricts(self.flood_event_id)
+                parent_field = 'district_code'
+            else:
+                areas = self.get_event_villages(self.flood_event_id)
+                parent_field = 'sub_district_code'
+
+            groups = {}
+            if len(areas):
+                groups = {
+                    int(code): rows
+                    for code, rows in areas.group_by(parent_field).items()
+                    if code is not None
+                }
+            self.children[level] = (groups, areas.take([]))
+
+        groups, empty = self.children[level]
+        return groups.get(parent_code, empty)
+
     def get_flood(self, flood_event_id):
         query = """
             SELECT
@@ -156,24 +549,63 @@ class FbfFloodData():
             FROM
                 flood_event fe
             WHERE
-                fe.id = {flood_event_id}
-        """.format(
-            flood_event_id=flood_event_id
-        )
+                fe.id = $1
+        """
 
-        return self.execute_query(query)
+        return self.execute_query(query, [flood_event_id], ['integer'])
 
     def get_flood_extent(self, flood_event_id):
         query = """
             SELECT *
             FROM vw_flood_event_extent fee
-            WHERE fee.id = {flood_event_id}
+            WHERE fee.id = $1
+        """
+        return self.execute_query(query, [flood_event_id], ['integer'])
+
+    def get_report_fingerprint(self):
+        """Return a digest of the data of the report (see `SmartExcel`).
+
+        The flood event (but the report stored in it) and the summaries
+        of its areas: the report is generated again when one of them
+        changes.
+        """
+        summary_query = """
+            (
+                SELECT count(*) || ':' || md5(string_agg(summary::text, ',' ORDER BY summary::text))
+                FROM {view} summary
+                WHERE summary.flood_event_id = $1
+            )
+        """
+
+        query = """
+            SELECT md5(concat_ws(
+                '|',
+                (
+                    SELECT (to_jsonb(fe) - 'spreadsheet')::text
+                    FROM flood_event fe
+                    WHERE fe.id = $1
+                ),
+                {summaries}
+            )) as fingerprint
         """.format(
-            flood_event_id=flood_event_id
+            summaries=','.join([
+                summary_query.format(view=view)
+                for view in [
+                    'mv_flood_event_district_summary',
+                    'mv_flood_event_sub_district_summary',
+                    'mv_flood_event_village_summary'
+                ]
+            ])
         )
-        return self.execute_query(query)
+
+        return self.execute_query(query, [self.flood_event_id], ['integer'])[0].fingerprint
 
     def get_area_extent(self, params, area_code):
+        """Return the extent of the area `area_code`.
+
+        The code is bound with the type of the `foreign_key` column, from
+        its text form: the column can hold numbers or text.
+        """
         query = """
             SELECT
                 st_xmin(st_extent((st_buffer(geom, 0.25)::geography)::geometry)) as x_min,
@@ -181,21 +613,152 @@ class FbfFloodData():
                 st_xmax(st_extent((st_buffer(geom, 0.25)::geography)::geometry)) as x_max,
                 st_ymax(st_extent((st_buffer(geom, 0.25)::geography)::geometry)) as y_max
             FROM {table}
-            WHERE {foreign_key} = '{area_code}'
+            WHERE {foreign_key} = $1
         """.format(
             table=params['table'],
-            foreign_key=params['foreign_key'],
-            area_code=area_code
+            foreign_key=params['foreign_key']
         )
-        return self.execute_query(query)
+        column_type = self.get_column_type(params['table'], params['foreign_key'])
+        return self.execute_query(query, [area_code_text(area_code)], [column_type])
+
+    def get_column_type(self, table, column):
+        """Return the SQL type of `column` in `table`, queried once."""
+        if (table, column) not in self.column_types:
+            query = """
+                SELECT format_type(atttypid, atttypmod) as column_type
+                FROM pg_attribute
+                WHERE attrelid = $1::regclass
+                    AND attname = $2
+            """
+            self.column_types[(table, column)] = self.execute_query(
+                query, [table, column], ['text', 'text'])[0].column_type
+        return self.column_types[(table, column)]
+
+    def get_area_extents(self, table):
+        """Return the extents of the areas of `table` in the flood event, by
+        area code.
+
+        The extents of all the areas are computed by one grouped query, the
+        first time, each geometry being buffered once. With an
+        `extent_table`, they are read from it: only the areas missing from
+        it are computed, and stored.
+        """
+        if table not in self.extents:
+            if self.extent_table:
+                extents = self.query_cached_extents(table)
+            else:
+                extents = self.query_extents(table)
+
+            self.extents[table] = {
+                int(extent.area_code): extent
+                for extent in extents
+                if extent.area_code is not None
+            }
+
+        return self.extents[table]
+
+    def query_extents(self, table):
+        foreign_key, summary, summary_key = self.area_levels[table]
+        query = """
+            SELECT
+                area_code,
+                st_xmin(extent) as x_min,
+                st_ymin(extent) as y_min,
+                st_xmax(extent) as x_max,
+                st_ymax(extent) as y_max
+            FROM (
+                SELECT
+                    area.{foreign_key} as area_code,
+                    st_extent((st_buffer(area.geom, 0.25)::geography)::geometry) as extent
+                FROM {table} area
+                WHERE area.{foreign_key} IN (
+                    SELECT summary.{summary_key}
+                    FROM {summary} summary
+                    WHERE summary.flood_event_id = $1
+                )
+                GROUP BY area.{foreign_key}
+            ) extents
+        """.format(
+            table=table,
+            foreign_key=foreign_key,
+            summary=summary,
+            summary_key=summary_key
+        )
+        return self.execute_query(query, [self.flood_event_id], ['integer'])
+
+    def query_cached_extents(self, table):
+        foreign_key, summary, summary_key = self.area_levels[table]
+        self.execute_statement("""
+            CREATE TABLE IF NOT EXISTS {extent_table} (
+                area_table varchar NOT NULL,
+                area_code bigint NOT NULL,
+                x_min double precision,
+                y_min double precision,
+                x_max double precision,
+                y_max double precision,
+                PRIMARY KEY (area_table, area_code)
+            )
+        """.format(extent_table=self.extent_table))
+
+        # the new extents are not seen by the last SELECT: they are
+        # returned by the INSERT.
+        query = """
+            WITH event_areas AS (
+                SELECT summary.{summary_key}::bigint as area_code
+                FROM {summary} summary
+                WHERE summary.flood_event_id = $1
+            ),
+            missing AS (
+                SELECT
+                    area.{foreign_key}::bigint as area_code,
+                    st_extent((st_buffer(area.geom, 0.25)::geography)::geometry) as extent
+                FROM {table} area
+                WHERE area.{foreign_key}::bigint IN (SELECT area_code FROM event_areas)
+                    AND area.{foreign_key}::bigint NOT IN (
+                        SELECT cached.area_code
+                        FROM {extent_table} cached
+                        WHERE cached.area_table = $2
+                    )
+                GROUP BY area.{foreign_key}
+            ),
+            inserted AS (
+                INSERT INTO {extent_table} (area_table, area_code, x_min, y_min, x_max, y_max)
+                SELECT
+                    $2,
+                    area_code,
+                    st_xmin(extent),
+                    st_ymin(extent),
+                    st_xmax(extent),
+                    st_ymax(extent)
+                FROM missing
+                ON CONFLICT DO NOTHING
+                RETURNING area_code, x_min, y_min, x_max, y_max
+            )
+            SELECT * FROM inserted
+            UNION ALL
+            SELECT cached.area_code, cached.x_min, cached.y_min, cached.x_max, cached.y_max
+            FROM {extent_table} cached
+            WHERE cached.area_table = $2
+                AND cached.area_code IN (SELECT area_code FROM event_areas)
+        """.format(
+            table=table,
+            foreign_key=foreign_key,
+            summary=summary,
+            summary_key=summary_key,
+            extent_table=self.extent_table
+        )
+        return self.execute_query(
+            query,
+            [self.flood_event_id, table],
+            ['integer', 'varchar'])
 
     def get_payload_subdistricts(self, instance, foreign_key):
         district_code = int(getattr(instance, foreign_key))
-        return self.get_subdistricts(self.flood_event_id, district_code)
+        return self.get_children('subdistricts', district_code)
 
     def get_payload_villages(self, instance, foreign_key):
         sub_district_code = int(getattr(instance, foreign_key))
-        return self.get_villages(self.flood_event_id, sub_district_code)
+        return self.get_children('villages', sub_district_code)
 
     def get_payload_village_detail(self, instance, foreign_key):
         return [instance]
@@ -299,6 +862,18 @@ class FbfFloodData():
         except Exception:
             return 0
 
+    def write_not_flooded_buildings__column(self, payload):
+        if isinstance(payload, ColumnarPayload):
+            arrays = payload.arrays('total_buildings', 'flooded_buildings')
+            if arrays:
+                total, flooded = arrays
+                return (total - flooded).tolist()
+
+        return [
+            self.write_not_flooded_buildings(instance)
+            for instance in payload
+        ]
+
     def write_vulnerability_total_score(self, instance, kwargs={}):
         return instance[kwargs['index']]['vulnerability_total_score']
 
@@ -396,10 +971,13 @@ class FbfFloodData():
         return self.get_map_path(params)
 
     def get_map_path(self, params):
-        extent = self.get_area_extent({
-            'table': params['table'],
-            'foreign_key': params['foreign_key']
-        }, params['area_code'])[0]
+        extent = self.get_area_extents(params['table']).get(params['area_code'])
+        if extent is None:
+            # an area outside of the flood event
+            extent = self.get_area_extent({
+                'table': params['table'],
+                'foreign_key': params['foreign_key']
+            }, params['area_code'])[0]
 
         bbox = extent_to_string(extent)
 
@@ -425,6 +1003,12 @@ class FbfFloodData():
         )
 
 
+def statement_name(query, types):
+    """The name of the prepared statement of `query`, from its text."""
+    digest = hashlib.md5('|'.join([query, *types]).encode('utf-8')).hexdigest()
+    return f'smartexcel_{digest[:16]}'
+
+
 def build_wms_url(flood_event_id, bbox, size):
     width = size['width']
     height = size['height']
@@ -0,0 +1,180 @@
+import contextlib
+import os
+import threading
+import time
+import weakref
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_UNKNOWN
+from psycopg2.pool import ThreadedConnectionPool
+
+
+# connections not used for this many seconds are checked before being lent
+HEALTH_CHECK_INTERVAL = 30
+
+
+class ConnectionPool():
+    """
+    A pool of psycopg2 connections, shared by the threads of a process.
+
+    The connections are borrowed for a block:
+        with pool.connection() as connection:
+            ...
+    The transaction is committed at the end of the block (rolled back on
+    an error), and the connection goes back to the pool. When all the
+    connections are lent, the block waits for one.
+
+    The pool is closed by `close()`, or at the end of a `with pool:` block.
+    """
+
+    pool_class = ThreadedConnectionPool
+
+    def __init__(self, minconn=None, maxconn=4, health_check_interval=HEALTH_CHECK_INTERVAL, **params):
+        """
+        :param minconn: the number of connections opened at once, and kept
+        open: psycopg2 closes the connections given back beyond this
+        number. By default, `maxconn`.
+        :param maxconn: the maximum number of connections.
+        :param health_check_interval: the connections idle for more than
+        this number of seconds are checked (`SELECT 1`) before being lent.
+        :param params: the parameters of `psycopg2.connect`.
+        """
+        if minconn is None:
+            minconn = maxconn
+        self.pool = self.pool_class(minconn, maxconn, **params)
+        self.available = threading.BoundedSemaphore(maxconn)
+        self.health_check_interval = health_check_interval
+        self.maxconn = maxconn
+        self.pid = os.getpid()
+
+        # connection => {'last_used': the time it was given back,
+        # 'prepared': the names of its prepared statements}. The state goes
+        # with the connection object, not with its id, which a new
+        # connection can take once it is freed.
+        self.states = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def from_env(cls):
+        """A pool connecting to the database of the DB_* environment variables."""
+        maxconn = pool_size(os.environ, 'DB_POOL_SIZE', 4)
+        return cls(
+            minconn=pool_size(os.environ, 'DB_POOL_MIN_SIZE', maxconn),
+            maxconn=maxconn,
+            user=os.environ['DB_USER'],
+            password=os.environ['DB_PASSWORD'],
+            host=os.environ['DB_HOST'],
+            port=os.environ['DB_PORT'],
+            database=os.environ['DB_DATABASE'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Lend a connection for the block, in a transaction."""
+        with self.available:
+            connection = self.getconn()
+            broken = False
+            try:
+                with connection:
+                    yield connection
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                self.putconn(connection, close=broken or bool(connection.closed))
+
+    def getconn(self):
+        # each of the connections of the pool may be broken
+        for attempt in range(self.maxconn + 1):
+            connection = self.pool.getconn()
+            if self.is_healthy(connection):
+                return connection
+            self.putconn(connection, close=True)
+
+        raise psycopg2.OperationalError('No healthy connection in the pool.')
+
+    def putconn(self, connection, close=False):
+        self.pool.putconn(connection, close=close)
+        if connection.closed:
+            # psycopg2 closed it, instead of keeping it
+            self.states.pop(connection, None)
+        else:
+            self.state(connection)['last_used'] = time.monotonic()
+
+    def state(self, connection):
+        return self.states.setdefault(connection, {'last_used': None, 'prepared': set()})
+
+    def prepared_statements(self, connection):
+        """The names of the statements prepared on `connection`, to be
+        updated by its borrower. Prepared statements outlive transactions,
+        not connections."""
+        return self.state(connection)['prepared']
+
+    def is_healthy(self, connection):
+        if connection.closed:
+            return False
+        if connection.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        last_used = self.state(connection)['last_used']
+        if last_used is None or time.monotonic() - last_used > self.health_check_interval:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                connection.rollback()
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def close(self):
+        # the connections of a forked process belong to its parent
+        if self.pid == os.getpid() and not self.pool.closed:
+            self.pool.closeall()
+
+
+def pool_size(environ, name, default):
+    """Read the size of a pool from the environment variable `name`."""
+    value = environ.get(name)
+    if not value:
+        return default
+
+    size = int(value)
+    if size < 1:
+        raise ValueError(f'{name} must be at least 1, not {size}.')
+    return size
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# The pools inherited by a forked process. They are kept, not closed:
+# closing (or freeing) their connections would end the sessions of the
+# parent process.
+_inherited_pools = []
+
+
+def get_pool():
+    """Return the pool of the process, created from the environment on the
+    first call (and again in a forked process)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid != os.getpid():
+            _inherited_pools.append(_pool)
+            _pool = None
+        if _pool is None:
+            _pool = ConnectionPool.from_env()
+        return _pool
+
+
+def close_pool():
+    """Close the pool of the process, if any."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,128 @@
+import io
+
+
+class TableLoader():
+    """
+    Load parsed rows into a PostgreSQL `table`, a batch at a time (see
+    `SmartExcel.parse_into`).
+
+    With a psycopg2 `connection`, each batch is sent with one
+    `COPY ... FROM STDIN`. In a pl/python function (`plpy`), where COPY
+    FROM STDIN is not available, each batch is inserted by one prepared
+    `INSERT ... SELECT * FROM unnest(...)`.
+
+    The transaction is left to the caller: nothing is committed here.
+    """
+
+    def __init__(self, table, columns=None, connection=None, plpy=None):
+        """
+        :param table: the name of the table, optionally schema-qualified.
+        :type table: str
+
+        :param columns: the key of the parsed rows => the column of the
+        table. By default, the keys of the rows are the columns.
+        :type columns: dict or list
+
+        :param connection: a psycopg2 connection.
+
+        :param plpy: the plpy module, in a pl/python function.
+        """
+        self.table = table
+        self.columns = columns
+        self.connection = connection
+        self.plpy = plpy
+
+        self.insert_plan = None
+
+    def get_columns(self, row):
+        """Return the (key, column) pairs to load from the rows."""
+        if self.columns is None:
+            self.columns = list(row)
+        if isinstance(self.columns, dict):
+            return list(self.columns.items())
+        return [(key, key) for key in self.columns]
+
+    def write_batch(self, rows):
+        """Load a batch of parsed rows (dict)."""
+        if not rows:
+            return
+
+        columns = self.get_columns(rows[0])
+        keys = [key for key, column in columns]
+
+        if self.plpy:
+            self.insert(rows, columns)
+            return
+
+        data = io.StringIO()
+        for row in rows:
+            data.write(csv_line([row.get(key) for key in keys]))
+        data.seek(0)
+
+        query = 'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)'.format(
+            table=quote_table(self.table),
+            columns=', '.join(quote_ident(column) for key, column in columns))
+
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(query, data)
+
+    def insert(self, rows, columns):
+        if self.insert_plan is None:
+            types = self.get_column_types([column for key, column in columns])
+
+            query = 'INSERT INTO {table} ({columns}) SELECT * FROM unnest({arrays})'.format(  # noqa
+                table=quote_table(self.table),
+                columns=', '.join(quote_ident(column) for key, column in columns),
+                arrays=', '.join(
+                    f'${index}'
+                    for index in range(1, len(columns) + 1)))
+
+            self.insert_plan = self.plpy.prepare(
+                query,
+                [f'{types[column]}[]' for key, column in columns])
+
+        self.plpy.execute(self.insert_plan, [
+            [row.get(key) for row in rows]
+            for key, column in columns
+        ])
+
+    def get_column_types(self, columns):
+        """Return the type of each column of the table."""
+        plan = self.plpy.prepare(
+            """
+                SELECT attname as name, format_type(atttypid, atttypmod) as type
+                FROM pg_attribute
+                WHERE attrelid = $1::regclass
+                    and attnum > 0
+                    and not attisdropped
+            """,
+            ['text'])
+
+        types = {
+            row['name']: row['type']
+            for row in self.plpy.execute(plan, [quote_table(self.table)])
+        }
+
+        for column in columns:
+            if column not in types:
+                raise ValueError(f"column '{column}' not present in table {self.table}")  # noqa
+        return types
+
+
+def quote_ident(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def quote_table(table):
+    return '.'.join(quote_ident(name) for name in table.split('.'))
+
+
+def csv_line(values):
+    """Return a line of COPY's csv format.
+
+    Every value is quoted, but None: an unquoted empty value is a NULL.
+    """
+    return ','.join(
+        '' if value is None else '"{}"'.format(str(value).replace('"', '""'))
+        for value in values
+    ) + '\n'
@@ -0,0 +1,158 @@
+import functools
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@functools.lru_cache(maxsize=None)
+def row_class(fields):
+    """The namedtuple class of the rows of a payload, created once per fields."""
+    return namedtuple('Result', fields)
+
+
+class ColumnarPayload():
+    """
+    Results of a query, stored as one list per field.
+
+    Numeric fields can be backed by a NumPy array (if NumPy is installed),
+    so derived columns can be computed in one vectorised operation.
+
+    A payload behaves like a list of rows: iterating or indexing it builds
+    a namedtuple view of a row, on demand. SmartExcel reads the columns
+    directly when it can (see `compile_definition`).
+    """
+
+    def __init__(self, fields, columns, numeric_fields=()):
+        """
+        :param fields: the names of the fields.
+        :type fields: list
+
+        :param columns: a list of values per field.
+        :type columns: list of list
+
+        :param numeric_fields: fields to store in a NumPy array.
+        :type numeric_fields: list
+        """
+        self.fields = tuple(fields)
+        self.columns = dict(zip(self.fields, columns))
+
+        self.length = len(columns[0]) if columns else 0
+
+        for field in numeric_fields:
+            if field in self.columns:
+                self.columns[field] = to_array(self.columns[field])
+
+    @classmethod
+    def from_rows(cls, fields, rows, numeric_fields=()):
+        """Build a payload from rows (tuples of values)."""
+        columns = [list(column) for column in zip(*rows)]
+        if not columns:
+            columns = [[] for field in fields]
+        return cls(fields, columns, numeric_fields)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        Row = row_class(self.fields)
+        columns = [self.columns[field] for field in self.fields]
+        for index in range(0, self.length):
+            yield Row(*[column[index] for column in columns])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # a payload of the rows of the slice (NumPy arrays are sliced
+            # as views)
+            return ColumnarPayload(self.fields, [
+                self.columns[field][index]
+                for field in self.fields
+            ])
+
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('payload index out of range')
+
+        return row_class(self.fields)(*[
+            self.columns[field][index]
+            for field in self.fields
+        ])
+
+    def __repr__(self):
+        return f'<ColumnarPayload {list(self.fields)} ({self.length} rows)>'
+
+    def column(self, field):
+        """Return the list (or NumPy array) of the values of `field`."""
+        if not self.length:
+            return []
+        return self.columns[field]
+
+    def values(self, field):
+        """Return the values of `field` as a list of Python objects."""
+        column = self.column(field)
+        if numpy is not None and isinstance(column, numpy.ndarray):
+            return column.tolist()
+        return column
+
+    def take(self, indices):
+        """Return a payload of the rows at `indices`, in this order."""
+        columns = []
+        for field in self.fields:
+            column = self.columns[field]
+            if numpy is not None and isinstance(column, numpy.ndarray):
+                columns.append(column[list(indices)])
+            else:
+                columns.append([column[index] for index in indices])
+        return ColumnarPayload(self.fields, columns)
+
+    def group_by(self, field):
+        """Split the rows by their value of `field`.
+
+        Returns a dict: value => payload of the rows with this value, in
+        their order.
+        """
+        indices = {}
+        for index, value in enumerate(self.values(field)):
+            indices.setdefault(value, []).append(index)
+
+        return {
+            value: self.take(rows)
+            for value, rows in indices.items()
+        }
+
+    def arrays(self, *fields):
+        """Return the NumPy arrays of `fields`, or None if one is not an array."""
+        if numpy is None:
+            return None
+
+        arrays = [self.column(field) for field in fields]
+        if all(isinstance(array, numpy.ndarray) for array in arrays):
+            return arrays
+        return None
+
+
+def to_array(values):
+    """Convert a list of numbers to a NumPy array.
+
+    The list is kept as is without NumPy or if it holds anything other than
+    only ints or only floats (None, Decimal...), so no value is altered.
+    An array is returned as is.
+    """
+    if numpy is None or isinstance(values, numpy.ndarray) or not values:
+        return values
+
+    types = set(map(type, values))
+    if types != {int} and types != {float}:
+        return values
+
+    try:
+        array = numpy.asarray(values)
+    except OverflowError:
+        return values
+
+    if array.dtype == object:
+        return values
+    return array
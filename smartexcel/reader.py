@@ -0,0 +1,362 @@
+import codecs
+import functools
+import html
+import posixpath
+import re
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils.cell import column_index_from_string, get_column_letter
+
+from .sinks import CHUNK_SIZE
+
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+TEXT = f'{MAIN_NS}t'
+RICH_TEXT_RUN = f'{MAIN_NS}r'
+SHARED_STRING = f'{MAIN_NS}si'
+
+# The cells of the sheets are not parsed as XML, but scanned: they are
+# written by xlsxwriter (or Excel) in this exact form. Any other form
+# makes the sheet unsupported.
+DIMENSION_RE = re.compile(r'<dimension ref="([^"]+)"')
+ROW_RE = re.compile(r'<row r="([0-9]+)"')
+CELL_PATTERN = (
+    r'<c r="({letters})([0-9]+)"(?: s="([0-9]+)")?(?: t="([a-zA-Z]+)")?'
+    r'(?:/>|>(?:<f>([^<]*)</f>)?(?:<v>([^<]*)</v>)?'
+    r'(?:<is><t(?: xml:space="preserve")?>([^<]*)</t></is>)?</c>)')
+CELL_RE = re.compile(CELL_PATTERN.format(letters='[A-Z]+'))
+SHARED_STRING_RE = re.compile(r'<si><t(?: xml:space="preserve")?>([^<]*)</t></si>')
+
+
+class UnsupportedWorkbook(Exception):
+    """The workbook (or a cell of it) can't be read by the XlsxReader."""
+
+
+class XlsxReader():
+    """
+    Read the values of the sheets of a xlsx, straight from its XML.
+
+    Made for the templates written by SmartExcel: plain values (numbers,
+    strings, booleans, formulas). The values are the ones openpyxl gives
+    in read-only mode (`iter_rows(values_only=True)`). Anything else
+    raises UnsupportedWorkbook, when the workbook is opened or when the
+    cell is read, so the caller can use openpyxl instead.
+
+    The sheets are used like openpyxl's read-only worksheets:
+        reader['Sheet1'].iter_rows(min_row=2, values_only=True)
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the path to a xlsx file, or a file object.
+        """
+        try:
+            self.zip = zipfile.ZipFile(path)
+        except zipfile.BadZipFile as e:
+            raise UnsupportedWorkbook(str(e))
+
+        try:
+            self.read_workbook()
+            self.date_styles = self.read_date_styles()
+        except (KeyError, SyntaxError) as e:
+            self.zip.close()
+            raise UnsupportedWorkbook(str(e))
+
+        self.shared_strings = None
+
+    def read_workbook(self):
+        targets = {
+            rel.get('Id'): (rel.get('Type'), self.part_path(rel.get('Target')))
+            for event, rel in iterparse(self.zip.open('xl/_rels/workbook.xml.rels'))
+            if rel.tag == f'{PACKAGE_REL_NS}Relationship'
+        }
+
+        self.sheets = {}
+        self.sheetnames = []
+        for event, element in iterparse(self.zip.open('xl/workbook.xml')):
+            if element.tag == f'{MAIN_NS}sheet':
+                name = element.get('name')
+                self.sheetnames.append(name)
+                self.sheets[name] = targets[element.get(f'{REL_NS}id')][1]
+
+        if not self.sheetnames:
+            # strict OOXML, or not a workbook
+            raise UnsupportedWorkbook('No sheets found.')
+
+        self.parts = {
+            rel_type.rsplit('/', 1)[-1]: path
+            for rel_type, path in targets.values()
+        }
+
+    def part_path(self, target):
+        if target.startswith('/'):
+            return target[1:]
+        return posixpath.normpath(posixpath.join('xl', target))
+
+    def read_date_styles(self):
+        """Return the indices of the styles (xf) formatting numbers as dates.
+
+        openpyxl converts the numbers of these cells to datetimes.
+        """
+        if 'styles' not in self.parts:
+            return frozenset()
+
+        custom_formats = {}
+        date_styles = set()
+        in_cell_xfs = False
+        index = 0
+
+        for event, element in iterparse(
+                self.zip.open(self.parts['styles']),
+                events=('start', 'end')):
+            if element.tag == f'{MAIN_NS}numFmt' and event == 'end':
+                custom_formats[int(element.get('numFmtId'))] = element.get('formatCode')
+            elif element.tag == f'{MAIN_NS}cellXfs':
+                in_cell_xfs = event == 'start'
+            elif element.tag == f'{MAIN_NS}xf' and in_cell_xfs and event == 'end':
+                format_id = int(element.get('numFmtId', 0))
+                code = custom_formats.get(format_id, BUILTIN_FORMATS.get(format_id))
+                if code and is_date_format(code):
+                    date_styles.add(index)
+                index += 1
+
+        return frozenset(date_styles)
+
+    def read_shared_strings(self):
+        """Return the shared strings, as openpyxl reads them."""
+        if 'sharedStrings' not in self.parts:
+            return []
+
+        with self.zip.open(self.parts['sharedStrings']) as fd:
+            content = fd.read().decode('utf-8')
+
+        strings = SHARED_STRING_RE.findall(content)
+        if len(strings) == content.count('<si>'):
+            # only plain strings
+            return [
+                unescape(string).replace('x005F_', '')
+                for string in strings
+            ]
+
+        strings = []
+        for event, element in iterparse(self.zip.open(self.parts['sharedStrings'])):
+            if element.tag == SHARED_STRING:
+                strings.append(rich_text(element).replace('x005F_', ''))
+                element.clear()
+        return strings
+
+    def __getitem__(self, name):
+        if name not in self.sheets:
+            raise KeyError(f'Worksheet {name} does not exist.')
+        return ReaderSheet(self, name)
+
+    def close(self):
+        self.zip.close()
+
+    def iter_rows(self, name, min_row=1, max_row=None, columns=None):
+        """Yield the values of the rows of the sheet `name`, as tuples.
+
+        Like openpyxl, the rows are as wide as the dimension of the sheet,
+        and the missing rows are yielded, empty (up to `max_row`, or to the
+        last row of the sheet).
+
+        :param columns: the indices (from 1) of the columns to read: the
+        rows hold the values of these columns only, in this order. The
+        cells of the other columns are skipped, not converted.
+        :type columns: list
+        """
+        if self.shared_strings is None:
+            self.shared_strings = self.read_shared_strings()
+
+        width = None
+        positions = None
+        next_row = 1
+
+        for content in iter_sheet_data(self.zip.open(self.sheets[name])):
+            if width is None:
+                # the head of the sheet, before sheetData
+                match = DIMENSION_RE.search(content)
+                if match is None:
+                    raise UnsupportedWorkbook('No dimension found.')
+                width, last_row = dimension(match.group(1))
+                if max_row is None:
+                    max_row = last_row
+
+                # column letter => position in the rows
+                if columns is None:
+                    columns = range(1, width + 1)
+                positions = {
+                    get_column_letter(column): position
+                    for position, column in enumerate(columns)
+                }
+                if len(columns) < width:
+                    # the cells of the other columns are not even matched.
+                    cell_re, cell_start_re = projection_res(tuple(positions))
+                else:
+                    cell_re, cell_start_re = CELL_RE, None
+                width = len(columns)
+                continue
+
+            rows = ROW_RE.findall(content)
+            cells = cell_re.findall(content)
+            if cell_start_re is None:
+                n_cells = content.count('<c ')
+            else:
+                n_cells = len(cell_start_re.findall(content))
+            if len(rows) != content.count('<row') or len(cells) != n_cells:
+                raise UnsupportedWorkbook('Unknown rows or cells.')
+
+            position = 0
+            count = len(cells)
+            for row in rows:
+                index = int(row)
+                if index > max_row:
+                    for missing in range(max(next_row, min_row), max_row + 1):
+                        yield (None,) * width
+                    return
+
+                values = [None] * width
+                while position < count and cells[position][1] == row:
+                    if index >= min_row:
+                        self.read_cell(cells[position], values, positions)
+                    position += 1
+
+                if index >= min_row:
+                    if index > next_row:
+                        # the missing rows
+                        for missing in range(max(next_row, min_row), index):
+                            yield (None,) * width
+
+                    yield tuple(values)
+
+                next_row = index + 1
+
+            if position != count:
+                raise UnsupportedWorkbook('Cells outside of their rows.')
+
+    def read_cell(self, cell, values, positions):
+        """Set the value of a (scanned) `cell` in the `values` of its row.
+
+        :param positions: column letter => position in `values`.
+        """
+        letters, row, style, data_type, formula, value, text = cell
+
+        position = positions.get(letters)
+        if position is None:
+            return
+
+        if formula:
+            value = f'={unescape(formula)}'
+        elif data_type == 'inlineStr':
+            value = unescape(text)
+        elif not value:
+            return
+        elif data_type == '' or data_type == 'n':
+            if style and int(style) in self.date_styles:
+                raise UnsupportedWorkbook('Dates are not supported.')
+            value = cast_number(value)
+        elif data_type == 's':
+            value = self.shared_strings[int(value)]
+        elif data_type == 'b':
+            value = bool(int(value))
+        elif data_type == 'str' or data_type == 'e':
+            value = unescape(value)
+        else:
+            raise UnsupportedWorkbook(f'Unknown cell type {data_type}.')
+
+        values[position] = value
+
+
+class ReaderSheet():
+    """A sheet of a XlsxReader, read like an openpyxl read-only worksheet."""
+
+    def __init__(self, reader, name):
+        self.reader = reader
+        self.title = name
+
+    def iter_rows(self, min_row=1, max_row=None, values_only=False, columns=None):
+        if not values_only:
+            raise UnsupportedWorkbook('Only values can be read.')
+        return self.reader.iter_rows(self.title, min_row, max_row, columns)
+
+
+def rich_text(element):
+    """The text of a shared or inline string, without its phonetic runs."""
+    texts = []
+    for child in element:
+        if child.tag == TEXT:
+            texts.append(child.text or '')
+        elif child.tag == RICH_TEXT_RUN:
+            texts.append(child.findtext(TEXT) or '')
+    return ''.join(texts)
+
+
+def cast_number(value):
+    """Convert a number, as openpyxl does."""
+    if '.' in value or 'E' in value or 'e' in value:
+        return float(value)
+    return int(value)
+
+
+def unescape(text):
+    """Replace the character references of a XML text."""
+    if '&' not in text:
+        return text
+    return html.unescape(text)
+
+
+@functools.lru_cache(maxsize=16)
+def projection_res(letters):
+    """Return the regular expressions matching the cells of the columns
+    `letters`, and the start of these cells."""
+    letters = '|'.join(letters)
+    return (
+        re.compile(CELL_PATTERN.format(letters=letters)),
+        re.compile(f'<c r="(?:{letters})[0-9]'))
+
+
+def iter_sheet_data(fd, chunk_size=CHUNK_SIZE):
+    """
+    Yield the head of a sheet (the XML before its sheetData), then its
+    data, in pieces of whole rows.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    in_head = True
+
+    with fd:
+        while True:
+            chunk = fd.read(chunk_size)
+            buffer += decoder.decode(chunk, final=not chunk)
+
+            if in_head:
+                start = buffer.find('<sheetData')
+                if start == -1:
+                    if not chunk:
+                        raise UnsupportedWorkbook('No sheet data found.')
+                    continue
+                yield buffer[:start]
+                buffer = buffer[start:]
+                in_head = False
+
+            if not chunk:
+                yield buffer
+                return
+
+            end = buffer.rfind('</row>')
+            if end != -1:
+                end += len('</row>')
+                yield buffer[:end]
+                buffer = buffer[end:]
+
+
+def dimension(ref):
+    """Return the (number of columns, number of rows) of a dimension."""
+    last = ref.split(':')[-1]
+    letters = last.rstrip('0123456789')
+    return column_index_from_string(letters), int(last[len(letters):])
@@ -0,0 +1,238 @@
+import io
+import tempfile
+
+
+# size of the pieces the sinks are read and written by
+CHUNK_SIZE = 1024 * 1024
+
+
+class OutputSink(io.RawIOBase):
+    """
+    Where a xlsx is written to: pass a sink as the `output` of SmartExcel.
+
+    The zip archive of the xlsx is written to the sink as it is built,
+    then it can be read back in chunks: the whole xlsx is never held in
+    memory as one bytes object.
+    """
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read_chunks(self, chunk_size=CHUNK_SIZE):
+        """Yield the content of the sink, in pieces of `chunk_size` bytes."""
+        raise NotImplementedError
+
+    def copy_to(self, fd, chunk_size=CHUNK_SIZE):
+        """Copy the content of the sink to the file object `fd`."""
+        for chunk in self.read_chunks(chunk_size):
+            fd.write(chunk)
+
+
+class FileSink(OutputSink):
+    """The xlsx is written to a file (`path`)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = self.open()
+
+    def open(self):
+        return open(self.path, 'w+b')
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+    def read_chunks(self, chunk_size=CHUNK_SIZE):
+        self.file.flush()
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class SpooledSink(FileSink):
+    """
+    The xlsx is written to memory, then to a temporary file once it is
+    bigger than `max_size` bytes.
+    """
+
+    def __init__(self, max_size=16 * 1024 * 1024):
+        self.max_size = max_size
+        super().__init__(None)
+
+    def open(self):
+        return tempfile.SpooledTemporaryFile(max_size=self.max_size)
+
+
+class ChunkedSink(OutputSink):
+    """
+    The xlsx is written in pieces of `chunk_size` bytes, by `write_chunk`.
+
+    The zip archive is not written sequentially: the header of each file
+    is written again once the file is compressed. The last written bytes
+    are buffered, so most of these rewrites happen in the buffer.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+        self.buffer = bytearray()
+        # offset of the buffer in the sink
+        self.offset = 0
+        self.position = 0
+        self.size = 0
+
+    def write_chunk(self, offset, data):
+        """Write `data` at `offset` of the destination."""
+        raise NotImplementedError
+
+    def write(self, data):
+        # `data` is sliced, not copied
+        data = memoryview(data).cast('B')
+        length = len(data)
+        position = self.position
+
+        if position < self.offset:
+            # before the buffer: already written.
+            head = data[:self.offset - position]
+            self.write_chunks(position, head)
+            position += len(head)
+            data = data[len(head):]
+
+        if data:
+            if position > self.offset + len(self.buffer):
+                self.flush()
+                self.offset = position
+
+            # over the buffer
+            start = position - self.offset
+            inside = data[:len(self.buffer) - start]
+            self.buffer[start:start + len(inside)] = inside
+            position += len(inside)
+            data = data[len(inside):]
+
+        if data:
+            # after the buffer
+            self.append(data)
+            position += len(data)
+
+        self.position = position
+        self.size = max(self.size, position)
+
+        return length
+
+    def append(self, data):
+        """Append `data` to the buffer.
+
+        Only the last `chunk_size` bytes are kept in the buffer, once it
+        would hold twice as much: the bytes before are written, the ones
+        of `data` straight from it.
+        """
+        total = len(self.buffer) + len(data)
+        if total < 2 * self.chunk_size:
+            self.buffer += data
+            return
+
+        written = total - self.chunk_size
+        if written <= len(self.buffer):
+            self.write_chunks(self.offset, self.buffer[:written])
+            del self.buffer[:written]
+            self.offset += written
+            self.buffer += data
+        else:
+            # the whole buffer, then the head of `data`
+            head = written - len(self.buffer)
+            self.flush()
+            self.write_chunks(self.offset, data[:head])
+            self.offset += head
+            self.buffer = bytearray(data[head:])
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+
+        if offset < 0:
+            raise ValueError(f'negative seek position {offset}')
+
+        self.position = offset
+        return offset
+
+    def tell(self):
+        return self.position
+
+    def write_chunks(self, offset, data):
+        """Write `data` at `offset`, in pieces of `chunk_size` bytes."""
+        for start in range(0, len(data), self.chunk_size):
+            self.write_chunk(offset + start, bytes(data[start:start + self.chunk_size]))
+
+    def flush(self):
+        self.write_chunks(self.offset, self.buffer)
+
+        self.offset += len(self.buffer)
+        self.buffer.clear()
+
+
+class LargeObjectSink(ChunkedSink):
+    """
+    The xlsx is written to a PostgreSQL large object, `oid`.
+
+    Use either a psycopg2 `connection` or, in a pl/python function,
+    the `plpy` module.
+    """
+
+    def __init__(self, connection=None, plpy=None, chunk_size=CHUNK_SIZE):
+        super().__init__(chunk_size)
+
+        self.connection = connection
+        self.plpy = plpy
+
+        if plpy:
+            self.oid = plpy.execute('SELECT lo_create(0) as oid')[0]['oid']
+            self.put_plan = plpy.prepare(
+                'SELECT lo_put($1, $2, $3)', ['oid', 'bigint', 'bytea'])
+            self.get_plan = plpy.prepare(
+                'SELECT lo_get($1, $2, $3) as chunk', ['oid', 'bigint', 'integer'])
+        else:
+            self.lobject = connection.lobject(0, 'rwb')
+            self.oid = self.lobject.oid
+
+    def write_chunk(self, offset, data):
+        if self.plpy:
+            self.plpy.execute(self.put_plan, [self.oid, offset, data])
+        else:
+            self.lobject.seek(offset)
+            self.lobject.write(data)
+
+    def read_chunks(self, chunk_size=CHUNK_SIZE):
+        self.flush()
+        for offset in range(0, self.size, chunk_size):
+            if self.plpy:
+                yield bytes(self.plpy.execute(
+                    self.get_plan, [self.oid, offset, chunk_size])[0]['chunk'])
+            else:
+                self.lobject.seek(offset)
+                yield self.lobject.read(chunk_size)
+
+    def close(self):
+        super().close()
+        if not self.plpy:
+            self.lobject.close()
@@ -1,8 +1,33 @@
-import copy
+import functools
+import hashlib
+import inspect
+import io
+import json
+import operator
 import xlsxwriter
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
 from openpyxl import load_workbook
+from openpyxl.utils.cell import coordinate_to_tuple
+from types import MappingProxyType
+import datetime
 import math
+import multiprocessing
+import numbers
+import os
+import shutil
+import threading
 
+from .cache import SheetCache
+from .payload import ColumnarPayload
+from .reader import UnsupportedWorkbook, XlsxReader
+from .sinks import CHUNK_SIZE
+from .validation import ColumnValidator
+from .workbook import Workbook, can_fork
+
+
+# rows of a table whose values are computed, then written, at once
+TABLE_BLOCK_SIZE = 1000
 
 SMART_EXCEL_CONFIG = {
     'sheet_names': ['Sheet1', '_data', '_meta'],
@@ -28,7 +53,9 @@ class SmartExcel():
     header_row = 1
     max_row = 100
     margin_component = 1
-    reserved_sheets = ['_data', '_meta']
+    meta_worksheet_name = '_meta'
+    data_worksheet_name = '_data'
+    reserved_sheets = [data_worksheet_name, meta_worksheet_name]
     READMODE = False
     WRITEMODE = False
 
@@ -37,12 +64,17 @@ class SmartExcel():
             definition=None,
             data=None,
             path=None,
-            output='template.xlsx'):
+            output='template.xlsx',
+            streaming=False,
+            workers=None,
+            cache_dir=None,
+            report_cache=None,
+            compression='default'):
         """
         Init a new instance of the SmartExcel class.
 
-        :param definition: A definition of the xlsx (headers, columns, validations).
-        :type definition: list
+        :param definition: A definition of the xlsx (headers, columns, validations), or its compiled form.
+        :type definition: list or CompiledDefinition
 
         :param data: An helper class to retrieve data based on the definition.
         :type data: object
@@ -51,7 +83,22 @@ class SmartExcel():
         :type path: string
 
         :param output: The output of a xlsx file. Only in WRITEMODE.
-        :type output: str or io.BytesIO()
+        :type output: str, io.BytesIO() or OutputSink
+
+        :param streaming: Parse each sheet just before it is rendered, and write its rows to disk as they are rendered, so memory stays flat. Only in WRITEMODE.
+        :type streaming: bool
+
+        :param workers: Number of processes assembling the worksheets in parallel (needs `fork`, not for pl/python). Only in WRITEMODE.
+        :type workers: int
+
+        :param cache_dir: Directory of the sheets rendered by the previous dump: the unchanged ones are not rendered again. Use one directory per report. Only in WRITEMODE.
+        :type cache_dir: str
+
+        :param report_cache: The reports already generated (see `FileReportCache`): if the data model's fingerprint did not change, the stored report is returned by `dump`. Only in WRITEMODE.
+        :type report_cache: FileReportCache
+
+        :param compression: How the xlsx is compressed: 'fastest', 'default', 'smallest' or 'store' (see `COMPRESSION_PROFILES`). Only in WRITEMODE.
+        :type compression: str
         """  # noqa
 
         assert definition and data
@@ -68,103 +115,656 @@ class SmartExcel():
             self.init_read_mode(definition, path)
         else:
             self.WRITEMODE = True
-            self.init_write_mode(definition, output)
+            self.init_write_mode(
+                definition,
+                output,
+                streaming,
+                workers,
+                cache_dir,
+                report_cache,
+                compression)
 
 
     def init_read_mode(self, definition, path):
         """
         Init in READMODE.
+
+        The xlsx is read straight from its XML (see `XlsxReader`), or in
+        openpyxl's read-only mode when the reader does not support it:
+        rows are read one at a time from the file, as they are parsed.
         """
-        self.build_columns_from_definition(definition)
+        self.path = path
+        self.accessors = {}
+        self.list_sources = {}
 
-        self.workbook = load_workbook(path)
+        self.build_columns_from_definition(definition)
 
-        self.meta_config = check_meta_config(self.workbook)
+        self.workbook = self.open_workbook()
+        try:
+            try:
+                self.check_workbook(self.workbook)
+            except UnsupportedWorkbook:
+                self.workbook.close()
+                self.workbook = self.open_workbook(reader=False)
+                self.check_workbook(self.workbook)
+        finally:
+            self.workbook.close()
+
+    def check_workbook(self, workbook):
+        if 'recursive' in self.table:
+            # the generated sheets are checked as they are parsed (see
+            # `parse_hierarchy`).
+            self.meta_config = check_meta_config(workbook, generated_sheets=True)
+            return
+
+        self.meta_config = check_meta_config(workbook)
 
         header = [c['name'] for c in self.columns]
 
         check_header(
-            self.workbook['Sheet1'],
+            workbook['Sheet1'],
             header,
             self.meta_config['header_row'])
 
-    def init_write_mode(self, definition, output):
+    def open_workbook(self, reader=True):
+        """Open the xlsx with a XlsxReader, or with openpyxl (read-only) if
+        the reader does not support it, or if `reader` is False."""
+        if hasattr(self.path, 'seek'):
+            self.path.seek(0)
+
+        if reader:
+            try:
+                return XlsxReader(self.path)
+            except UnsupportedWorkbook:
+                if hasattr(self.path, 'seek'):
+                    self.path.seek(0)
+
+        return load_workbook(self.path, read_only=True)
+
+    def build_columns_from_definition(self, definition):
+        """Build the columns to parse: the columns of the first table of the
+        first sheet of the definition.
+
+        See `build_columns`.
+        """
+        if isinstance(definition, CompiledDefinition):
+            definition = definition.elements
+
+        try:
+            self.sheet_definition = next(
+                element
+                for element in definition
+                if element['type'] == 'sheet')
+            self.table = get_table(self.sheet_definition['components'])
+        except (IndexError, KeyError, StopIteration):
+            raise ValueError('The first sheet of the definition must have a table component.')  # noqa
+
+        self.columns = self.build_columns(self.table)
+
+    def build_columns(self, table):
+        """Build the columns to parse of a table definition.
+
+        The values of a column are parsed under its `key` (by default, its
+        `data_func`), suffixed by `--<index>` for the repeated columns.
+
+        The columns with `validations` get a `ColumnValidator`. The values
+        of a `list_source_func` are read once, per function.
+        """
+        columns = self.parse_columns(
+            table['columns'],
+            table.get('repeat', 1))
+
+        for column in columns:
+            key = column.get('key', column['data_func'])
+            if column['index'] > 0:
+                key = f"{key}--{column['index']}"
+            column['key'] = key
+
+            if 'validations' not in column:
+                continue
+
+            list_source_func = column['validations'].get('list_source_func')
+            if list_source_func and list_source_func not in self.list_sources:
+                self.list_sources[list_source_func] = self.get_accessor(
+                    self.data, list_source_func)()
+
+            column['validator'] = ColumnValidator(
+                column['validations'],
+                self.list_sources.get(list_source_func))
+
+        return columns
+
+    def init_write_mode(self, definition, output, streaming=False, workers=None, cache_dir=None, report_cache=None, compression='default'):
         """
         Init in WRITEMODE.
+
+        In streaming mode, xlsxwriter's `constant_memory` option is used:
+        rows are written to a temporary file as soon as a following row is
+        written, so every sheet must be rendered in ascending row order.
+        The sheets are parsed (payloads, images) one at a time, as they are
+        rendered by `dump`.
+
+        With `workers`, the XML of the worksheets is assembled by a pool
+        of processes when the workbook is closed (see `Workbook`).
+
+        With `cache_dir`, the XML of the sheets whose inputs did not change
+        since the previous dump is reused (see `use_sheet_cache`).
+
+        With `report_cache`, the report is looked up before the definition
+        is parsed (see `get_report_key`): on a hit, nothing is queried nor
+        rendered.
         """
 
         self.output = output
-        self.workbook = xlsxwriter.Workbook(self.output)
+        self.streaming = streaming
+        self.compression = compression
+        self.plan = self.get_plan(definition)
+        # the methods of the data model, bound on their first call
+        self.accessors = {}
+
+        self.report_cache = report_cache
+        self.report_key = None
+        self.cached_report = None
+        if report_cache is not None:
+            self.report_key = self.get_report_key()
+            if self.report_key is not None:
+                self.cached_report = report_cache.get(self.report_key)
+            if self.cached_report is not None:
+                return
+
+        self.sheet_cache = SheetCache(cache_dir) if cache_dir else None
+        self.workbook = Workbook(
+            self.output,
+            {'constant_memory': streaming},
+            workers=workers,
+            sheet_cache=self.sheet_cache,
+            compression=compression)
+        self.format_registry = FormatRegistry(self.workbook)
+
+        self.bind_accessors()
 
         self.add_reserved_sheets()
 
-        self.parse_definition(definition)
+        # in streaming mode, each sheet is parsed just before it is
+        # rendered (see `dump`).
+        self.pending_sheets = self.iter_definition(self.plan.elements)
+        if not streaming:
+            for sheet_key in self.pending_sheets:
+                pass
+
+    def get_report_key(self):
+        """Return the key of the report in the report cache.
+
+        The data model gives a fingerprint of its data with a
+        `get_report_fingerprint` method. Without it, or if it returns None,
+        the report is not cached. The options changing the bytes of the
+        report (streaming, compression) are part of the key.
+        """
+        if not hasattr(self.data, 'get_report_fingerprint'):
+            return None
+
+        fingerprint = self.call('get_report_fingerprint')
+        if fingerprint is None:
+            return None
+
+        digest = hashlib.sha1()
+        update_digest(digest, [
+            xlsxwriter.__version__,
+            self.plan.key,
+            type(self.data).__qualname__,
+            self.header_row,
+            self.margin_component,
+            self.streaming,
+            self.compression,
+            fingerprint
+        ])
+        return digest.hexdigest()
+
+    def get_plan(self, definition):
+        """Return the compiled form of `definition` for the data model.
+
+        A definition is compiled once per process (see `compile_definition`).
+        """
+        if isinstance(definition, CompiledDefinition):
+            if not isinstance(self.data, definition.data_model_class):
+                raise ValueError(
+                    f'{self.data} is not an instance of {definition.data_model_class}.')  # noqa
+            return definition
+
+        return compile_definition(definition, type(self.data))
+
+    def bind_accessors(self):
+        """Build the table of `write_*` methods, bound to the data model.
+
+        This table is built once, when the definition is bound to the data
+        model: a method missing from the data model raises here.
+
+        A `write_<data_func>__column` method (see `compile_definition`)
+        returns the values of a whole column in one call.
+        """
+        self.accessors = {}
+        for func in self.plan.writers:
+            column_func = f'{func}__column'
+
+            if func not in self.plan.accessors and column_func not in self.plan.accessors:
+                raise Exception(f'method \'{func}\' not present in {self.data} class')  # noqa
+
+            for name in [func, column_func]:
+                if name in self.plan.accessors:
+                    self.accessors[name] = bind_accessor(self.plan.accessors[name], self.data)
+
+    def call(self, func, *args, **kwargs):
+        """Call the method `func` of the data model.
+
+        The method is resolved when the definition is compiled, and bound
+        to the data model on its first call.
+        """
+        method = self.accessors.get(func)
+        if method is None:
+            try:
+                method = bind_accessor(self.plan.accessors[func], self.data)
+            except KeyError:
+                return getattr(self.data, func)(*args, **kwargs)
+            self.accessors[func] = method
+        return method(*args, **kwargs)
 
 
-    def parse(self):
+    def parse(self, columns=None):
         """
         Parse a xlsx file according to the definition and returns an list of dict (rows).
+
+        The values are coerced and validated (see `iter_batches`).
+
+        :param columns: the keys of the columns to parse (see `select_columns`). By default, all of them.
+        :type columns: list
         """  # noqa
         assert self.READMODE
 
-        self.parsed_data = []
-        for row_index, row in enumerate(self.workbook['Sheet1'].values):
-            parsed_row = {}
-            if row_index < self.meta_config['header_row']:
-                continue
-            for col_index, col in enumerate(self.columns):
-                if col['index'] > 0 and col['key'].find('--') == -1:
-                    new_key = '{key}--{index}'.format(
-                        key=col['key'],
-                        index=col['index'])
-                    col['key'] = new_key
-
-                col_index_base_1 = col_index + 1
-                row_index_base_1 = row_index + 1
-                value = self.workbook['Sheet1'].cell(
-                    column=col_index_base_1,
-                    row=row_index_base_1).value
-
-                parsed_row[col['key']] = value
-
-            self.parsed_data.append(parsed_row)
+        self.parsed_data = [
+            row
+            for batch in self.iter_batches(columns=columns)
+            for row in batch
+        ]
         return self.parsed_data
 
+    def validate(self, batch_size=1000, columns=None):
+        """
+        Validate a xlsx file according to the definition, without keeping its rows.
+
+        Returns the errors found (see `iter_batches`).
+        """  # noqa
+        for batch in self.iter_batches(batch_size, columns):
+            pass
+        return self.parse_errors
+
+    def select_columns(self, keys=None):
+        """Return the columns of the given `keys`, in this order (all the
+        columns if `keys` is None)."""
+        if keys is None:
+            return self.columns
+
+        columns = {column['key']: column for column in self.columns}
+        for key in keys:
+            if key not in columns:
+                raise ValueError(f"column '{key}' not present in the definition")  # noqa
+        return [columns[key] for key in keys]
+
+    def iter_parse(self, columns=None):
+        """
+        Parse a xlsx file according to the definition and yield its rows (dict), one at a time.
+
+        The values are the raw values of the cells. If the XlsxReader meets
+        a cell it does not support, the rows are read by openpyxl from there.
+
+        :param columns: the keys of the columns to parse. The XlsxReader skips the cells of the other columns.
+        :type columns: list
+        """  # noqa
+        assert self.READMODE
+
+        columns = self.select_columns(columns)
+        keys = [column['key'] for column in columns]
+        # (from 1) the columns of the sheet to read
+        indices = [self.columns.index(column) + 1 for column in columns]
+
+        next_row = self.meta_config['header_row'] + 1
+
+        workbook = self.open_workbook()
+        try:
+            while True:
+                try:
+                    if isinstance(workbook, XlsxReader):
+                        rows = workbook['Sheet1'].iter_rows(
+                            min_row=next_row,
+                            values_only=True,
+                            columns=indices)
+                    else:
+                        rows = (
+                            tuple(row[index - 1] for index in indices)
+                            for row in workbook['Sheet1'].iter_rows(
+                                min_row=next_row,
+                                max_col=max(indices, default=1),
+                                values_only=True))
+
+                    for row in rows:
+                        yield dict(zip(keys, row))
+                        next_row += 1
+                    break
+                except UnsupportedWorkbook:
+                    workbook.close()
+                    workbook = self.open_workbook(reader=False)
+        finally:
+            workbook.close()
+
+    def iter_batches(self, batch_size=1000, columns=None):
+        """
+        Parse a xlsx file and yield its rows by lists of `batch_size` rows.
+
+        The values of the columns with `validations` are coerced and
+        validated a batch at a time (see `ColumnValidator`). An invalid
+        value is kept as it is (coerced if it could be) and reported in
+        `self.parse_errors`:
+            {
+                column key: {
+                    reason: [row numbers]
+                }
+            }
+
+        :param columns: the keys of the columns to parse (see `iter_parse`).
+        """
+        self.parse_errors = {}
+
+        selected = self.select_columns(columns)
+
+        first_row = self.meta_config['header_row'] + 1
+        batch = []
+        for row in self.iter_parse(columns):
+            batch.append(row)
+            if len(batch) == batch_size:
+                self.validate_batch(batch, first_row, selected)
+                yield batch
+                first_row += len(batch)
+                batch = []
+
+        if batch:
+            self.validate_batch(batch, first_row, selected)
+            yield batch
+
+    def validate_batch(self, batch, first_row, columns=None):
+        """Coerce and validate the `columns` of `batch`, in place.
+
+        :param first_row: the row number of the first row of the batch.
+        """
+        validate_rows(
+            self.columns if columns is None else columns,
+            batch,
+            first_row,
+            self.parse_errors)
+
+    def parse_into(self, sink, batch_size=1000, columns=None):
+        """
+        Parse a xlsx file into `sink`, `batch_size` rows at a time: only one batch is in memory.
+
+        :param sink: where the rows are loaded, with its `write_batch(rows)` method.
+        :type sink: TableLoader
+
+        :param columns: the keys of the columns to load (see `iter_parse`).
+        :type columns: list
+
+        Returns the number of rows parsed.
+        """  # noqa
+        n_rows = 0
+        for batch in self.iter_batches(batch_size, columns):
+            sink.write_batch(batch)
+            n_rows += len(batch)
+        return n_rows
+
+    def parse_hierarchy(self, workers=None):
+        """
+        Parse the sheets generated by the recursive tables of the definition (one sheet per instance of the parent's payload) and return the rows of the first table, with their children.
+
+        The generated sheets are found as `dump` names them, from the data
+        model: its `get_sheet_name_for_*` and `get_payload_*` methods are
+        called for each instance, level by level.
+
+        On each sheet, the table starts at the row holding its header, and
+        ends at the first empty row. The values are coerced and validated
+        as by `parse`; `parse_errors` is indexed by sheet name.
+
+        Each row of a level is linked to the rows of the sheet generated
+        for its instance, by the `foreign_key` of the level: a row gets
+        the `foreign_key` of its instance (unless a column has that key),
+        and the rows of its child sheet under the `payload_func` of the
+        level.
+
+        :param workers: number of processes parsing the sheets (needs
+        `fork`, and a path or a BytesIO). None (the default) parses the
+        sheets one after another, in this process.
+        :type workers: int
+        """  # noqa
+        assert self.READMODE
+
+        global _parse_hierarchy_context
+
+        levels = self.get_levels()
+        sheets = self.get_generated_sheets(levels)
+
+        parallel = can_fork(workers, len(sheets)) and (
+            isinstance(self.path, io.BytesIO) or not hasattr(self.path, 'read'))
+
+        _parse_hierarchy_context = (self, levels, sheets)
+        try:
+            if not parallel:
+                results = parse_sheets(range(0, len(sheets)))
+            else:
+                # a few chunks per process: each chunk opens the xlsx once.
+                size = math.ceil(len(sheets) / (workers * 4))
+                chunks = [
+                    range(start, min(start + size, len(sheets)))
+                    for start in range(0, len(sheets), size)
+                ]
+                context = multiprocessing.get_context('fork')
+                with context.Pool(workers) as pool:
+                    results = [
+                        result
+                        for chunk in pool.imap_unordered(parse_sheets, chunks)
+                        for result in chunk
+                    ]
+        finally:
+            _parse_hierarchy_context = None
+
+        rows = [None] * len(sheets)
+        self.parse_errors = {}
+        for index, sheet_rows, errors in results:
+            rows[index] = sheet_rows
+            if errors:
+                self.parse_errors[sheets[index].name] = errors
+
+        self.link_hierarchy(levels, sheets, rows)
+
+        self.parsed_data = rows[0]
+        return self.parsed_data
+
+    def get_levels(self):
+        """Return the tables of the definition, from the first one down its
+        `recursive` components: a list of (table, columns)."""
+        levels = []
+        table = self.table
+        while table is not None:
+            columns = self.columns if not levels else self.build_columns(table)
+            levels.append((table, columns))
+
+            if 'recursive' not in table:
+                break
+            try:
+                table = get_table(table['recursive']['components'])
+            except StopIteration:
+                table = None
+
+        return levels
+
+    def get_generated_sheets(self, levels):
+        """Return the sheets `dump` generates for the definition, in the same
+        order: a list of `GeneratedSheet`, the first sheet first."""
+        name = self.sheet_definition['name']
+        if not isinstance(name, str):
+            name = getattr(self.data, f"get_sheet_name_for_{name['func']}")()
+
+        sheets = [GeneratedSheet(name, 0, None, None, None)]
+        names = {name.lower()}
+
+        def walk(level, payload, parent):
+            table, columns = levels[level]
+            recursive = table.get('recursive')
+            if recursive is None or level + 1 == len(levels):
+                return
+
+            foreign_key = recursive['foreign_key']
+            for position, instance in enumerate(payload):
+                name = getattr(
+                    self.data,
+                    f"get_sheet_name_for_{recursive['name']['func']}")(instance)
+                if name.lower() in names:
+                    # as `dump` does
+                    name = f'{name}-1'
+                names.add(name.lower())
+
+                children = getattr(
+                    self.data,
+                    f"get_payload_{recursive['payload_func']}")(
+                        instance=instance,
+                        foreign_key=foreign_key)
+                self.data.results[recursive['payload_func']] = children
+
+                sheets.append(GeneratedSheet(
+                    name,
+                    level + 1,
+                    parent,
+                    position,
+                    get_field(instance, foreign_key)))
+
+                walk(level + 1, children, len(sheets) - 1)
+
+        walk(0, self.data.results[levels[0][0]['payload']], 0)
+        return sheets
+
+    def parse_sheets(self, levels, sheets):
+        """Parse the table of each of the (index, `GeneratedSheet`) `sheets`.
+
+        Returns a list of (index, rows, errors).
+        """
+        results = []
+        workbook = self.open_workbook()
+        fallback = None
+        try:
+            for index, sheet in sheets:
+                columns = levels[sheet.level][1]
+                try:
+                    rows, errors = self.parse_table_of_sheet(workbook[sheet.name], columns)
+                except UnsupportedWorkbook:
+                    if fallback is None:
+                        fallback = self.open_workbook(reader=False)
+                    rows, errors = self.parse_table_of_sheet(fallback[sheet.name], columns)
+                results.append((index, rows, errors))
+        finally:
+            workbook.close()
+            if fallback is not None:
+                fallback.close()
+
+        return results
+
+    def parse_table_of_sheet(self, sheet, columns):
+        """Parse the table of `columns` of a sheet: from its header row to
+        the first empty row.
+
+        Returns the rows and the errors (see `validate_rows`).
+        """
+        header = tuple(column['name'] for column in columns)
+        keys = [column['key'] for column in columns]
+        n_keys = len(keys)
+
+        rows = sheet.iter_rows(values_only=True)
+        for header_row, row in enumerate(rows, 1):
+            if row[:n_keys] == header:
+                break
+        else:
+            raise Exception(f"Header definitions do not match in sheet '{sheet.title}'.")  # noqa
+
+        parsed = []
+        for row in rows:
+            row = row[:n_keys]
+            if all(value is None for value in row):
+                break
+            if len(row) < n_keys:
+                row = row + (None,) * (n_keys - len(row))
+            parsed.append(dict(zip(keys, row)))
+
+        errors = {}
+        validate_rows(columns, parsed, header_row + 1, errors)
+        return parsed, errors
+
+    def link_hierarchy(self, levels, sheets, rows):
+        """Give each parsed row the rows of its child sheet.
+
+        :param rows: the parsed rows of each of the `sheets`.
+        """
+        # parent sheet => {foreign key: rows of the child sheet}
+        children = {}
+        # parent sheet => {position of the instance: foreign key}
+        keys = {}
+        for index, sheet in enumerate(sheets):
+            if sheet.parent is None:
+                continue
+            children.setdefault(sheet.parent, {})[sheet.foreign_key] = rows[index]
+            keys.setdefault(sheet.parent, {})[sheet.position] = sheet.foreign_key
+
+        for index, sheet in enumerate(sheets):
+            table = levels[sheet.level][0]
+            if sheet.level + 1 == len(levels):
+                continue
+
+            foreign_key = table['recursive']['foreign_key']
+            children_key = table['recursive']['payload_func']
+            for position, row in enumerate(rows[index]):
+                if foreign_key not in row:
+                    row[foreign_key] = keys.get(index, {}).get(position)
+                row[children_key] = children.get(index, {}).get(row[foreign_key], [])
+
     def dump(self):
         """
         Dump (render) data into a xlsx file according to the definition.
         """
         assert self.WRITEMODE
 
-        # First, we create the user sheets
-        for sheet_key, sheet_data in self.sheets.items():
-            if not sheet_data['reserved']:
-                try:
-                    sheet_data['fd'] = self.workbook.add_worksheet(sheet_data['name'])
-                except xlsxwriter.exceptions.DuplicateWorksheetName:
-                    sheet_data['fd'] = self.workbook.add_worksheet(f"{sheet_data['name']}-1")
+        if self.cached_report is not None:
+            self.write_output(self.cached_report)
+            return
 
-        # Then, we create the reserved sheets
-        for sheet_key, sheet_data in self.sheets.items():
-            if sheet_data['reserved']:
+        if self.streaming:
+            sheet_keys = self.pending_sheets
+        else:
+            sheet_keys = [
+                sheet_key
+                for sheet_key, sheet_data in self.sheets.items()
+                if not sheet_data['reserved']
+            ]
+
+        # First, we create and render the user sheets
+        for sheet_key in sheet_keys:
+            sheet_data = self.sheets[sheet_key]
+            try:
                 sheet_data['fd'] = self.workbook.add_worksheet(sheet_data['name'])
-                sheet_data['fd'].protect()
-                getattr(
-                    self,
-                    f"build{sheet_data['name']}"
-                )()
-                # self.build_meta()
-                # self.build_data()
-
-        for sheet_key, sheet_data in self.sheets.items():
+            except xlsxwriter.exceptions.DuplicateWorksheetName:
+                sheet_data['fd'] = self.workbook.add_worksheet(f"{sheet_data['name']}-1")
 
-            if sheet_data['reserved']:
-                continue
+            self.add_validations(sheet_data)
 
             fd_current_sheet = sheet_data['fd']
 
             self.apply_settings(fd_current_sheet, sheet_data['settings'])
 
+            if self.sheet_cache is not None:
+                fd_current_sheet = self.use_sheet_cache(sheet_data)
+
             next_available_row = 0
 
             for component in sheet_data['components']:
@@ -173,8 +773,106 @@ class SmartExcel():
                     f"render_{component['type']}_component"
                 )(fd_current_sheet, component, next_available_row)
 
+            if self.streaming:
+                # the rows are kept by xlsxwriter, not the payloads
+                sheet_data['components'] = []
+
+        # Then, we create the reserved sheets
+        for sheet_key, sheet_data in self.sheets.items():
+            if sheet_data['reserved']:
+                sheet_data['fd'] = self.workbook.add_worksheet(sheet_data['name'])
+                sheet_data['fd'].protect()
+                getattr(
+                    self,
+                    f"build{sheet_data['name']}"
+                )()
+
         self.workbook.close()
 
+        if self.sheet_cache is not None:
+            self.sheet_cache.prune()
+
+        if self.report_key is not None:
+            self.report_cache.set(self.report_key, self.read_output())
+
+    def read_output(self):
+        """Yield the content of the dumped xlsx, in chunks."""
+        if hasattr(self.output, 'read_chunks'):
+            # an OutputSink
+            yield from self.output.read_chunks()
+        elif hasattr(self.output, 'getvalue'):
+            yield self.output.getvalue()
+        else:
+            with open(self.output, 'rb') as fd:
+                yield from iter(lambda: fd.read(CHUNK_SIZE), b'')
+
+    def write_output(self, report):
+        """Copy `report` (a xlsx, as a file open for reading) to the output,
+        in chunks, then close it."""
+        with report:
+            if hasattr(self.output, 'write'):
+                shutil.copyfileobj(report, self.output, CHUNK_SIZE)
+                self.output.flush()
+                return
+
+            with open(self.output, 'wb') as fd:
+                shutil.copyfileobj(report, fd, CHUNK_SIZE)
+
+    def use_sheet_cache(self, sheet_data):
+        """Look up the rendered XML of a sheet in the sheet cache.
+
+        If the sheet has been rendered from the same inputs by the previous
+        dump, its XML is reused when the workbook is closed: the cells are
+        not written again. Images and drawings live outside of the sheet's
+        XML, so they are still inserted.
+
+        Returns the worksheet to render the sheet into.
+
+        :param sheet_data: a parsed sheet.
+        :type sheet_data: dict
+        """
+        fd_current_sheet = sheet_data['fd']
+
+        fingerprint = self.sheet_fingerprint(sheet_data)
+        part = self.sheet_cache.get(fingerprint)
+
+        self.workbook.sheet_parts[fd_current_sheet.name] = (fingerprint, part)
+
+        if part is None:
+            return fd_current_sheet
+        return SkipCells(fd_current_sheet)
+
+    def sheet_fingerprint(self, sheet_data):
+        """Return a digest of everything a sheet is rendered from.
+
+        The values are read from the payloads of the components: the
+        accessors of the data model are expected to depend on them only.
+        The validations of the columns, with the values of their list
+        sources, are added by `add_validations` before.
+        """
+        validations = [
+            self.validations.get(column['data_func'])
+            for component in sheet_data['components']
+            for column in component.get('columns', [])
+        ]
+
+        digest = hashlib.sha1()
+        update_digest(digest, [
+            xlsxwriter.__version__,
+            self.plan.key,
+            type(self.data).__qualname__,
+            self.header_row,
+            self.margin_component,
+            self.streaming,
+            # the first sheet is the selected one.
+            sheet_data['fd'].index == 0,
+            sheet_data['fd'].name,
+            sheet_data['settings'],
+            sheet_data['components'],
+            validations
+        ])
+        return digest.hexdigest()
+
     def apply_settings(self, fd_current_sheet, settings):
         """Apply settings to the current sheet.
 
@@ -183,10 +881,9 @@ class SmartExcel():
         => https://xlsxwriter.readthedocs.io/page_setup.html
         """
         for func_setting in settings:
-            getattr(
-                self.data,
-                f"apply_setting_{func_setting}"
-            )(fd_current_sheet)
+            self.call(
+                f"apply_setting_{func_setting}",
+                fd_current_sheet)
 
 
     def render_map_component(self, fd_current_sheet, component, next_available_row):
@@ -227,12 +924,11 @@ class SmartExcel():
                     {})
 
                 if 'format_func' in row:
-                    cell_format = getattr(
-                        self.data,
-                        f"get_format_for_{row['format_func']}"
-                    )(component['payload'][0])
+                    cell_format = self.call(
+                        f"get_format_for_{row['format_func']}",
+                        component['payload'][0])
 
-                    map_value_format = self.workbook.add_format(cell_format)
+                    map_value_format = self.format_registry.get(cell_format)
 
                 try:
                     middle = component['position']['middle']
@@ -252,6 +948,10 @@ class SmartExcel():
     def render_table_component(self, fd_current_sheet, component, next_available_row):
         """Render a Table component into the current sheet at the next available row.
 
+        The values (and per-cell formats) are computed and written by
+        blocks of `TABLE_BLOCK_SIZE` rows: in streaming mode, only a block
+        of the table is in memory at once.
+
         :param fd_current_sheet:
 
         :param component:
@@ -261,36 +961,106 @@ class SmartExcel():
         header_format = self.get_component_format(component, 'header')
         component_cell_format = self.get_component_format(component, 'cell')
 
-        for column in component['columns']:
-            self.write_header(
-                fd_current_sheet,
-                column,
-                next_available_row,
-                header_format)
+        columns = component['columns']
+        payload = component['payload']
+
+        # 0-indexed (row, col) coordinates, the table starts on column 0.
+        header_row = next_available_row + self.header_row - 1
+
+        self.write_header(
+            fd_current_sheet,
+            columns,
+            header_row,
+            header_format)
 
-            # validations
+        # validations
+        for column in columns:
             self.set_validations(fd_current_sheet, column)
 
-            values = self.get_values_for_column(column, component['payload'])
-            self.set_column_width(fd_current_sheet, column, values)
+        # format
+        cell_formats = [
+            self.get_column_format(column) or component_cell_format
+            for column in columns
+        ]
+
+        widths = [0] * len(columns)
+        for start in range(0, len(payload), TABLE_BLOCK_SIZE):
+            block = payload[start:start + TABLE_BLOCK_SIZE]
+
+            values_per_column = [
+                self.get_values_for_column(column, block, start)
+                for column in columns
+            ]
 
-            # format
-            cell_format = self.get_column_format(column) or component_cell_format
+            # per-cell formats, computed by the data model
+            dynamic_formats = {
+                col_index: self.get_formats_for_column(column, block)
+                for col_index, column in enumerate(columns)
+                if 'format_func' in column
+            }
 
-            for index, value in enumerate(values):
-                # TODO: use 0;0 notation instead of A1
-                cell_pos = f'{column["letter"]}{index + next_available_row + 1 + self.header_row}'
-                fd_current_sheet.write(cell_pos, value, cell_format)
+            block_widths = self.write_rows(
+                fd_current_sheet,
+                header_row + 1 + start,
+                zip(*values_per_column),
+                cell_formats,
+                dynamic_formats)
+            widths = list(map(max, widths, block_widths))
+
+        for column, width in zip(columns, widths):
+            self.set_column_width(fd_current_sheet, column, width)
+
+        return len(payload) + 1 + self.margin_component
+
+    def write_header(self, sheet, columns, row, header_format):
+        """Write the names of the columns on the (0-indexed) `row`."""
+        sheet.write_row(
+            row,
+            0,
+            [column['name'] for column in columns],
+            header_format)
+
+    def write_rows(self, sheet, first_row, rows, cell_formats, dynamic_formats=None):
+        """Write rows of values, in ascending order, from `first_row`.
+
+        :param rows: an iterable of tuples, one value per column.
+        :param cell_formats: the format of each column.
+        :param dynamic_formats: column index => the format of each row.
+
+        Returns the display width of the widest value of each column,
+        measured as the values are written (see `display_width`).
+        """
+        same_format = not dynamic_formats and all(
+            cell_format is cell_formats[0]
+            for cell_format in cell_formats)
 
-        return len(values) + 1 + self.margin_component
+        widths = [0] * len(cell_formats)
 
-    def write_header(self, sheet, column, next_available_row, header_format):
-        col = column["letter"]
-        row = self.header_row + next_available_row
-        cell_pos = f'{col}{row}'
+        for index, values in enumerate(rows):
+            row_index = first_row + index
+
+            for col_index, value in enumerate(values):
+                width = display_width(value)
+                if width > widths[col_index]:
+                    widths[col_index] = width
+
+            if same_format:
+                sheet.write_row(row_index, 0, values, cell_formats[0])
+                continue
+
+            for col_index, value in enumerate(values):
+                if dynamic_formats and col_index in dynamic_formats:
+                    cell_format = dynamic_formats[col_index][index]
+                else:
+                    cell_format = cell_formats[col_index]
 
-        # TODO: use 0;0 notation instead of A1
-        sheet.write(cell_pos, column['name'], header_format)
+                sheet.write(
+                    row_index,
+                    col_index,
+                    value,
+                    cell_format)
+
+        return widths
 
     def render_text_component(self, fd_current_sheet, component, next_available_row):
         """Render a Text component into the current sheet at the next available row.
@@ -365,25 +1135,41 @@ class SmartExcel():
     def parse_definition(self, definition):
         """Parse a definition.
 
-        :param definition: the spreadhsheet definition
-        :type definition: list of dict
+        :param definition: the elements of a compiled definition
+        :type definition: tuple of dict
 
         Supported types:
         - sheet
         - format
         """
+        for sheet_key in self.iter_definition(definition):
+            pass
 
+    def iter_definition(self, definition):
+        """Parse a definition, one sheet at a time: yield the key of each
+        sheet (in `self.sheets`) once it is parsed (see `iter_sheets`)."""
         for elem in definition:
+            # xlsxwriter takes the options of the definition as lists and
+            # dicts, not as the tuples and mappingproxies of the plan.
+            elem = thaw(elem)
             try:
                 if elem['type'] == 'sheet':
-                    self.parse_sheet(elem)
+                    yield from self.iter_sheets(elem)
                 elif elem['type'] == 'format':
                     self.parse_format(elem)
             except KeyError:
                 pass
 
     def parse_sheet(self, definition, index=0):
-        """Parse a sheet definition.
+        """Parse a sheet definition, and the sheets of its recursive
+        components (see `iter_sheets`)."""
+        for sheet_key in self.iter_sheets(definition, index):
+            pass
+
+    def iter_sheets(self, definition, index=0):
+        """Parse a sheet definition: yield the key of the sheet, then the
+        keys of the sheets of its recursive components, each one once it is
+        parsed.
 
         Attributes:
         - type : 'sheet'
@@ -403,9 +1189,8 @@ class SmartExcel():
             if isinstance(definition['name'], str):
                 sheet_name = definition['name']
             else:
-                sheet_name = getattr(
-                    self.data,
-                    f"get_sheet_name_for_{definition['name']['func']}")()
+                sheet_name = self.call(
+                    f"get_sheet_name_for_{definition['name']['func']}")
         except KeyError:
             sheet_name = f'Default-{index}'
 
@@ -431,28 +1216,36 @@ class SmartExcel():
             'settings': settings
         }
 
-        if 'components' in definition:
-            kwargs = {
-                'sheet_key': sheet_key,
-                'settings': settings
-            }
-            self.parse_components(definition['components'], **kwargs)
+        if 'components' not in definition:
+            yield sheet_key
+            return
+
+        kwargs = {
+            'sheet_key': sheet_key,
+            'settings': settings
+        }
+        recursive_components = self.parse_components(
+            definition['components'], **kwargs)
+        yield sheet_key
+
+        for component in recursive_components:
+            yield from self.iter_recursive_sheets(component, **kwargs)
 
     def parse_components(self, components, **kwargs):
-        """Parse sheet's components."""
+        """Parse sheet's components.
 
-        component_required_attrs = [
-            'type',
-            'name',
-        ]
+        Components have been validated by `compile_definition`.
+
+        Returns the components with `recursive` sheets, to be parsed once
+        the sheet is (see `iter_recursive_sheets`).
+        """
+        recursive_components = []
 
         for component in components:
-            params = copy.deepcopy(kwargs)
+            params = dict(kwargs)
 
             params.update(component)
 
-            validate_attrs(component_required_attrs, params, 'component')
-
             if component['type'] == 'table':
                 self.parse_table(**params)
             elif component['type'] == 'map':
@@ -465,32 +1258,43 @@ class SmartExcel():
                 raise ValueError(f"Type `{component['type']}` not supported.")
 
             if 'recursive' in component:
-                self.parse_recursive_components(component, **kwargs)
+                recursive_components.append(component)
+
+        return recursive_components
+
+    def iter_recursive_sheets(self, parent_comp, **kwargs):
+        """Parse the sheet of each instance of the payload of a recursive
+        component: yield their keys (see `iter_sheets`)."""
+        recursive = parent_comp['recursive']
 
-    def parse_recursive_components(self, parent_comp, **kwargs):
         for index, instance in enumerate(self.data.results[parent_comp['payload']]):
 
             # compute payload for the current instance.
             payload = self.get_payload(
-                func_name=parent_comp['recursive']['payload_func'],
+                func_name=recursive['payload_func'],
                 instance=instance,
-                foreign_key=parent_comp['recursive']['foreign_key'])
+                foreign_key=recursive['foreign_key'])
 
-            self.data.results[parent_comp['recursive']['payload_func']] = payload
+            self.data.results[recursive['payload_func']] = payload
 
             # inherit parent's format
             if 'format' in parent_comp:
                 comp_format = parent_comp['format']
-            elif 'format' in parent_comp['recursive']:
-                comp_format = parent_comp['recursive']['format']
+            elif 'format' in recursive:
+                comp_format = recursive['format']
             else:
                 comp_format = None
 
-            for child_comp in parent_comp['recursive']['components']:
+            # the compiled definition is immutable: children are
+            # (shallow) copies completed for the current instance.
+            children = []
+            for child_comp in recursive['components']:
+                child_comp = dict(child_comp)
+
                 # assign parent's `payload` to Map or Table children components.
                 # Image or Text components don't need a `payload`.
                 if child_comp['type'] in ['map', 'table']:
-                    child_comp['payload'] = parent_comp['recursive']['payload_func']
+                    child_comp['payload'] = recursive['payload_func']
 
                 # assign parent's `format` to children having the same type.
                 if child_comp['type'] == parent_comp['type']:
@@ -500,20 +1304,21 @@ class SmartExcel():
                 # similar than `self`.
                 child_comp['instance'] = instance
 
+                children.append(child_comp)
+
             # compute the child's sheet name
-            sheet_name = getattr(
-                self.data,
-                f"get_sheet_name_for_{parent_comp['recursive']['name']['func']}"
-                )(instance)
+            sheet_name = self.call(
+                f"get_sheet_name_for_{recursive['name']['func']}",
+                instance)
 
             definition = {
                 'name': sheet_name,
                 # children inherit parent's settings
                 'settings': kwargs['settings'],
-                'components': parent_comp['recursive']['components']
+                'components': children
             }
 
-            self.parse_sheet(
+            yield from self.iter_sheets(
                 definition=definition,
                 index=index)
 
@@ -531,22 +1336,15 @@ class SmartExcel():
         - 'format': a dict (required):
             => https://xlsxwriter.readthedocs.io/format.html
         """
-        required_attrs = [
-            'key',
-            'format'
-        ]
-
-        validate_attrs(required_attrs, cell_format, 'format')
-
-        self.formats[cell_format['key']] = self.workbook.add_format(
-            cell_format['format'])
+        properties = dict(cell_format['format'])
 
         if 'num_format' in cell_format:
             # It controls whether a number is displayed
             # as an integer, a floating point number, a date,
             # a currency value or some other user defined format.
-            self.formats[cell_format['key']].set_num_format(
-                cell_format['num_format'])
+            properties['num_format'] = cell_format['num_format']
+
+        self.formats[cell_format['key']] = self.format_registry.get(properties)
 
     def parse_map(self, **kwargs):
         """Parse a Map component (as the data structure).
@@ -573,15 +1371,9 @@ class SmartExcel():
             }
         """
 
-        map_required_attrs = [
-            'rows',
-            'payload'
-        ]
-        validate_attrs(map_required_attrs, kwargs, 'map component')
-
         parsed_rows = []
         for row in kwargs['rows']:
-            tmp = copy.deepcopy(row)
+            tmp = dict(row)
 
             tmp.update({
                 'letter': 'A'
@@ -627,13 +1419,6 @@ class SmartExcel():
             }
         """
 
-        table_required_attrs = [
-            'columns',
-            'payload'
-        ]
-
-        validate_attrs(table_required_attrs, kwargs, 'table component')
-
         # parse 'group_name'
         if 'group_name' in kwargs:
             group_name = kwargs['group_name']
@@ -642,10 +1427,9 @@ class SmartExcel():
 
         # parse 'repeat'
         if 'repeat_func' in kwargs:
-            repeat = getattr(
-                self.data,
+            repeat = self.call(
                 'write_{key}'.format(
-                    key=kwargs['repeat_func']))()
+                    key=kwargs['repeat_func']))
         elif 'repeat' in kwargs:
             repeat = kwargs['repeat']
         else:
@@ -693,15 +1477,6 @@ class SmartExcel():
         - 'format': a string
         """
 
-        required_attrs = [
-            'name',
-            'text_func',
-            'size',
-        ]
-
-        validate_attrs(required_attrs, kwargs, 'text component')
-        validate_size(kwargs)
-
         sheet_key = kwargs['sheet_key']
 
         if 'format' in kwargs:
@@ -712,15 +1487,12 @@ class SmartExcel():
         # compute `text` from `text_func`
         if 'instance' in kwargs:
             # `instance` is available for a child's component
-            text = getattr(
-                self.data,
-                f"get_text_for_{kwargs['text_func']}"
-            )(kwargs['instance'])
+            text = self.call(
+                f"get_text_for_{kwargs['text_func']}",
+                kwargs['instance'])
         else:
-            text = getattr(
-                self.data,
-                f"get_text_for_{kwargs['text_func']}"
-            )()
+            text = self.call(
+                f"get_text_for_{kwargs['text_func']}")
 
         self.sheets[sheet_key]['components'].append({
             'type': 'text',
@@ -749,28 +1521,18 @@ class SmartExcel():
         - 'parameters' : a dict
             => https://xlsxwriter.readthedocs.io/worksheet.html#worksheet-insert-image
         """
-        required_attrs = [
-            'name',
-            'image_func',
-            'size',
-        ]
-
-        validate_attrs(required_attrs, kwargs, 'image component')
-        validate_size(kwargs)
-
         sheet_key = kwargs['sheet_key']
 
         if 'instance' in kwargs:
             # `instance` is available for a child's component
-            image = getattr(
-                self.data,
-                f"get_image_{kwargs['image_func']}"
-            )(kwargs['instance'], kwargs['size'])
+            image = self.call(
+                f"get_image_{kwargs['image_func']}",
+                kwargs['instance'],
+                kwargs['size'])
         else:
-            image = getattr(
-                self.data,
-                f"get_image_{kwargs['image_func']}"
-            )(kwargs['size'])
+            image = self.call(
+                f"get_image_{kwargs['image_func']}",
+                kwargs['size'])
 
         if 'parameters' in kwargs:
             parameters = kwargs['parameters']
@@ -809,19 +1571,14 @@ class SmartExcel():
         - 'data_func': a string (required)
         - 'width': a integer (width of the cell, in excel unit)
         - 'format': a string
+        - 'format_func': a string, the format of each cell is computed by
+            `get_format_for_<format_func>(instance)`
         """
 
-        required_attrs = [
-            'name',
-            'data_func'
-        ]
-
         parsed_columns = []
         for index in range(0, repeat):
             for column in columns:
-                validate_attrs(required_attrs, column, 'column')
-
-                tmp_col = copy.deepcopy(column)
+                tmp_col = dict(column)
 
                 if isinstance(tmp_col['name'], dict):
                     tmp_col['name'] = self.get_value(
@@ -849,7 +1606,7 @@ class SmartExcel():
         if 'validations' in column and 'list_source_func' in column['validations']:
             sheet.data_validation(cell_range, {
                 'validate': 'list',
-                'source': f'={self.validations[column["key"]]["meta_source"]}'
+                'source': self.validations[column['data_func']]['meta_source']
             })
 
     def column_cell_range(self, column):
@@ -883,37 +1640,39 @@ class SmartExcel():
 
     def build_data(self):
         """Populate the reserved sheet name `_data`.
+
+        It holds the values of the list sources of the validations, a row
+        per validation (see `add_validations`).
         """
-        for sheet_key, sheet_data in self.sheets.items():
-            if sheet_data['reserved']:
-                continue
-            for component in sheet_data['components']:
-                if 'rows' in component:
-                    pass
-                if 'columns' in component:
-                    for column in component['columns']:
-                        if column['data_func'] not in self.validations:
-                            tmp = {
-                                'row': len(self.validations) + 1
-                            }
-                            if 'validations' in column:
-                                tmp.update(column['validations'])
-
-                                if 'list_source_func' in column['validations']\
-                                    and column['data_func'] not in self.validations:
-                                    list_source = getattr(
-                                        self.data,
-                                        column['validations']['list_source_func'])()
-
-                                    tmp.update({
-                                        'meta_source': f'={self.data_worksheet_name}!$A${tmp["row"]}:${next_letter(len(list_source) - 1)}${tmp["row"]}'  # noqa
-                                    })
-
-                                    self.sheets['_data']['fd'].write_row(
-                                        f"A{tmp['row']}",
-                                        list_source)
-
-                                self.validations[column['data_func']] = tmp
+        for validation in self.validations.values():
+            if 'list_source' in validation:
+                self.sheets['_data']['fd'].write_row(
+                    f"A{validation['row']}",
+                    validation['list_source'])
+
+    def add_validations(self, sheet_data):
+        """Add the validations of the columns of a sheet, before it is
+        rendered: the values of a list source go to a row of `_data`."""
+        for component in sheet_data['components']:
+            if 'columns' in component:
+                for column in component['columns']:
+                    if column['data_func'] not in self.validations:
+                        tmp = {
+                            'row': len(self.validations) + 1
+                        }
+                        if 'validations' in column:
+                            tmp.update(column['validations'])
+
+                            if 'list_source_func' in column['validations']:
+                                list_source = self.call(
+                                    column['validations']['list_source_func'])
+
+                                tmp.update({
+                                    'meta_source': f'={self.data_worksheet_name}!$A${tmp["row"]}:${next_letter(len(list_source) - 1)}${tmp["row"]}',  # noqa
+                                    'list_source': list_source
+                                })
+
+                            self.validations[column['data_func']] = tmp
 
     def get_format(self, format_name):
         if format_name in self.formats:
@@ -960,26 +1719,37 @@ class SmartExcel():
         self.main_ws.freeze_panes(1, 0)
         self.main_ws.freeze_panes(2, 0)
 
-    def set_column_width(self, fd_current_sheet, column, values):
+    def set_column_width(self, fd_current_sheet, column, width):
+        """Set the width of a column, from the width of its widest value.
+
+        The `width` of the column definition, if any, is used instead.
+        """
         if 'width' in column:
             width = column['width']
-        else:
-            try:
-                width = len(max(values, key=len))
-                if width < 10:
-                    width = 10
-            except (TypeError, ValueError):
-                width = 10
+        elif width < 10:
+            width = 10
 
         fd_current_sheet.set_column(
             f"{column['letter']}:{column['letter']}",
             width)
 
-    def get_meta(self, klass, func, meta, kwargs):
-        if func not in dir(klass):
+    def get_accessor(self, klass, func):
+        """Return the method `func` of `klass`.
+
+        Methods of the data model are served from the table built by
+        `bind_accessors`.
+        """
+        if klass is self.data and func in self.accessors:
+            return self.accessors[func]
+
+        method = getattr(klass, func, None)
+        if method is None:
             raise Exception(f'method \'{func}\' not present in {klass} class')  # noqa
+        return method
+
+    def get_meta(self, klass, func, meta, kwargs):
         try:
-            meta = getattr(klass, func)(meta, kwargs)
+            meta = self.get_accessor(klass, func)(meta, kwargs)
         except IndexError:
             meta = None
 
@@ -988,14 +1758,35 @@ class SmartExcel():
     def get_value(self, klass, func, obj, kwargs):
         return self.get_meta(klass, func, obj, kwargs)
 
-    def get_values_for_column(self, column, payload):
+    def get_values_for_column(self, column, payload, start=0):
+        """The values of `column` for the rows of `payload`.
+
+        :param start: the index of the first row of `payload`, when it is a
+        block of the rows of a table.
+        """
+        # batch protocol: the whole column (of the block) in one call.
+        write_column = self.accessors.get(f"write_{column['data_func']}__column")
+        if write_column is not None:
+            return write_column(payload)
+
+        write = self.get_accessor(
+            self.data,
+            'write_{key}'.format(key=column['data_func']))
+
+        values = []
+        for index, obj in enumerate(payload, start):  # self.data.results
+            try:
+                values.append(write(obj, {'index': index}))
+            except IndexError:
+                values.append(None)
+        return values
+
+    def get_formats_for_column(self, column, payload):
+        """Compute the format of each cell of a column with a `format_func`."""
+        func = f"get_format_for_{column['format_func']}"
         return [
-            self.get_value(
-                self.data,
-                'write_{key}'.format(key=column['data_func']),
-                obj,
-                {'index': index})
-            for index, obj in enumerate(payload)  # self.data.results
+            self.format_registry.get(self.call(func, obj))
+            for obj in payload
         ]
 
     def get_payload(self, func_name, instance, foreign_key):
@@ -1019,45 +1810,650 @@ class SmartExcel():
         """
 
         func_name = f'get_payload_{func_name}'
-        payload = getattr(
-            self.data,
-            func_name)(
-                instance=instance,
-                foreign_key=foreign_key
-            )
+        payload = self.call(
+            func_name,
+            instance=instance,
+            foreign_key=foreign_key)
         return payload
 
 
-def check_sheet_names(sheet_names):
+class SkipCells():
+    """
+    A worksheet, without its cells.
+
+    A sheet whose XML is reused from the sheet cache is rendered into it:
+    what is written into the cells is dropped, anything else (images,
+    column widths...) goes to the worksheet.
+    """
+    cell_methods = frozenset([
+        'write',
+        'write_row',
+        'write_column',
+        'write_string',
+        'write_number',
+        'write_blank',
+        'write_formula',
+        'write_boolean',
+        'write_datetime',
+        'write_url',
+        'merge_range',
+        'data_validation'
+    ])
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def __getattr__(self, name):
+        if name in self.cell_methods:
+            return skip_cells
+        return getattr(self.worksheet, name)
+
+
+def skip_cells(*args, **kwargs):
+    return 0
+
+
+class FormatRegistry():
+    """Hand back one shared xlsxwriter `Format` per distinct style.
+
+    Format properties are canonicalised (sorted items), so identical
+    formats are added only once to the workbook, whatever the number of
+    cells or dicts using them.
+    """
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.formats = {}
+
+    def get(self, properties):
+        """Return the `Format` of the dict `properties`.
+
+        None, like an empty dict, is the default format.
+        """
+        if properties is None:
+            properties = {}
+
+        try:
+            key = tuple(sorted(properties.items()))
+            return self.formats[key]
+        except KeyError:
+            cell_format = self.workbook.add_format(dict(properties))
+            self.formats[key] = cell_format
+            return cell_format
+        except TypeError:
+            # unhashable or unorderable properties
+            return self.workbook.add_format(dict(properties))
+
+
+ParseResult = namedtuple(
+    'ParseResult',
+    [
+        'path',
+        'rows',
+        'errors',
+        'exception'
+    ])
+
+# Files parsed by the worker processes of `parse_many`: (paths,
+# definition, data model). Set by the initializer of the pool, from the
+# context inherited (without any pickling) by the forked processes.
+_parse_many_context = None
+
+
+class ParseError(Exception):
+    """
+    An exception raised while parsing a file of `parse_many`, by its type
+    name and message: unlike the exception itself, it can always be
+    pickled back from a worker process.
+    """
+
+    def __init__(self, type_name, message):
+        super().__init__(type_name, message)
+        self.type_name = type_name
+        self.message = message
+
+    def __str__(self):
+        return f'{self.type_name}: {self.message}'
+
+
+def parse_many(paths, definition, data, workers=None):
+    """
+    Parse many xlsx files with the same definition, in a pool of processes.
+
+    Each file is checked (`_meta` sheet, header) and parsed by its own
+    SmartExcel. Yield a ParseResult per file, as soon as it is parsed (in
+    any order): its path, its rows and `parse_errors`, or the `ParseError`
+    of the exception raised while parsing it.
+
+    The data model is only used by the parent process: the values of the
+    `list_source_func` of the definition are read once, before the pool
+    is forked.
+
+    :param workers: number of processes (needs `fork`). None (the default)
+    parses the files one after another, in this process.
+    :type workers: int
+    """
+    paths = list(paths)
+    context = (paths, definition, ListSources(data, definition))
+
+    if not can_fork(workers, len(paths)):
+        for index in range(0, len(paths)):
+            yield ParseResult(paths[index], *parse_file_in(context, index)[1:])
+        return
+
+    multiprocessing_context = multiprocessing.get_context('fork')
+    with multiprocessing_context.Pool(
+            workers,
+            initializer=init_parse_many,
+            initargs=(context,)) as pool:
+        for index, rows, errors, exception in pool.imap_unordered(
+                parse_file, range(0, len(paths))):
+            yield ParseResult(paths[index], rows, errors, exception)
+
+
+def init_parse_many(context):
+    """Set the context of `parse_many` (in a worker process)."""
+    global _parse_many_context
+    _parse_many_context = context
+
+
+def parse_file(index):
+    """Parse the file at `index` of `parse_many` (in a worker process)."""
+    return parse_file_in(_parse_many_context, index)
+
+
+def parse_file_in(context, index):
+    """Parse the file at `index` of a `parse_many` context."""
+    paths, definition, data = context
+    try:
+        excel = SmartExcel(
+            definition=definition,
+            data=data,
+            path=paths[index])
+        rows = excel.parse()
+    except Exception as e:
+        return index, None, None, ParseError(type(e).__name__, str(e))
+
+    return index, rows, excel.parse_errors, None
+
+
+GeneratedSheet = namedtuple(
+    'GeneratedSheet',
+    [
+        'name',
+        # index of the table of the sheet in `get_levels`
+        'level',
+        # index of the parent sheet
+        'parent',
+        # position of the instance of the sheet in the parent's payload
+        'position',
+        'foreign_key'
+    ]
+)
+
+
+# (SmartExcel, levels, sheets) of the running `parse_hierarchy`, inherited
+# by the forked workers.
+_parse_hierarchy_context = None
+
+
+def parse_sheets(indices):
+    """Parse the sheets at `indices` of `parse_hierarchy` (in a worker process)."""  # noqa
+    excel, levels, sheets = _parse_hierarchy_context
+    return excel.parse_sheets(
+        levels,
+        [(index, sheets[index]) for index in indices])
+
+
+class ListSources():
+    """
+    A data model whose `list_source_func` methods return the values they
+    returned once.
+    """
+
+    def __init__(self, data, definition):
+        self.data = data
+        self.values = {}
+
+        if isinstance(definition, CompiledDefinition):
+            definition = definition.elements
+
+        for sheet in definition:
+            for component in sheet.get('components', []):
+                for column in component.get('columns', []):
+                    func = column.get('validations', {}).get('list_source_func')
+                    if func and func not in self.values:
+                        self.values[func] = getattr(data, func)()
+
+    def __getattr__(self, name):
+        if name in self.values:
+            return functools.partial(list, self.values[name])
+        return getattr(self.data, name)
+
+    def __str__(self):
+        return str(self.data)
+
+
+CompiledDefinition = namedtuple(
+    'CompiledDefinition',
+    [
+        # hash of the definition
+        'key',
+        'data_model_class',
+        # the validated definition, frozen (dict => mappingproxy, list => tuple)
+        'elements',
+        # method name => function (unbound) of the data model class
+        'accessors',
+        # names of the `write_*` methods used by the definition
+        'writers'
+    ])
+
+
+# the compiled definitions of the process, least recently used first
+COMPILED_DEFINITIONS_SIZE = 32
+_COMPILED_DEFINITIONS = OrderedDict()
+_compiled_definitions_lock = threading.Lock()
+
+
+def compile_definition(definition, data_model_class):
+    """Validate a definition and pre-resolve the methods of the data model.
+
+    The result is immutable and cached per process, keyed by the hash of the
+    definition and the data model class, so every SmartExcel instance using
+    the same definition and data model shares it. The cache keeps the last
+    `COMPILED_DEFINITIONS_SIZE` plans used.
+
+    The values of a table column are computed row by row with
+    `write_<data_func>(instance, kwargs)`, unless the data model provides
+    them one column at a time, either with:
+    - a method `write_<data_func>__column(payload)` returning a list,
+      called for each block of rows of the payload (see
+      `render_table_component`),
+    - or a class attribute `column_attributes`, a dict mapping a
+      `data_func` to the attribute to read on each instance of the payload.
+
+    :param definition: the spreadsheet definition
+    :type definition: list of dict
+
+    :param data_model_class: the class of the data model
+    :type data_model_class: type
+    """
+    key = definition_hash(definition)
+
+    with _compiled_definitions_lock:
+        plan = _COMPILED_DEFINITIONS.get((key, data_model_class))
+        if plan is not None:
+            _COMPILED_DEFINITIONS.move_to_end((key, data_model_class))
+            return plan
+
+    accessors = {}
+    writers = set()
+    elements = []
+    for elem in definition:
+        if 'type' not in elem:
+            continue
+
+        if elem['type'] == 'sheet':
+            elements.append(
+                compile_sheet(elem, data_model_class, accessors, writers))
+        elif elem['type'] == 'format':
+            validate_attrs(['key', 'format'], elem, 'format')
+            elements.append(freeze(elem))
+
+    plan = CompiledDefinition(
+        key=key,
+        data_model_class=data_model_class,
+        elements=tuple(elements),
+        accessors=MappingProxyType(accessors),
+        writers=frozenset(writers))
+
+    with _compiled_definitions_lock:
+        _COMPILED_DEFINITIONS[(key, data_model_class)] = plan
+        while len(_COMPILED_DEFINITIONS) > COMPILED_DEFINITIONS_SIZE:
+            _COMPILED_DEFINITIONS.popitem(last=False)
+    return plan
+
+
+def definition_hash(definition):
+    serialized = json.dumps(definition, sort_keys=True, default=repr)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def update_digest(digest, value):
+    """Feed `value` (of a parsed sheet) into `digest`.
+
+    Payloads are read column by column and images by their content.
+    """
+    if isinstance(value, (dict, MappingProxyType)):
+        for key in sorted(value, key=str):
+            digest.update(repr(key).encode('utf-8'))
+            if str(key).startswith('image') \
+                    and isinstance(value[key], str) \
+                    and os.path.isfile(value[key]):
+                with open(value[key], 'rb') as fd:
+                    digest.update(hashlib.sha1(fd.read()).digest())
+            else:
+                update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'[')
+        for item in value:
+            update_digest(digest, item)
+        digest.update(b']')
+    elif isinstance(value, ColumnarPayload):
+        for field in value.fields:
+            digest.update(repr((field, value.values(field))).encode('utf-8'))
+    elif hasattr(value, 'getvalue'):
+        # io.BytesIO
+        digest.update(hashlib.sha1(value.getvalue()).digest())
+    else:
+        digest.update(repr(value).encode('utf-8'))
+
+
+def freeze(value):
+    """Return an immutable copy of a definition element."""
+    if isinstance(value, dict):
+        return MappingProxyType({
+            key: freeze(item)
+            for key, item in value.items()
+        })
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Return a plain (mutable) copy of a frozen definition element."""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {
+            key: thaw(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+def resolve_accessor(data_model_class, func, accessors, writers=None):
+    """Resolve the method `func` once.
+
+    A missing method is not an error here: `write_*` methods (`writers`)
+    are checked when the definition is bound to a data model, others raise
+    when they are called.
+    """
+    # the method as stored in the class: a function, a staticmethod or a
+    # classmethod (see `bind_accessor`)
+    method = inspect.getattr_static(data_model_class, func, None)
+    if method is not None:
+        accessors[func] = method
+
+    if writers is not None:
+        writers.add(func)
+
+
+def bind_accessor(method, data):
+    """Bind a method resolved by `resolve_accessor` to the data model `data`,
+    as `getattr(data, func)` would."""
+    if hasattr(method, '__get__'):
+        return method.__get__(data, type(data))
+    return method
+
+
+def resolve_column_accessor(data_model_class, data_func, accessors):
+    """Resolve the batch accessor of a column, if the data model has one."""
+    func = f'write_{data_func}__column'
+    column_attributes = getattr(data_model_class, 'column_attributes', {})
+
+    if data_func in column_attributes:
+        accessors[func] = attribute_column_accessor(column_attributes[data_func])
+    else:
+        resolve_accessor(data_model_class, func, accessors)
+
+
+def attribute_column_accessor(attr):
+    """Build a batch accessor reading the attribute `attr` of each instance.
+
+    A `ColumnarPayload` hands back the column as is: no row is built.
+    """
+    getter = operator.attrgetter(attr)
+
+    def write_column(data_model, payload):
+        if isinstance(payload, ColumnarPayload):
+            return payload.values(attr)
+        return list(map(getter, payload))
+
+    return write_column
+
+
+def compile_sheet(sheet, data_model_class, accessors, writers):
+    if isinstance(sheet.get('name'), dict):
+        resolve_accessor(
+            data_model_class,
+            f"get_sheet_name_for_{sheet['name']['func']}",
+            accessors)
+    elif sheet.get('name') in SmartExcel.reserved_sheets:
+        raise ValueError(f"{sheet['name']} is a reserved sheet name.")
+
+    for func_setting in sheet.get('settings', []):
+        resolve_accessor(
+            data_model_class,
+            f"apply_setting_{func_setting}",
+            accessors)
+
+    compile_components(
+        sheet.get('components', []),
+        data_model_class,
+        accessors,
+        writers)
+
+    return freeze(sheet)
+
+
+def compile_components(components, data_model_class, accessors, writers, inherit_payload=False):
+    """Validate components and resolve their methods.
+
+    :param inherit_payload: children of a `recursive` component receive
+    their payload from their parent.
+    :type inherit_payload: bool
+    """
+    for component in components:
+        validate_attrs(['type', 'name'], component, 'component')
+
+        if component['type'] == 'table':
+            required_attrs = ['columns'] if inherit_payload else ['columns', 'payload']
+            validate_attrs(required_attrs, component, 'table component')
+
+            if 'repeat_func' in component:
+                resolve_accessor(
+                    data_model_class,
+                    f"write_{component['repeat_func']}",
+                    accessors,
+                    writers)
+
+            for column in component['columns']:
+                validate_attrs(['name', 'data_func'], column, 'column')
+
+                if isinstance(column['name'], dict):
+                    resolve_accessor(
+                        data_model_class,
+                        f"write_{column['name']['func']}",
+                        accessors,
+                        writers)
+
+                resolve_accessor(
+                    data_model_class,
+                    f"write_{column['data_func']}",
+                    accessors,
+                    writers)
+                resolve_column_accessor(
+                    data_model_class,
+                    column['data_func'],
+                    accessors)
+
+                if 'format_func' in column:
+                    resolve_accessor(
+                        data_model_class,
+                        f"get_format_for_{column['format_func']}",
+                        accessors)
+
+                validations = column.get('validations', {})
+                if 'list_source_func' in validations:
+                    resolve_accessor(
+                        data_model_class,
+                        validations['list_source_func'],
+                        accessors)
+
+        elif component['type'] == 'map':
+            required_attrs = ['rows'] if inherit_payload else ['rows', 'payload']
+            validate_attrs(required_attrs, component, 'map component')
+
+            for row in component['rows']:
+                if 'data_func' in row:
+                    resolve_accessor(
+                        data_model_class,
+                        f"write_{row['data_func']}",
+                        accessors,
+                        writers)
+                if 'format_func' in row:
+                    resolve_accessor(
+                        data_model_class,
+                        f"get_format_for_{row['format_func']}",
+                        accessors)
+
+        elif component['type'] == 'text':
+            validate_attrs(['text_func', 'size'], component, 'text component')
+            validate_size(component)
+
+            resolve_accessor(
+                data_model_class,
+                f"get_text_for_{component['text_func']}",
+                accessors)
+
+        elif component['type'] == 'image':
+            validate_attrs(['image_func', 'size'], component, 'image component')
+            validate_size(component)
+
+            resolve_accessor(
+                data_model_class,
+                f"get_image_{component['image_func']}",
+                accessors)
+
+        else:
+            raise ValueError(f"Type `{component['type']}` not supported.")
+
+        if 'recursive' in component:
+            recursive = component['recursive']
+
+            resolve_accessor(
+                data_model_class,
+                f"get_payload_{recursive['payload_func']}",
+                accessors)
+            resolve_accessor(
+                data_model_class,
+                f"get_sheet_name_for_{recursive['name']['func']}",
+                accessors)
+
+            compile_components(
+                recursive['components'],
+                data_model_class,
+                accessors,
+                writers,
+                inherit_payload=True)
+
+
+def check_sheet_names(sheet_names, generated_sheets=False):
+    if generated_sheets:
+        if sheet_names[-2:] != SMART_EXCEL_CONFIG['sheet_names'][-2:]:
+            raise Exception("'_meta', '_data' sheets must be present.")
+        return
+
     if sheet_names != SMART_EXCEL_CONFIG['sheet_names']:
         raise Exception("'Sheet1', '_meta', '_data' sheets must be present.")
 
 
+def read_cell_value(sheet, position):
+    # only the row of the cell is read.
+    row, column = coordinate_to_tuple(position)
+    values = next(
+        sheet.iter_rows(min_row=row, max_row=row, values_only=True),
+        ())
+    return values[column - 1] if len(values) >= column else None
+
+
 def check_dump_date(meta_ws):
-    dump_date = meta_ws[SMART_EXCEL_CONFIG['dump_date_cell_position']]
+    dump_date = read_cell_value(
+        meta_ws,
+        SMART_EXCEL_CONFIG['dump_date_cell_position'])
     if dump_date is None:
         raise Exception("A dump date must be present.")
-    return dump_date.value
+    return dump_date
 
 
 def check_header_row(meta_ws):
-    header_row = meta_ws[SMART_EXCEL_CONFIG['header_row_cell_position']]
-    if header_row is None:
+    header_row = read_cell_value(
+        meta_ws,
+        SMART_EXCEL_CONFIG['header_row_cell_position'])
+    if not isinstance(header_row, int) or isinstance(header_row, bool):
         raise Exception("config header_row must be present.")
-    return header_row.value
+    return header_row
 
 
 def check_header(sheet, definition, header_row):
-    header_row_base_0 = header_row - 1
-    # sheet.values is a generator, so an iterator. I should use itertools
-    for index, row in enumerate(sheet.values):
-        if index == header_row_base_0:
-            if tuple(definition) != row:
-                raise Exception("Header definitions do not match.")
+    # only the header row is read.
+    rows = sheet.iter_rows(
+        min_row=header_row,
+        max_row=header_row,
+        values_only=True)
+    row = next(rows, ())
+
+    # the rows are as wide as the widest row of the sheet.
+    while row and row[-1] is None:
+        row = row[:-1]
+
+    if tuple(definition) != tuple(row):
+        raise Exception("Header definitions do not match.")
+
+
+def get_table(components):
+    """Return the first table of `components` (StopIteration if none)."""
+    return next(
+        component
+        for component in components
+        if component['type'] == 'table')
 
 
-def check_meta_config(wb):
-    check_sheet_names(wb.sheetnames)
+def get_field(instance, field):
+    """Return the `field` of an instance of a payload (dict or namedtuple)."""
+    if isinstance(instance, Mapping):
+        return instance[field]
+    return getattr(instance, field)
+
+
+def validate_rows(columns, rows, first_row, errors):
+    """Coerce and validate the columns of the parsed `rows`, in place.
+
+    The errors are added to `errors`: key => reason => row numbers.
+
+    :param first_row: the row number of the first row.
+    """
+    for column in columns:
+        validator = column.get('validator')
+        if validator is None:
+            continue
+
+        key = column['key']
+        column_errors = {}
+        values = validator([row[key] for row in rows], column_errors)
+
+        for row, value in zip(rows, values):
+            row[key] = value
+
+        for reason, indices in column_errors.items():
+            errors.setdefault(key, {}).setdefault(
+                reason, []).extend(first_row + index for index in indices)
+
+
+def check_meta_config(wb, generated_sheets=False):
+    check_sheet_names(wb.sheetnames, generated_sheets)
 
     return {
         'dump_date': check_dump_date(wb['_meta']),
@@ -1066,15 +2462,43 @@ def check_meta_config(wb):
 
 
 
+def display_width(value):
+    """Return the number of characters Excel displays `value` with.
+
+    Numbers as in the General format (up to 11 characters), dates as
+    ISO dates, strings by their longest line.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        if '\n' in value:
+            return max(map(len, value.split('\n')))
+        return len(value)
+    if isinstance(value, numbers.Integral):
+        return len(str(value))
+    if isinstance(value, numbers.Real):
+        return len(format(value, '.10g'))
+    if isinstance(value, datetime.datetime):
+        return len('YYYY-MM-DD HH:MM:SS')
+    if isinstance(value, datetime.date):
+        return len('YYYY-MM-DD')
+    if isinstance(value, datetime.time):
+        return len('HH:MM:SS')
+    return len(str(value))
+
+
 A, Z = 65, 90
 TOTAL = 26
 
 
+@functools.lru_cache(maxsize=None)
 def next_letter(length):
     """
     Get the next excel column available.
     e.g: 'A', 'AA', 'BA'
 
+    Letters are computed once per process, then served from the cache.
+
     length: of the columns list
     returns
     """
@@ -0,0 +1,276 @@
+import decimal
+import unittest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from .fbf.data_model import (
+    CopyDecoder,
+    FbfFloodData,
+    copyfetchall,
+    decode_copy,
+    parse_bool,
+    parse_text
+)
+from .payload import numpy
+from .fbf.db import ConnectionPool, pool_size
+
+
+class FakeCursor():
+    description = [('id',)]
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.connection.queries.append(query)
+        self.connection.params.append(params)
+        self.rows = []
+        if query.startswith('EXECUTE') and self.connection.results:
+            self.description, self.rows = self.connection.results.pop(0)
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeInfo():
+    transaction_status = TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection():
+    """A psycopg2 connection, without a server."""
+    info = FakeInfo()
+
+    def __init__(self):
+        self.closed = 0
+        self.queries = []
+        self.params = []
+        # (description, rows) returned by the next statements executed
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeThreadedPool(ThreadedConnectionPool):
+    def _connect(self, key=None):
+        # a new connection takes the place (and the id) of a closed one
+        connections = getattr(self, 'connections', [])
+        closed = [connection for connection in connections if connection.closed]
+        if closed:
+            connection = closed[0]
+            connection.__init__()
+        else:
+            connection = FakeConnection()
+            connections.append(connection)
+        self.connections = connections
+        self.opened = getattr(self, 'opened', 0) + 1
+        self.last = connection
+        if key is not None:
+            self._used[key] = connection
+            self._rused[id(connection)] = key
+        else:
+            self._pool.append(connection)
+        return connection
+
+
+class FakeConnectionPool(ConnectionPool):
+    pool_class = FakeThreadedPool
+
+
+class TestConnectionPool(unittest.TestCase):
+    def test_reuse(self):
+        pool = FakeConnectionPool(maxconn=2)
+
+        for i in range(3):
+            # two borrowers at once
+            with pool.connection() as first:
+                with pool.connection() as second:
+                    pass
+
+        self.assertEqual(pool.pool.opened, 2)
+        self.assertFalse(first.closed or second.closed)
+        # the connections are checked once, when they are first lent
+        self.assertEqual(first.queries, ['SELECT 1'])
+
+    def test_closed_connection(self):
+        pool = FakeConnectionPool(minconn=1, maxconn=2)
+
+        with pool.connection() as first:
+            pool.prepared_statements(first).add('statement')
+            with pool.connection() as second:
+                pass
+
+        # psycopg2 closed the connection given back last, beyond minconn:
+        # its state is gone.
+        self.assertTrue(first.closed)
+        self.assertNotIn(first, pool.states)
+        self.assertFalse(second.closed)
+        self.assertEqual(pool.prepared_statements(second), set())
+
+
+class TestPoolSize(unittest.TestCase):
+    def runTest(self):
+        self.assertEqual(pool_size({}, 'DB_POOL_SIZE', 4), 4)
+        self.assertEqual(pool_size({'DB_POOL_SIZE': ''}, 'DB_POOL_SIZE', 4), 4)
+        self.assertEqual(pool_size({'DB_POOL_SIZE': '8'}, 'DB_POOL_SIZE', 4), 8)
+
+        with self.assertRaisesRegex(ValueError, 'DB_POOL_SIZE must be at least 1'):
+            pool_size({'DB_POOL_SIZE': '0'}, 'DB_POOL_SIZE', 4)
+
+
+class TestDecodeCopy(unittest.TestCase):
+    def runTest(self):
+        data = 'a\\tb\t1\t\\N\tt\n\\\\N\t2\t2.50\tf\n'
+        self.assertEqual(
+            decode_copy(data, [parse_text, int, decimal.Decimal, parse_bool]),
+            [
+                ['a\tb', '\\N'],
+                [1, 2],
+                [None, decimal.Decimal('2.50')],
+                [True, False]
+            ])
+        self.assertEqual(decode_copy('', [int, int]), [[], []])
+
+        with self.assertRaisesRegex(ValueError, 'The rows do not have the columns'):
+            decode_copy('1\t2\n3\n', [int, int])
+
+
+class FakeCopyCursor():
+    def __init__(self, data, size):
+        self.data = data
+        self.size = size
+
+    def copy_expert(self, query, file):
+        # psycopg2 writes the output of COPY in chunks
+        for start in range(0, len(self.data), self.size):
+            file.write(self.data[start:start + self.size])
+
+
+class TestCopyDecoder(unittest.TestCase):
+    data = (
+        'a\\tb\t1\t1.5\n'
+        '\\\\N\t2\t\\N\n'
+        'c\\nd\t3\t2.5\n'
+    )
+
+    def test_chunks(self):
+        # chunks of 1 to 7 characters split the rows, values and escapes
+        for size in range(1, 8):
+            cursor = FakeCopyCursor(self.data, size)
+            payload = copyfetchall(
+                cursor,
+                b'SELECT',
+                [parse_text, int, float],
+                ['name', 'total', 'score'],
+                numeric_fields=['total', 'score'])
+
+            self.assertEqual(payload.values('name'), ['a\tb', '\\N', 'c\nd'])
+            self.assertEqual(list(payload.values('total')), [1, 2, 3])
+            self.assertEqual(payload.values('score'), [1.5, None, 2.5])
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_numeric_columns(self):
+        decoder = CopyDecoder([int, float, int], [True, True, False])
+        decoder.write('1\t1.5\t1\n2\t')
+        decoder.write('2.5\t2\n')
+
+        total, score, other = decoder.getvalue()
+        self.assertIsInstance(total, numpy.ndarray)
+        self.assertEqual(total.tolist(), [1, 2])
+        self.assertIsInstance(score, numpy.ndarray)
+        self.assertEqual(score.tolist(), [1.5, 2.5])
+        self.assertEqual(other, [1, 2])
+
+        # a null in a later chunk turns the column into a list
+        decoder.write('\\N\t3.5\t3\n')
+        total, score, other = decoder.getvalue()
+        self.assertEqual(total, [1, 2, None])
+        self.assertEqual(score.tolist(), [1.5, 2.5, 3.5])
+
+    def test_incomplete_row(self):
+        decoder = CopyDecoder([int, int])
+        decoder.write('1\t2\n3\t')
+        with self.assertRaisesRegex(ValueError, 'The last row of the query is incomplete'):
+            decoder.getvalue()
+
+
+class TestAreaExtent(unittest.TestCase):
+    def runTest(self):
+        pool = FakeConnectionPool(minconn=1, maxconn=2)
+        data = FbfFloodData(flood_event_id=1, pool=pool)
+        connection = pool.pool.last
+        connection.results = [
+            ([('column_type',)], [('character varying',)]),
+            ([('x_min',), ('y_min',), ('x_max',), ('y_max',)], [(1.0, 2.0, 3.0, 4.0)]),
+        ]
+
+        # a village code, read as a float
+        extent = data.get_area_extent({
+            'table': 'village',
+            'foreign_key': 'village_code'
+        }, 3201001.0)[0]
+        self.assertEqual(extent.x_max, 3.0)
+
+        # the code is bound with the type of the column, as text
+        self.assertEqual(connection.params[-3], ['village', 'village_code'])
+        self.assertIn('(character varying) AS', connection.queries[-2])
+        self.assertEqual(connection.params[-1], ['3201001'])
+
+        # the type of the column is queried once
+        connection.results = [
+            ([('x_min',), ('y_min',), ('x_max',), ('y_max',)], [(1.0, 2.0, 3.0, 4.0)]),
+        ]
+        data.get_area_extent({
+            'table': 'village',
+            'foreign_key': 'village_code'
+        }, 3201002)
+        self.assertTrue(connection.queries[-1].startswith('EXECUTE'))
+        self.assertEqual(connection.params[-1], ['3201002'])
+
+
+class TestPreparedStatements(unittest.TestCase):
+    def runTest(self):
+        pool = FakeConnectionPool(minconn=1, maxconn=2)
+        data = FbfFloodData(flood_event_id=1, pool=pool)
+
+        # the connection of the data model is busy: the query prepares its
+        # statement on a second connection.
+        busy = pool.getconn()
+        data.get_flood(1)
+        # psycopg2 closes the first one when it is given back
+        pool.putconn(busy)
+        self.assertTrue(busy.closed)
+
+        # a new connection, with the id of the closed one, prepares the
+        # statement again.
+        second = pool.getconn()
+        data.get_flood(1)
+        self.assertIs(pool.pool.last, busy)
+        queries = busy.queries
+        self.assertTrue(queries[-2].startswith('PREPARE'))
+        self.assertTrue(queries[-1].startswith('EXECUTE'))
+        pool.putconn(second)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+from .loaders import (
+    TableLoader,
+    csv_line,
+    quote_table
+)
+
+
+class FakeCursor():
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def copy_expert(self, query, data):
+        self.connection.copies.append((query, data.read()))
+
+
+class FakeConnection():
+    """A psycopg2 connection recording the COPY it runs."""
+
+    def __init__(self):
+        self.copies = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakePlpy():
+    """The plpy module, with the columns of one table."""
+
+    def __init__(self, types):
+        self.types = types
+        self.prepared = []
+        self.executed = []
+
+    def prepare(self, query, types):
+        plan = (query, types)
+        self.prepared.append(plan)
+        return plan
+
+    def execute(self, plan, args):
+        self.executed.append((plan, args))
+        if 'pg_attribute' in plan[0]:
+            return [
+                {'name': name, 'type': column_type}
+                for name, column_type in self.types.items()
+            ]
+        return []
+
+
+class TestCsvLine(unittest.TestCase):
+    def runTest(self):
+        self.assertEqual(
+            csv_line([None, '', 42, 'a "b", c']),
+            ',"","42","a ""b"", c"\n')
+
+
+class TestQuoteTable(unittest.TestCase):
+    def runTest(self):
+        self.assertEqual(quote_table('public.partner_row'), '"public"."partner_row"')
+        self.assertEqual(quote_table('a"b'), '"a""b"')
+
+
+class TestTableLoader(unittest.TestCase):
+    rows = [
+        {'id': 1, 'name': 'a "quoted", name', 'note': None},
+        {'id': 2, 'name': 'two\nlines', 'note': ''}
+    ]
+
+    def test_copy(self):
+        connection = FakeConnection()
+        loader = TableLoader(
+            'public.partner_row',
+            columns={'id': 'id', 'name': 'partner name', 'note': 'note'},
+            connection=connection)
+        loader.write_batch(self.rows)
+        loader.write_batch([])
+
+        self.assertEqual(connection.copies, [(
+            'COPY "public"."partner_row" ("id", "partner name", "note") '
+            'FROM STDIN WITH (FORMAT csv)',
+            '"1","a ""quoted"", name",\n'
+            '"2","two\nlines",""\n'
+        )])
+
+    def test_unnest(self):
+        plpy = FakePlpy({'id': 'integer', 'name': 'character varying(50)', 'note': 'text'})
+        loader = TableLoader('partner_row', plpy=plpy)
+        loader.write_batch(self.rows)
+        loader.write_batch(self.rows[:1])
+
+        # the types are read, and the insert prepared, once.
+        types_plan, insert_plan = plpy.prepared
+        self.assertIn('FROM pg_attribute', types_plan[0])
+        self.assertEqual(types_plan[1], ['text'])
+        self.assertEqual(insert_plan, (
+            'INSERT INTO "partner_row" ("id", "name", "note") '
+            'SELECT * FROM unnest($1, $2, $3)',
+            ['integer[]', 'character varying(50)[]', 'text[]']))
+
+        self.assertEqual(plpy.executed, [
+            (types_plan, ['"partner_row"']),
+            (insert_plan, [[1, 2], ['a "quoted", name', 'two\nlines'], [None, '']]),
+            (insert_plan, [[1], ['a "quoted", name'], [None]])
+        ])
+
+    def test_unknown_column(self):
+        loader = TableLoader('partner_row', columns=['id', 'missing'], plpy=FakePlpy({'id': 'integer'}))
+
+        with self.assertRaisesRegex(ValueError, "column 'missing' not present in table partner_row"):
+            loader.write_batch(self.rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
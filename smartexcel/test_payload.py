@@ -0,0 +1,86 @@
+import unittest
+from .payload import (
+    ColumnarPayload,
+    numpy
+)
+
+
+class TestColumnarPayload(unittest.TestCase):
+    def setUp(self):
+        self.payload = ColumnarPayload.from_rows(
+            ['name', 'total'],
+            [
+                ('Bonzai', 10),
+                ('Artichoke', 3)
+            ])
+
+    def test_rows(self):
+        self.assertEqual(len(self.payload), 2)
+
+        rows = list(self.payload)
+        self.assertEqual(rows[0].name, 'Bonzai')
+        self.assertEqual(rows[1].total, 3)
+
+        self.assertEqual(self.payload[-1].name, 'Artichoke')
+        with self.assertRaises(IndexError):
+            self.payload[2]
+
+    def test_slice(self):
+        payload = self.payload[1:]
+
+        self.assertIsInstance(payload, ColumnarPayload)
+        self.assertEqual(len(payload), 1)
+        self.assertEqual(payload.values('name'), ['Artichoke'])
+        self.assertEqual(len(self.payload[2:]), 0)
+
+    def test_columns(self):
+        self.assertEqual(self.payload.values('name'), ['Bonzai', 'Artichoke'])
+        self.assertEqual(self.payload.values('total'), [10, 3])
+
+    def test_empty(self):
+        payload = ColumnarPayload.from_rows(['name'], [])
+
+        self.assertEqual(len(payload), 0)
+        self.assertEqual(list(payload), [])
+        self.assertEqual(payload.values('name'), [])
+
+    def test_group_by(self):
+        payload = ColumnarPayload.from_rows(
+            ['parent', 'name', 'total'],
+            [
+                (1, 'Bonzai', 10),
+                (2, 'Artichoke', 3),
+                (1, 'Cucumber', 7)
+            ],
+            numeric_fields=['total'])
+
+        groups = payload.group_by('parent')
+
+        self.assertEqual(list(groups), [1, 2])
+        self.assertEqual(groups[1].values('name'), ['Bonzai', 'Cucumber'])
+        self.assertEqual(groups[1].values('total'), [10, 7])
+        self.assertEqual(groups[2][0].name, 'Artichoke')
+
+        self.assertEqual(len(payload.take([])), 0)
+
+    @unittest.skipUnless(numpy, 'NumPy is not installed')
+    def test_numeric_fields(self):
+        payload = ColumnarPayload.from_rows(
+            ['total', 'flooded', 'score'],
+            [
+                (10, 1, None),
+                (3, 2, 1.5)
+            ],
+            numeric_fields=['total', 'flooded', 'score'])
+
+        total, flooded = payload.arrays('total', 'flooded')
+        self.assertEqual((total - flooded).tolist(), [9, 1])
+        self.assertEqual(payload.values('total'), [10, 3])
+
+        # None can't be stored in an array: the list is kept.
+        self.assertIsNone(payload.arrays('total', 'score'))
+        self.assertEqual(payload.values('score'), [None, 1.5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import datetime
+import io
+import unittest
+import xlsxwriter
+from openpyxl import load_workbook
+from .reader import UnsupportedWorkbook, XlsxReader
+from .smart_excel import SmartExcel
+from .test_smart_excel import DataModel, TestParse
+
+
+def write_template(rows, dump_date='2020-01-01', options=None):
+    """Write a returned template: a header and `rows` in Sheet1."""
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, options or {})
+    sheet = workbook.add_worksheet('Sheet1')
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+
+    sheet.write_row(0, 0, ['Identification', 'Value'])
+    for index, row in enumerate(rows, 1):
+        for column, value in enumerate(row):
+            if isinstance(value, datetime.date):
+                sheet.write_datetime(index, column, value, date_format)
+            else:
+                sheet.write(index, column, value)
+
+    workbook.add_worksheet('_data')
+    meta = workbook.add_worksheet('_meta')
+    if dump_date:
+        meta.write('A1', 'dump_date')
+        meta.write('B1', dump_date)
+    meta.write('A2', 'header_rows')
+    meta.write('B2', 1)
+    workbook.close()
+    return output
+
+
+class TestXlsxReader(unittest.TestCase):
+    def write_values(self, options):
+        output = io.BytesIO()
+        workbook = xlsxwriter.Workbook(output, options)
+        bold = workbook.add_format({'bold': True})
+        sheet = workbook.add_worksheet('Values')
+
+        sheet.write_row(0, 0, ['a & <b>', '  spaces ', 'two\nlines', 'é'])
+        sheet.write_row(1, 0, [42, -1.5, 1e20, 0])
+        sheet.write_row(2, 0, [True, False, '=1+1', None], bold)
+        sheet.write_blank(3, 1, None, bold)
+        # a missing row, and a missing column
+        sheet.write(5, 0, 'last')
+        sheet.write(5, 2, 7)
+        sheet.write_formula(6, 3, '=1/0', None, '#DIV/0!')
+        workbook.add_worksheet('Empty')
+        workbook.close()
+        return output
+
+    def assertReadLikeOpenpyxl(self, output, **kwargs):
+        workbook = load_workbook(output, read_only=True)
+        reader = XlsxReader(output)
+
+        self.assertEqual(reader.sheetnames, workbook.sheetnames)
+        for name in workbook.sheetnames:
+            self.assertEqual(
+                list(reader[name].iter_rows(values_only=True, **kwargs)),
+                list(workbook[name].iter_rows(values_only=True, **kwargs)))
+
+    def test_values(self):
+        for options in ({}, {'constant_memory': True}):
+            with self.subTest(options=options):
+                output = self.write_values(options)
+                self.assertReadLikeOpenpyxl(output)
+                self.assertReadLikeOpenpyxl(output, min_row=2, max_row=5)
+
+    def test_columns(self):
+        output = self.write_values({})
+        rows = load_workbook(output, read_only=True)['Values'].iter_rows(values_only=True)
+        reader = XlsxReader(output)
+
+        self.assertEqual(
+            list(reader['Values'].iter_rows(values_only=True, columns=[3, 1])),
+            [(row[2], row[0]) for row in rows])
+
+    def test_dates(self):
+        reader = XlsxReader(write_template([[1, datetime.date(2020, 1, 1)]]))
+
+        # openpyxl converts the dates.
+        with self.assertRaises(UnsupportedWorkbook):
+            list(reader['Sheet1'].iter_rows(values_only=True))
+
+    def test_not_a_workbook(self):
+        with self.assertRaises(UnsupportedWorkbook):
+            XlsxReader(io.BytesIO(b'not a zip'))
+
+
+class TestReadMode(unittest.TestCase):
+    definition = TestParse.definition
+
+    def test_fallback(self):
+        # the rows after the date are read by openpyxl.
+        output = write_template([
+            [1, 'one'],
+            [2, datetime.date(2020, 1, 2)],
+            [3, 'three']
+        ])
+
+        excel = SmartExcel(
+            definition=self.definition,
+            data=DataModel(),
+            path=output)
+
+        self.assertEqual(
+            list(excel.iter_parse()),
+            [
+                {'thing_id': 1, 'value': 'one'},
+                {'thing_id': 2, 'value': datetime.datetime(2020, 1, 2)},
+                {'thing_id': 3, 'value': 'three'}
+            ])
+
+    def test_dump_date(self):
+        with self.assertRaisesRegex(Exception, 'A dump date must be present.'):
+            SmartExcel(
+                definition=self.definition,
+                data=DataModel(),
+                path=write_template([[1, 'one']], dump_date=None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import io
+import unittest
+import zipfile
+from openpyxl import load_workbook
+from .sinks import (
+    ChunkedSink,
+    SpooledSink
+)
+from .smart_excel import SmartExcel
+from .test_smart_excel import DataModel
+
+
+class BytesSink(ChunkedSink):
+    def __init__(self, chunk_size):
+        super().__init__(chunk_size)
+        self.content = bytearray()
+        self.chunks = []
+
+    def write_chunk(self, offset, data):
+        self.chunks.append((offset, len(data)))
+        end = offset + len(data)
+        if len(self.content) < end:
+            self.content.extend(bytes(end - len(self.content)))
+        self.content[offset:end] = data
+
+    def read_chunks(self, chunk_size=1024):
+        self.flush()
+        yield bytes(self.content)
+
+
+def dump(output):
+    excel = SmartExcel(
+        output=output,
+        definition=[
+            {
+                'type': 'sheet',
+                'name': 'Things',
+                'components': [
+                    {
+                        'type': 'table',
+                        'name': 'A table',
+                        'payload': 'things',
+                        'columns': [
+                            {
+                                'name': 'Value',
+                                'data_func': 'thing_value'
+                            }
+                        ]
+                    }
+                ]
+            }
+        ],
+        data=DataModel())
+    excel.dump()
+    return b''.join(output.read_chunks())
+
+
+class TestChunkedSink(unittest.TestCase):
+    def test_rewrite(self):
+        sink = BytesSink(chunk_size=4)
+        sink.write(b'0123456789')
+        # the first chunk has been written, the rewrite goes straight to it.
+        sink.seek(2)
+        sink.write(b'ab')
+        sink.seek(0, io.SEEK_END)
+        sink.write(b'!')
+
+        self.assertEqual(next(sink.read_chunks()), b'01ab456789!')
+        self.assertEqual(sink.tell(), 11)
+
+    def test_large_write(self):
+        sink = BytesSink(chunk_size=4)
+        sink.write(b'01')
+        sink.write(memoryview(b'23456789abcdef'))
+
+        # written in pieces, straight from the data: only the last chunk
+        # is buffered.
+        self.assertEqual(sink.chunks, [(0, 2), (2, 4), (6, 4), (10, 2)])
+        self.assertEqual(sink.buffer, bytearray(b'cdef'))
+        self.assertEqual(next(sink.read_chunks()), b'0123456789abcdef')
+
+    def test_dump(self):
+        sink = BytesSink(chunk_size=1024)
+        content = dump(sink)
+
+        self.assertIsNone(zipfile.ZipFile(io.BytesIO(content)).testzip())
+        self.assertEqual(
+            list(load_workbook(io.BytesIO(content))['Things'].values),
+            [('Value',), ('The answer',), ('nothing',)])
+
+        # fixed size pieces, but for the headers rewritten in place.
+        self.assertTrue(all(
+            length <= 1024 for offset, length in sink.chunks))
+
+
+class TestSpooledSink(unittest.TestCase):
+    def runTest(self):
+        sink = SpooledSink(max_size=1024)
+        content = dump(sink)
+
+        # spilled to a temporary file
+        self.assertTrue(sink.file._rolled)
+        self.assertEqual(
+            list(load_workbook(io.BytesIO(content))['Things'].values),
+            [('Value',), ('The answer',), ('nothing',)])
+
+
+if __name__ == "__main__":
+    unittest.main()
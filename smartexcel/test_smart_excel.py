@@ -1,9 +1,29 @@
+import datetime
+import io
 import os
+import tempfile
+import threading
+import time
 import unittest
+import zipfile
+import xlsxwriter
+import xlsxwriter.workbook
+from collections import namedtuple
+from unittest import mock
+from openpyxl import load_workbook
+from .cache import FileReportCache
+from . import smart_excel
+from .payload import ColumnarPayload
 from .smart_excel import (
+    ParseError,
     SmartExcel,
+    compile_definition,
+    display_width,
+    next_letter,
+    parse_many,
     validate_position
 )
+from .workbook import Workbook, WorkbookPackager
 
 
 children_things = [
@@ -59,6 +79,9 @@ class DataModel():
     def write_column_name_func(self, instance, kwargs={}):
         return self.custom_column_names[kwargs['index']]
 
+    def write_column_1(self, instance, kwargs={}):
+        return instance
+
     def write_first_column(self, instance, kwargs={}):
         return instance
 
@@ -90,6 +113,12 @@ class DataModel():
     def write_row_one(self, instance, kwargs={}):
         return instance
 
+    def get_format_for_thing(self, instance):
+        return {
+            'bold': instance['id'] == 42,
+            'align': 'center'
+        }
+
     def get_text_for_sheet_title(self):
         return 'Hello World!'
 
@@ -702,5 +731,1635 @@ class TestApplySettings(unittest.TestCase):
         excel.dump()
 
 
+class EventsDataModel(DataModel):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def get_payload_detail(self, instance, foreign_key):
+        self.events.append(('payload', instance['id']))
+        return super().get_payload_detail(instance, foreign_key)
+
+    def write_thing_id(self, instance, kwargs={}):
+        self.events.append(('write', instance['id']))
+        return super().write_thing_id(instance, kwargs)
+
+    def write_result(self, instance, kwargs={}):
+        self.events.append(('write', instance['result']))
+        return super().write_result(instance, kwargs)
+
+
+class TestStreamingDump(unittest.TestCase):
+    def setUp(self):
+        self.definition = {
+            'type': 'sheet',
+            'name': 'Things',
+            'components': [
+                {
+                    'type': 'table',
+                    'name': 'A table',
+                    'payload': 'things',
+                    'columns': [
+                        {
+                            'name': 'Identification',
+                            'data_func': 'thing_id'
+                        },
+                        {
+                            'name': 'Value',
+                            'data_func': 'thing_value'
+                        }
+                    ],
+                    'recursive': {
+                        'payload_func': 'detail',
+                        'foreign_key': 'id',
+                        'name': {
+                            'func': 'detail'
+                        },
+                        'components': [
+                            {
+                                'name': 'Another table',
+                                'type': 'table',
+                                'columns': [
+                                    {
+                                        'name': 'Result',
+                                        'data_func': 'result'
+                                    }
+                                ]
+                            }
+                        ]
+                    }
+                }
+            ]
+        }
+
+    def test_dump(self):
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=[self.definition],
+            data=DataModel(),
+            streaming=True)
+        excel.dump()
+
+        workbook = load_workbook(excel.output)
+        self.assertEqual(
+            list(workbook['Things'].values),
+            [
+                ('Identification', 'Value'),
+                (42, 'The answer'),
+                (43, 'nothing')
+            ])
+        self.assertEqual(
+            list(workbook['Sheet nb 43'].values),
+            [('Result',), ('oui',), ('non',)])
+        self.assertEqual(workbook['_meta']['A2'].value, 'header_rows')
+
+    def test_lazy_parsing(self):
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=[self.definition],
+            data=EventsDataModel(),
+            streaming=True)
+        # only the reserved sheets
+        self.assertEqual(len(excel.sheets), 2)
+
+        excel.dump()
+
+        # the payload of a sheet is computed once its parent is rendered
+        self.assertEqual(excel.data.events, [
+            ('write', 42),
+            ('write', 43),
+            ('payload', 42),
+            ('write', 'yes'),
+            ('write', 'no'),
+            ('payload', 43),
+            ('write', 'oui'),
+            ('write', 'non')
+        ])
+        self.assertEqual(
+            [sheet_data['components'] for sheet_data in excel.sheets.values()
+             if not sheet_data['reserved']],
+            [[], [], []])
+
+
+class TestRenderTable(unittest.TestCase):
+    def runTest(self):
+        definition = [
+            {
+                'type': 'format',
+                'key': 'bold',
+                'format': {
+                    'bold': True
+                }
+            },
+            {
+                'type': 'sheet',
+                'name': 'Table',
+                'components': [
+                    {
+                        'type': 'text',
+                        'name': 'Title',
+                        'text_func': 'sheet_title',
+                        'size': {
+                            'width': 2,
+                            'height': 1
+                        }
+                    },
+                    {
+                        'type': 'table',
+                        'name': 'A table',
+                        'payload': 'things',
+                        'columns': [
+                            {
+                                'name': 'Identification',
+                                'data_func': 'thing_id',
+                                'format': 'bold'
+                            },
+                            {
+                                'name': 'Value',
+                                'data_func': 'thing_value'
+                            }
+                        ]
+                    }
+                ]
+            }
+        ]
+        excel = get_smart_excel(definition, DataModel, output=io.BytesIO())
+        excel.dump()
+
+        worksheet = load_workbook(excel.output)['Table']
+        # the text takes 2 rows (height + margin), then the table header.
+        self.assertEqual(worksheet['A3'].value, 'Identification')
+        self.assertEqual(worksheet['B3'].value, 'Value')
+        self.assertEqual(worksheet['A4'].value, 42)
+        self.assertTrue(worksheet['A4'].font.b)
+        self.assertEqual(worksheet['B5'].value, 'nothing')
+        self.assertFalse(worksheet['B5'].font.b)
+
+
+class TestCompileDefinition(unittest.TestCase):
+    def setUp(self):
+        self.definition = [
+            {
+                'type': 'sheet',
+                'name': {
+                    'func': 'summary'
+                },
+                'components': [
+                    {
+                        'type': 'table',
+                        'name': 'A table',
+                        'payload': 'things',
+                        'columns': [
+                            {
+                                'name': 'Identification',
+                                'data_func': 'thing_id'
+                            }
+                        ]
+                    }
+                ]
+            }
+        ]
+
+    def test_shared_plan(self):
+        plan = compile_definition(self.definition, DataModel)
+
+        self.assertIs(compile_definition(self.definition, DataModel), plan)
+        self.assertIs(get_smart_excel(self.definition, DataModel).plan, plan)
+
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=plan,
+            data=DataModel())
+        self.assertIs(excel.plan, plan)
+        self.assertEqual(excel.sheets['A summary title-0']['name'], 'A summary title')
+
+    def test_bounded_cache(self):
+        plan = compile_definition(self.definition, DataModel)
+
+        for index in range(0, smart_excel.COMPILED_DEFINITIONS_SIZE):
+            self.definition[0]['components'][0]['name'] = f'Table {index}'
+            compile_definition(self.definition, DataModel)
+
+        self.assertEqual(
+            len(smart_excel._COMPILED_DEFINITIONS),
+            smart_excel.COMPILED_DEFINITIONS_SIZE)
+        self.assertNotIn(
+            (plan.key, DataModel), smart_excel._COMPILED_DEFINITIONS)
+
+    def test_accessors(self):
+        plan = compile_definition(self.definition, DataModel)
+
+        self.assertIs(plan.accessors['write_thing_id'], DataModel.write_thing_id)
+        self.assertIs(
+            plan.accessors['get_sheet_name_for_summary'],
+            DataModel.get_sheet_name_for_summary)
+
+    def test_immutable(self):
+        plan = compile_definition(self.definition, DataModel)
+
+        with self.assertRaises(TypeError):
+            plan.elements[0]['name'] = 'Another name'
+
+        with self.assertRaises(TypeError):
+            plan.accessors['write_thing_id'] = None
+
+    def test_list_validation(self):
+        self.definition[0]['components'][0]['columns'][0]['validations'] = {
+            'excel': {
+                'validate': 'list',
+                'source': ['x', 'y']
+            }
+        }
+        excel = get_smart_excel(self.definition, DataModel, output=io.BytesIO())
+        excel.dump()
+
+        validations = load_workbook(excel.output)['A summary title'].data_validations
+        self.assertEqual(
+            [validation.formula1 for validation in validations.dataValidation],
+            ['"x,y"'])
+
+    def test_validation(self):
+        del self.definition[0]['components'][0]['columns']
+
+        with self.assertRaises(ValueError) as raised:
+            compile_definition(self.definition, DataModel)
+
+        self.assertEqual(
+            str(raised.exception),
+            'columns is required in a table component definition.')
+
+
+class TestBindAccessors(unittest.TestCase):
+    def setUp(self):
+        self.definition = {
+            'type': 'sheet',
+            'name': 'Columns',
+            'components': [
+                {
+                    'type': 'table',
+                    'name': 'A table',
+                    'payload': 'my_custom_payload_for_table',
+                    'columns': [
+                        {
+                            'name': 'Column name',
+                            'data_func': 'column_name_func'
+                        }
+                    ]
+                }
+            ]
+        }
+
+    def test_missing_method(self):
+        self.definition['components'][0]['columns'][0]['data_func'] = 'missing'
+
+        with self.assertRaises(Exception) as raised:
+            get_smart_excel(self.definition, DataModel)
+
+        self.assertEqual(
+            str(raised.exception),
+            "method 'write_missing' not present in My Custom DataModel class")
+
+    def test_index_error(self):
+        excel = get_smart_excel(self.definition, DataModel)
+        self.assertEqual(
+            excel.accessors['write_column_name_func'].__self__,
+            excel.data)
+
+        excel.data.custom_column_names = ['Bonzai']
+        self.assertEqual(
+            excel.get_values_for_column(
+                excel.sheets['Columns-0']['components'][0]['columns'][0],
+                excel.data.results['my_custom_payload_for_table']),
+            ['Bonzai', None])
+
+    def test_static_and_class_methods(self):
+        class StaticDataModel(DataModel):
+            suffix = '!'
+
+            @staticmethod
+            def write_column_name_func(instance, kwargs={}):
+                return instance.upper()
+
+            @classmethod
+            def write_column_1(cls, instance, kwargs={}):
+                return instance + cls.suffix
+
+        self.definition['components'][0]['columns'].append({
+            'name': 'Column 1',
+            'data_func': 'column_1'
+        })
+        excel = get_smart_excel(self.definition, StaticDataModel, output=io.BytesIO())
+        columns = excel.sheets['Columns-0']['components'][0]['columns']
+        payload = excel.data.results['my_custom_payload_for_table']
+
+        self.assertEqual(
+            excel.get_values_for_column(columns[0], payload),
+            ['GOOD MORNING', 'BONJOUR'])
+        self.assertEqual(
+            excel.get_values_for_column(columns[1], payload),
+            ['Good morning!', 'Bonjour!'])
+        excel.dump()
+
+
+class TestFormatRegistry(unittest.TestCase):
+    def test_shared_format(self):
+        excel = get_smart_excel([
+            {
+                'type': 'format',
+                'key': 'a_format',
+                'format': {
+                    'bold': True,
+                    'align': 'center'
+                }
+            },
+            {
+                'type': 'format',
+                'key': 'same_format',
+                'format': {
+                    'align': 'center',
+                    'bold': True
+                }
+            }
+        ], DataModel)
+
+        self.assertIs(excel.formats['a_format'], excel.formats['same_format'])
+        self.assertIs(
+            excel.format_registry.get({'bold': True, 'align': 'center'}),
+            excel.formats['a_format'])
+        self.assertEqual(len(excel.format_registry.formats), 1)
+
+    def format_func_definition(self):
+        return {
+            'type': 'sheet',
+            'name': 'Things',
+            'components': [
+                {
+                    'type': 'table',
+                    'name': 'A table',
+                    'payload': 'things',
+                    'columns': [
+                        {
+                            'name': 'Value',
+                            'data_func': 'thing_value',
+                            'format_func': 'thing'
+                        }
+                    ]
+                }
+            ]
+        }
+
+    def test_format_func(self):
+        excel = get_smart_excel(self.format_func_definition(), DataModel, output=io.BytesIO())
+        excel.dump()
+
+        # one format per distinct style
+        self.assertEqual(len(excel.format_registry.formats), 2)
+
+        worksheet = load_workbook(excel.output)['Things']
+        self.assertTrue(worksheet['A2'].font.b)
+        self.assertFalse(worksheet['A3'].font.b)
+        self.assertEqual(worksheet['A3'].alignment.horizontal, 'center')
+
+    def test_no_format(self):
+        class NoFormatDataModel(DataModel):
+            def get_format_for_thing(self, instance):
+                if instance['id'] == 42:
+                    return {'bold': True}
+                return None
+
+        excel = get_smart_excel(self.format_func_definition(), NoFormatDataModel, output=io.BytesIO())
+        excel.dump()
+
+        self.assertIs(excel.format_registry.get(None), excel.format_registry.get({}))
+        worksheet = load_workbook(excel.output)['Things']
+        self.assertTrue(worksheet['A2'].font.b)
+        self.assertFalse(worksheet['A3'].font.b)
+        self.assertEqual(worksheet['A3'].value, 'nothing')
+
+
+Point = namedtuple('Point', ['x', 'y'])
+
+
+class ColumnDataModel(DataModel):
+    column_attributes = {
+        'x': 'x'
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.results['points'] = [Point(1, 2), Point(3, 4)]
+        self.calls = []
+
+    def write_y(self, instance, kwargs={}):
+        self.calls.append('write_y')
+        return instance.y
+
+    def write_y__column(self, payload):
+        self.calls.append('write_y__column')
+        return [instance.y for instance in payload]
+
+
+class TestColumnAccessors(unittest.TestCase):
+    def setUp(self):
+        self.definition = {
+            'type': 'sheet',
+            'name': 'Points',
+            'components': [
+                {
+                    'type': 'table',
+                    'name': 'A table',
+                    'payload': 'points',
+                    'columns': [
+                        {
+                            'name': 'X',
+                            'data_func': 'x'
+                        },
+                        {
+                            'name': 'Y',
+                            'data_func': 'y'
+                        }
+                    ]
+                }
+            ]
+        }
+
+    def test_batch(self):
+        excel = get_smart_excel(self.definition, ColumnDataModel, output=io.BytesIO())
+        excel.dump()
+
+        self.assertEqual(excel.data.calls, ['write_y__column'])
+        self.assertEqual(
+            list(load_workbook(excel.output)['Points'].values),
+            [('X', 'Y'), (1, 2), (3, 4)])
+
+    def test_columnar_payload(self):
+        excel = get_smart_excel(self.definition, ColumnDataModel, output=io.BytesIO())
+        payload = ColumnarPayload.from_rows(['x', 'y'], [(1, 2), (3, 4)])
+
+        self.assertEqual(
+            excel.get_values_for_column({'data_func': 'x'}, payload),
+            [1, 3])
+
+
+class BlockDataModel(DataModel):
+    def __init__(self):
+        super().__init__()
+        self.results['points'] = [Point(x, 10 ** (3 * x)) for x in range(0, 5)]
+        self.indices = []
+        self.blocks = []
+
+    def write_x(self, instance, kwargs={}):
+        self.indices.append(kwargs['index'])
+        return instance.x
+
+    def write_y__column(self, payload):
+        self.blocks.append(len(payload))
+        return [instance.y for instance in payload]
+
+    def get_format_for_point(self, instance):
+        return {'bold': instance.x % 2 == 0}
+
+
+class TestTableBlocks(unittest.TestCase):
+    definition = {
+        'type': 'sheet',
+        'name': 'Points',
+        'components': [
+            {
+                'type': 'table',
+                'name': 'A table',
+                'payload': 'points',
+                'columns': [
+                    {
+                        'name': 'X',
+                        'data_func': 'x',
+                        'format_func': 'point'
+                    },
+                    {
+                        'name': 'Y',
+                        'data_func': 'y'
+                    }
+                ]
+            }
+        ]
+    }
+
+    def setUp(self):
+        self.block_size = smart_excel.TABLE_BLOCK_SIZE
+        smart_excel.TABLE_BLOCK_SIZE = 2
+
+    def tearDown(self):
+        smart_excel.TABLE_BLOCK_SIZE = self.block_size
+
+    def runTest(self):
+        for payload in [
+                BlockDataModel().results['points'],
+                ColumnarPayload.from_rows(
+                    ['x', 'y'],
+                    BlockDataModel().results['points'],
+                    numeric_fields=['y'])]:
+            data = BlockDataModel()
+            data.results['points'] = payload
+            excel = SmartExcel(
+                output=io.BytesIO(),
+                definition=[self.definition],
+                data=data,
+                streaming=True)
+            excel.dump()
+
+            self.assertEqual(data.blocks, [2, 2, 1])
+            self.assertEqual(data.indices, [0, 1, 2, 3, 4])
+
+            sheet = load_workbook(excel.output)['Points']
+            self.assertEqual(
+                list(sheet.values),
+                [('X', 'Y')] + [(x, 10 ** (3 * x)) for x in range(0, 5)])
+            self.assertEqual(
+                [sheet.cell(row, 1).font.b for row in range(2, 7)],
+                [True, False, True, False, True])
+            # the widest value is in the last block
+            self.assertGreater(sheet.column_dimensions['B'].width, 13)
+
+
+class LinkDataModel(DataModel):
+    def __init__(self):
+        super().__init__()
+        self.results['links'] = ['https://kartoza.com']
+
+
+class TestParallelDump(unittest.TestCase):
+    def runTest(self):
+        definition = [
+            {
+                'type': 'sheet',
+                'name': 'Links',
+                'components': [
+                    {
+                        'type': 'table',
+                        'name': 'Links',
+                        'payload': 'links',
+                        'columns': [
+                            {
+                                'name': 'Link',
+                                'data_func': 'first_column'
+                            }
+                        ]
+                    },
+                    {
+                        'type': 'table',
+                        'name': 'A table',
+                        'payload': 'things',
+                        'columns': [
+                            {
+                                'name': 'Identification',
+                                'data_func': 'thing_id'
+                            }
+                        ],
+                        'recursive': {
+                            'payload_func': 'detail',
+                            'foreign_key': 'id',
+                            'name': {
+                                'func': 'detail'
+                            },
+                            'components': [
+                                {
+                                    'name': 'Another table',
+                                    'type': 'table',
+                                    'columns': [
+                                        {
+                                            'name': 'Result',
+                                            'data_func': 'result'
+                                        }
+                                    ]
+                                }
+                            ]
+                        }
+                    }
+                ]
+            }
+        ]
+
+        workbooks = []
+        for workers in [None, 2]:
+            excel = SmartExcel(
+                output=io.BytesIO(),
+                definition=definition,
+                data=LinkDataModel(),
+                workers=workers)
+            excel.dump()
+            workbooks.append(load_workbook(excel.output))
+
+        serial, parallel = workbooks
+        self.assertEqual(serial.sheetnames, parallel.sheetnames)
+        for sheet_name in serial.sheetnames:
+            self.assertEqual(
+                list(serial[sheet_name].values),
+                list(parallel[sheet_name].values))
+
+        self.assertEqual(
+            parallel['Links']['A2'].hyperlink.target,
+            'https://kartoza.com')
+
+
+class TestParallelStyles(unittest.TestCase):
+    def package(self, workers):
+        output = io.BytesIO()
+        workbook = Workbook(output, workers=workers)
+        unused = workbook.add_format({'italic': True})
+        bold = workbook.add_format({'bold': True})
+        red = workbook.add_format({'font_color': 'red'})
+        grey = workbook.add_format({'bg_color': 'gray'})
+        wide = workbook.add_format({'num_format': '0.000'})
+
+        first = workbook.add_worksheet('First')
+        first.set_column(2, 2, None, wide)
+        first.write(0, 1, 'red', red)
+        first.write(0, 0, 'bold', bold)
+        first.write(1, 2, 42)
+
+        second = workbook.add_worksheet('Second')
+        second.set_row(0, None, grey)
+        second.write(0, 0, 'grey')
+        second.write(1, 0, 'bold', bold)
+        workbook.close()
+
+        self.assertIsNone(unused.xf_index)
+        package = zipfile.ZipFile(output)
+        return {
+            name: package.read(name)
+            for name in [
+                'xl/styles.xml',
+                'xl/worksheets/sheet1.xml',
+                'xl/worksheets/sheet2.xml'
+            ]
+        }
+
+    def runTest(self):
+        self.assertEqual(self.package(workers=2), self.package(workers=None))
+
+
+class TestParallelRoundTrip(unittest.TestCase):
+    """The cells keep their styles when the worksheets are assembled in
+    parallel, as read back by openpyxl."""
+
+    def dump(self, workers, constant_memory=False):
+        output = io.BytesIO()
+        workbook = Workbook(
+            output,
+            {'constant_memory': constant_memory},
+            workers=workers)
+        formats = [
+            workbook.add_format({'bold': True}),
+            workbook.add_format({'italic': True, 'font_color': 'red'}),
+            workbook.add_format({'bg_color': 'yellow', 'border': 1}),
+            workbook.add_format({'num_format': '0.000', 'align': 'center'}),
+            workbook.add_format({'font_size': 14, 'text_wrap': True}),
+        ]
+
+        for index in range(4):
+            worksheet = workbook.add_worksheet(f'Sheet {index}')
+            # each sheet uses the formats in another order
+            shifted = formats[index:] + formats[:index]
+            worksheet.set_column(0, 0, 20, shifted[0])
+            for row in range(3):
+                for col, cell_format in enumerate(shifted):
+                    worksheet.write(row, col + 1, row * col + 0.5, cell_format)
+                worksheet.write(row, 0, f'{index}-{row}')
+        workbook.close()
+        return load_workbook(output)
+
+    def styles(self, workbook):
+        return {
+            (worksheet.title, cell.coordinate): (
+                cell.value,
+                cell.font.b,
+                cell.font.i,
+                cell.font.sz,
+                cell.font.color.rgb if cell.font.color else None,
+                cell.fill.fgColor.rgb,
+                cell.border.left.style,
+                cell.number_format,
+                cell.alignment.horizontal,
+                cell.alignment.wrap_text,
+            )
+            for worksheet in workbook
+            for row in worksheet.iter_rows()
+            for cell in row
+        }
+
+    def test_styles(self):
+        for constant_memory in [False, True]:
+            with self.subTest(constant_memory=constant_memory):
+                serial = self.styles(self.dump(1, constant_memory))
+                self.assertEqual(len(serial), 4 * 3 * 6)
+                self.assertEqual(
+                    self.styles(self.dump(2, constant_memory)), serial)
+
+    def test_other_version(self):
+        # the parallel assembly relies on the internals of one version
+        with mock.patch.object(xlsxwriter, '__version__', '0.0.0'), \
+                mock.patch.object(WorkbookPackager, 'assemble_in_pool') as pool:
+            workbook = self.dump(2)
+
+        pool.assert_not_called()
+        self.assertEqual(self.styles(workbook), self.styles(self.dump(1)))
+
+
+class TestSheetCache(unittest.TestCase):
+    def dump(self, data):
+        definition = [
+            {
+                'type': 'sheet',
+                'name': 'Things',
+                'components': [
+                    {
+                        'type': 'table',
+                        'name': 'A table',
+                        'payload': 'things',
+                        'columns': [
+                            {
+                                'name': 'Value',
+                                'data_func': 'thing_value'
+                            }
+                        ],
+                        'recursive': {
+                            'payload_func': 'detail',
+                            'foreign_key': 'id',
+                            'name': {
+                                'func': 'detail'
+                            },
+                            'components': [
+                                {
+                                    'name': 'Another table',
+                                    'type': 'table',
+                                    'columns': [
+                                        {
+                                            'name': 'Result',
+                                            'data_func': 'result'
+                                        }
+                                    ]
+                                }
+                            ]
+                        }
+                    }
+                ]
+            }
+        ]
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=definition,
+            data=data,
+            cache_dir=self.cache_dir.name)
+        excel.dump()
+
+        hits = [
+            name
+            for name, (fingerprint, part) in excel.workbook.sheet_parts.items()
+            if part is not None
+        ]
+        return load_workbook(excel.output), hits
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_unchanged(self):
+        first, hits = self.dump(DataModel())
+        self.assertEqual(hits, [])
+
+        second, hits = self.dump(DataModel())
+        self.assertEqual(hits, ['Things', 'Sheet nb 42', 'Sheet nb 43'])
+
+        for sheet_name in first.sheetnames:
+            self.assertEqual(
+                list(first[sheet_name].values),
+                list(second[sheet_name].values))
+        self.assertEqual(
+            first['Sheet nb 42']['A1'].font.b,
+            second['Sheet nb 42']['A1'].font.b)
+
+    def test_changed(self):
+        self.dump(DataModel())
+
+        data = DataModel()
+        # one string less in the shared string table: the indices of the
+        # strings of the cached sheets change.
+        data.results['things'][0]['name'] = 'nothing'
+        workbook, hits = self.dump(data)
+
+        self.assertEqual(hits, ['Sheet nb 42', 'Sheet nb 43'])
+        self.assertEqual(
+            list(workbook['Things'].values),
+            [('Value',), ('nothing',), ('nothing',)])
+        self.assertEqual(
+            list(workbook['Sheet nb 43'].values),
+            [('Result',), ('oui',), ('non',)])
+
+        # only the parts of the last dump are kept.
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), 2 * 3)
+
+    def test_list_source(self):
+        definition = [
+            {
+                'type': 'sheet',
+                'name': 'Things',
+                'components': [
+                    {
+                        'type': 'table',
+                        'name': 'A table',
+                        'payload': 'things',
+                        'columns': [
+                            {
+                                'name': 'Value',
+                                'data_func': 'thing_value',
+                                'validations': {
+                                    'list_source_func': 'get_thing_names'
+                                }
+                            }
+                        ]
+                    }
+                ]
+            }
+        ]
+
+        formulas = []
+        for names in [['The answer', 'nothing'], ['The answer', 'nothing', 'more']]:
+            data = ListSourceDataModel()
+            data.names = names
+            excel = SmartExcel(
+                output=io.BytesIO(),
+                definition=definition,
+                data=data,
+                cache_dir=self.cache_dir.name)
+            excel.dump()
+
+            self.assertIsNone(excel.workbook.sheet_parts['Things'][1])
+            validations = load_workbook(excel.output)['Things'].data_validations
+            formulas.extend(
+                validation.formula1
+                for validation in validations.dataValidation)
+
+        self.assertEqual(formulas, ['_data!$A$1:$B$1', '_data!$A$1:$C$1'])
+
+
+class FingerprintDataModel(DataModel):
+    fingerprint = 'v1'
+
+    def get_report_fingerprint(self):
+        return self.fingerprint
+
+
+class TestReportCache(unittest.TestCase):
+    definition = [
+        {
+            'type': 'sheet',
+            'name': 'Things',
+            'components': [
+                {
+                    'type': 'table',
+                    'name': 'A table',
+                    'payload': 'things',
+                    'columns': [
+                        {
+                            'name': 'Value',
+                            'data_func': 'thing_value'
+                        }
+                    ]
+                }
+            ]
+        }
+    ]
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def dump(self, data, report_cache, **kwargs):
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=self.definition,
+            data=data,
+            report_cache=report_cache,
+            **kwargs)
+        excel.dump()
+        return excel
+
+    def test_hit(self):
+        report_cache = FileReportCache(self.cache_dir.name)
+
+        first = self.dump(FingerprintDataModel(), report_cache)
+        self.assertIsNone(first.cached_report)
+
+        data = FingerprintDataModel()
+        data.results['things'] = []
+        second = self.dump(data, report_cache)
+
+        # the stored report, not parsed nor rendered again.
+        self.assertEqual(second.sheets, {})
+        self.assertEqual(second.output.getvalue(), first.output.getvalue())
+        self.assertTrue(second.cached_report.closed)
+
+        data.fingerprint = 'v2'
+        third = self.dump(data, report_cache)
+        self.assertIsNone(third.cached_report)
+        self.assertEqual(
+            list(load_workbook(third.output)['Things'].values),
+            [('Value',)])
+
+    def test_compression(self):
+        report_cache = FileReportCache(self.cache_dir.name)
+
+        for compression, compress_type in [
+                ('store', zipfile.ZIP_STORED),
+                ('smallest', zipfile.ZIP_DEFLATED)]:
+            excel = self.dump(
+                FingerprintDataModel(), report_cache, compression=compression)
+
+            self.assertIsNone(excel.cached_report)
+            package = zipfile.ZipFile(excel.output)
+            self.assertEqual(
+                package.getinfo('xl/worksheets/sheet1.xml').compress_type,
+                compress_type)
+
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), 2)
+        excel = self.dump(
+            FingerprintDataModel(), report_cache, compression='store')
+        self.assertIsNotNone(excel.cached_report)
+
+    def test_no_fingerprint(self):
+        excel = self.dump(DataModel(), FileReportCache(self.cache_dir.name))
+
+        self.assertIsNone(excel.report_key)
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_eviction(self):
+        report_cache = FileReportCache(self.cache_dir.name, max_size=25)
+
+        report_cache.set('a', b'a' * 10)
+        report_cache.set('b', b'b' * 10)
+        # `a` is used after `b`: `b` is the least recently used.
+        past = time.time() - 60
+        os.utime(report_cache.path('b'), (past, past))
+        os.utime(report_cache.path('a'), (past - 60, past - 60))
+        self.assertEqual(self.read(report_cache, 'a'), b'a' * 10)
+
+        report_cache.set('c', b'c' * 10)
+
+        self.assertIsNone(report_cache.get('b'))
+        self.assertEqual(self.read(report_cache, 'a'), b'a' * 10)
+        self.assertEqual(self.read(report_cache, 'c'), b'c' * 10)
+
+    def read(self, report_cache, key):
+        with report_cache.get(key) as fd:
+            return fd.read()
+
+
+class TestCompression(unittest.TestCase):
+    definition = [
+        {
+            'type': 'sheet',
+            'name': 'Images',
+            'components': [
+                {
+                    'type': 'text',
+                    'name': 'Title',
+                    'text_func': 'sheet_title',
+                    'size': {
+                        'width': 2,
+                        'height': 1
+                    }
+                },
+                {
+                    'type': 'image',
+                    'name': 'Partner logos',
+                    'image_func': 'partner_logos_small',
+                    'size': {
+                        'width': 300,
+                        'height': 41
+                    }
+                }
+            ]
+        }
+    ]
+
+    def dump(self, compression):
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=self.definition,
+            data=DataModel(),
+            compression=compression)
+        excel.dump()
+        return zipfile.ZipFile(excel.output)
+
+    def test_profiles(self):
+        for compression in ['fastest', 'default', 'smallest', 'store']:
+            package = self.dump(compression)
+            self.assertIsNone(package.testzip())
+
+            methods = {
+                info.filename: info.compress_type
+                for info in package.infolist()
+            }
+            # already compressed
+            self.assertEqual(
+                methods['xl/media/image1.png'], zipfile.ZIP_STORED)
+            self.assertEqual(
+                methods['xl/worksheets/sheet1.xml'],
+                zipfile.ZIP_STORED if compression == 'store'
+                else zipfile.ZIP_DEFLATED)
+
+        self.assertEqual(
+            load_workbook(io.BytesIO(package.fp.getvalue()))['Images']['A1'].value,
+            'Hello World!')
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            self.dump('zstd')
+
+    def test_xlsxwriter_not_patched(self):
+        zip_classes = []
+
+        class SpyWorkbook(Workbook):
+            def _get_packager(self):
+                zip_classes.append(xlsxwriter.workbook.ZipFile)
+                return super()._get_packager()
+
+        for options in ({}, {'in_memory': True}):
+            output = io.BytesIO()
+            workbook = SpyWorkbook(output, options, compression='store')
+            workbook.add_worksheet('Sheet1').write('A1', 'Hello')
+            workbook.close()
+
+            package = zipfile.ZipFile(output)
+            self.assertEqual(
+                {info.compress_type for info in package.infolist()},
+                {zipfile.ZIP_STORED})
+            self.assertEqual(load_workbook(output)['Sheet1']['A1'].value, 'Hello')
+
+        # other workbooks, closed meanwhile, keep xlsxwriter's zip file
+        self.assertEqual(zip_classes, [zipfile.ZipFile, zipfile.ZipFile])
+        # the package of xlsxwriter is repacked, not written by a copy of
+        # its private method
+        self.assertNotIn('_store_workbook', vars(Workbook))
+
+    def test_repack(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.xlsx')
+            workbook = Workbook(
+                path,
+                {'in_memory': True, 'tmpdir': directory},
+                compression='smallest')
+            workbook.add_worksheet('Sheet1').write('A1', 'Hello')
+            workbook.close()
+
+            with zipfile.ZipFile(path) as package:
+                self.assertIsNone(package.testzip())
+                # the date of xlsxwriter's parts
+                self.assertEqual(
+                    {info.date_time for info in package.infolist()},
+                    {(1980, 1, 1, 0, 0, 0)})
+            self.assertEqual(load_workbook(path)['Sheet1']['A1'].value, 'Hello')
+            # no temporary file left
+            self.assertEqual(os.listdir(directory), ['report.xlsx'])
+
+
+class NumbersDataModel(DataModel):
+    def __init__(self):
+        super().__init__()
+        self.results['numbers'] = [
+            12345678901234,
+            3.14159265358979,
+            None
+        ]
+
+
+class TestColumnWidth(unittest.TestCase):
+    def test_display_width(self):
+        self.assertEqual(display_width('Bonzai'), 6)
+        self.assertEqual(display_width('Good\nmorning'), 7)
+        self.assertEqual(display_width(12345678901234), 14)
+        self.assertEqual(display_width(3.14159265358979), 11)
+        self.assertEqual(display_width(True), 4)
+        self.assertEqual(display_width(datetime.date(2020, 1, 2)), 10)
+        self.assertEqual(display_width(None), 0)
+
+    def test_numbers(self):
+        definition = [
+            {
+                'type': 'sheet',
+                'name': 'Numbers',
+                'components': [
+                    {
+                        'type': 'table',
+                        'name': 'Numbers',
+                        'payload': 'numbers',
+                        'columns': [
+                            {
+                                'name': 'Number',
+                                'data_func': 'first_column'
+                            },
+                            {
+                                'name': 'Fixed',
+                                'data_func': 'second_column',
+                                'width': 5
+                            }
+                        ]
+                    }
+                ]
+            }
+        ]
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=definition,
+            data=NumbersDataModel())
+        excel.dump()
+
+        widths = load_workbook(excel.output)['Numbers'].column_dimensions
+        # xlsxwriter adds the cell padding to the widths.
+        self.assertAlmostEqual(widths['A'].width, 14, delta=1)
+        self.assertAlmostEqual(widths['B'].width, 5, delta=1)
+
+
+class TestParse(unittest.TestCase):
+    definition = [
+        {
+            'type': 'sheet',
+            'name': 'Sheet1',
+            'components': [
+                {
+                    'type': 'table',
+                    'name': 'Things',
+                    'payload': 'things',
+                    'columns': [
+                        {
+                            'name': 'Identification',
+                            'data_func': 'thing_id'
+                        },
+                        {
+                            'name': 'Value',
+                            'data_func': 'thing_value',
+                            'key': 'value'
+                        }
+                    ]
+                }
+            ]
+        }
+    ]
+
+    def setUp(self):
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=self.definition,
+            data=DataModel())
+        excel.dump()
+        self.output = excel.output
+
+    def test_round_trip(self):
+        excel = SmartExcel(
+            definition=self.definition,
+            data=DataModel(),
+            path=self.output)
+
+        self.assertEqual(excel.meta_config['header_row'], 1)
+        self.assertEqual(
+            excel.parse(),
+            [
+                {'thing_id': 42, 'value': 'The answer'},
+                {'thing_id': 43, 'value': 'nothing'}
+            ])
+        # the file is read again by each parse.
+        self.assertEqual(len(list(excel.iter_parse())), 2)
+
+    def test_columns(self):
+        excel = SmartExcel(
+            definition=self.definition,
+            data=DataModel(),
+            path=self.output)
+
+        self.assertEqual(
+            excel.parse(columns=['value']),
+            [{'value': 'The answer'}, {'value': 'nothing'}])
+
+        with self.assertRaisesRegex(ValueError, "column 'thing_value' not present"):
+            excel.parse(columns=['thing_value'])
+
+    def test_parse_into(self):
+        class Sink():
+            def __init__(self):
+                self.batches = []
+
+            def write_batch(self, rows):
+                self.batches.append(rows)
+
+        excel = SmartExcel(
+            definition=self.definition,
+            data=DataModel(),
+            path=self.output)
+
+        sink = Sink()
+        self.assertEqual(excel.parse_into(sink, batch_size=1), 2)
+        self.assertEqual(
+            sink.batches,
+            [
+                [{'thing_id': 42, 'value': 'The answer'}],
+                [{'thing_id': 43, 'value': 'nothing'}]
+            ])
+
+    def test_header(self):
+        definition = [dict(self.definition[0])]
+        definition[0]['components'] = [
+            dict(definition[0]['components'][0], columns=[
+                {
+                    'name': 'Value',
+                    'data_func': 'thing_value'
+                }
+            ])
+        ]
+
+        with self.assertRaisesRegex(Exception, 'Header definitions do not match.'):
+            SmartExcel(
+                definition=definition,
+                data=DataModel(),
+                path=self.output)
+
+
+class ValidationsDataModel(DataModel):
+    def get_thing_names(self):
+        return ['The answer', 'nothing']
+
+
+class ListSourceDataModel(DataModel):
+    names = []
+
+    def get_thing_names(self):
+        return self.names
+
+
+class TestParseValidations(unittest.TestCase):
+    def runTest(self):
+        definition = [
+            {
+                'type': 'sheet',
+                'name': 'Sheet1',
+                'components': [
+                    {
+                        'type': 'table',
+                        'name': 'Things',
+                        'payload': 'things',
+                        'columns': [
+                            {
+                                'name': 'Identification',
+                                'data_func': 'thing_id',
+                                'validations': {
+                                    'excel': {
+                                        'validate': 'integer',
+                                        'criteria': '>',
+                                        'value': 0
+                                    }
+                                }
+                            },
+                            {
+                                'name': 'Value',
+                                'data_func': 'thing_value',
+                                'validations': {
+                                    'list_source_func': 'get_thing_names'
+                                }
+                            }
+                        ]
+                    }
+                ]
+            }
+        ]
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=definition,
+            data=ValidationsDataModel())
+        excel.dump()
+
+        # filled in by a partner
+        workbook = load_workbook(excel.output)
+        sheet = workbook['Sheet1']
+        sheet.append(['44', 'nothing'])
+        sheet.append([-1, 'everything'])
+        output = io.BytesIO()
+        workbook.save(output)
+
+        excel = SmartExcel(
+            definition=definition,
+            data=ValidationsDataModel(),
+            path=output)
+
+        self.assertEqual(
+            excel.parse(),
+            [
+                {'thing_id': 42, 'thing_value': 'The answer'},
+                {'thing_id': 43, 'thing_value': 'nothing'},
+                {'thing_id': 44, 'thing_value': 'nothing'},
+                {'thing_id': -1, 'thing_value': 'everything'}
+            ])
+        self.assertEqual(excel.parse_errors, {
+            'thing_id': {'out of range': [5]},
+            'thing_value': {'not in list': [5]}
+        })
+        self.assertEqual(excel.validate(batch_size=1), excel.parse_errors)
+
+
+class TestParseMany(unittest.TestCase):
+    definition = TestParse.definition
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = []
+        for definition in [self.definition, self.definition, TestReportCache.definition]:
+            path = os.path.join(self.directory.name, f'{len(self.paths)}.xlsx')
+            SmartExcel(
+                output=path,
+                definition=definition,
+                data=DataModel()).dump()
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_parse_many(self):
+        for workers in [None, 2]:
+            results = sorted(
+                parse_many(
+                    self.paths,
+                    self.definition,
+                    DataModel(),
+                    workers=workers),
+                key=lambda result: result.path)
+
+            self.assertEqual(
+                [result.path for result in results],
+                self.paths)
+
+            for result in results[:2]:
+                self.assertIsNone(result.exception)
+                self.assertEqual(result.errors, {})
+                self.assertEqual(
+                    result.rows,
+                    [
+                        {'thing_id': 42, 'value': 'The answer'},
+                        {'thing_id': 43, 'value': 'nothing'}
+                    ])
+
+            # not a template of the definition
+            self.assertIsNone(results[2].rows)
+            self.assertIsInstance(results[2].exception, ParseError)
+            self.assertEqual(results[2].exception.type_name, 'Exception')
+
+    def test_interleaved(self):
+        for workers in [None, 2]:
+            first = parse_many(
+                self.paths[:2], self.definition, DataModel(), workers=workers)
+            second = parse_many(
+                self.paths[2:] * 2, self.definition, DataModel(), workers=workers)
+
+            results = [next(first), next(second)]
+            # `second` is done before `first`
+            results.extend(second)
+            results.extend(first)
+
+            self.assertEqual(
+                sorted(result.path for result in results),
+                sorted(self.paths[:2] + self.paths[2:] * 2))
+            for result in results:
+                self.assertEqual(
+                    result.exception is None,
+                    result.path in self.paths[:2])
+
+    def test_unpicklable_exception(self):
+        paths = [UnpicklableFile(), self.paths[0]]
+        for workers in [None, 2]:
+            results = list(parse_many(
+                paths, self.definition, DataModel(), workers=workers))
+
+            self.assertEqual(len(results), 2)
+            for result in results:
+                if result.path is paths[0]:
+                    self.assertIsNone(result.rows)
+                    self.assertEqual(
+                        str(result.exception),
+                        'UnpicklableError: not picklable')
+                else:
+                    self.assertIsNone(result.exception)
+                    self.assertEqual(len(result.rows), 2)
+
+
+class UnpicklableError(Exception):
+    def __init__(self):
+        super().__init__('not picklable')
+        self.lock = threading.Lock()
+
+
+class UnpicklableFile(io.BytesIO):
+    """A file whose reading raises an exception that cannot be pickled."""
+
+    def seek(self, *args):
+        raise UnpicklableError()
+
+
+class HierarchyDataModel(DataModel):
+    districts = [
+        {'region': 1, 'name': 'North-East', 'population': 10},
+        {'region': 1, 'name': 'North-West', 'population': 20},
+        {'region': 2, 'name': 'South', 'population': 30},
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self.results['regions'] = [
+            {'code': 1, 'name': 'North'},
+            {'code': 2, 'name': 'South'}
+        ]
+
+    def get_sheet_name_for_region(self, instance):
+        return instance['name']
+
+    def get_sheet_name_for_district(self, instance):
+        # 'South' is also the name of a region
+        return instance['name']
+
+    def get_payload_districts(self, instance, foreign_key):
+        return [
+            district
+            for district in self.districts
+            if district['region'] == instance[foreign_key]
+        ]
+
+    def get_payload_villages(self, instance, foreign_key):
+        return [
+            {'name': f"{instance[foreign_key]} {index}"}
+            for index in range(0, 2)
+        ]
+
+    def write_code(self, instance, kwargs={}):
+        return instance['code']
+
+    def write_name(self, instance, kwargs={}):
+        return instance['name']
+
+    def write_population(self, instance, kwargs={}):
+        return instance['population']
+
+
+class TestParseHierarchy(unittest.TestCase):
+    definition = [
+        {
+            'type': 'sheet',
+            'name': 'Regions',
+            'components': [
+                {
+                    'type': 'text',
+                    'name': 'Title',
+                    'text_func': 'sheet_title',
+                    'size': {
+                        'width': 2,
+                        'height': 1
+                    }
+                },
+                {
+                    'type': 'table',
+                    'name': 'Regions',
+                    'payload': 'regions',
+                    'columns': [
+                        {
+                            'name': 'Code',
+                            'data_func': 'code'
+                        },
+                        {
+                            'name': 'Name',
+                            'data_func': 'name'
+                        }
+                    ],
+                    'recursive': {
+                        'name': {
+                            'func': 'region'
+                        },
+                        'foreign_key': 'code',
+                        'payload_func': 'districts',
+                        'components': [
+                            {
+                                'type': 'table',
+                                'name': 'Districts',
+                                'columns': [
+                                    {
+                                        'name': 'District',
+                                        'data_func': 'name'
+                                    },
+                                    {
+                                        'name': 'Population',
+                                        'data_func': 'population',
+                                        'validations': {
+                                            'excel': {
+                                                'validate': 'integer',
+                                                'criteria': '>=',
+                                                'value': 0
+                                            }
+                                        }
+                                    }
+                                ],
+                                'recursive': {
+                                    'name': {
+                                        'func': 'district'
+                                    },
+                                    'foreign_key': 'name',
+                                    'payload_func': 'villages',
+                                    'components': [
+                                        {
+                                            'type': 'table',
+                                            'name': 'Villages',
+                                            'columns': [
+                                                {
+                                                    'name': 'Village',
+                                                    'data_func': 'name',
+                                                    'key': 'village'
+                                                }
+                                            ]
+                                        }
+                                    ]
+                                }
+                            }
+                        ]
+                    }
+                }
+            ]
+        }
+    ]
+
+    def setUp(self):
+        excel = SmartExcel(
+            output=io.BytesIO(),
+            definition=self.definition,
+            data=HierarchyDataModel())
+        excel.dump()
+
+        # edited by a partner
+        workbook = load_workbook(excel.output)
+        self.assertEqual(
+            workbook.sheetnames,
+            ['Regions', 'North', 'North-East', 'North-West',
+             'South', 'South-1', '_data', '_meta'])
+        workbook['North']['B3'] = 'many'
+        workbook['South-1'].append(['South 2'])
+
+        self.output = io.BytesIO()
+        workbook.save(self.output)
+
+    def runTest(self):
+        for workers in [None, 2]:
+            excel = SmartExcel(
+                definition=self.definition,
+                data=HierarchyDataModel(),
+                path=self.output)
+
+            north_east = [{'village': 'North-East 0'}, {'village': 'North-East 1'}]
+            north_west = [{'village': 'North-West 0'}, {'village': 'North-West 1'}]
+            self.assertEqual(
+                excel.parse_hierarchy(workers=workers),
+                [
+                    {
+                        'code': 1,
+                        'name': 'North',
+                        'districts': [
+                            {'name': 'North-East', 'population': 10, 'villages': north_east},
+                            {'name': 'North-West', 'population': 'many', 'villages': north_west},
+                        ]
+                    },
+                    {
+                        'code': 2,
+                        'name': 'South',
+                        'districts': [
+                            {
+                                'name': 'South',
+                                'population': 30,
+                                'villages': [
+                                    {'village': 'South 0'},
+                                    {'village': 'South 1'},
+                                    {'village': 'South 2'}
+                                ]
+                            }
+                        ]
+                    }
+                ])
+            self.assertEqual(
+                excel.parse_errors,
+                {'North': {'population': {'not an integer': [3]}}})
+
+
+class TestNextLetter(unittest.TestCase):
+    def runTest(self):
+        self.assertEqual(next_letter(0), 'A')
+        self.assertEqual(next_letter(25), 'Z')
+        self.assertEqual(next_letter(26), 'AA')
+        self.assertEqual(next_letter(52), 'BA')
+
+
 if __name__ == "__main__":
     unittest.main()
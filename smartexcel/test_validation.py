@@ -0,0 +1,83 @@
+import datetime
+import unittest
+from .validation import ColumnValidator
+
+
+class TestColumnValidator(unittest.TestCase):
+    def validate(self, validations, values, list_source=None):
+        errors = {}
+        values = ColumnValidator(validations, list_source)(values, errors)
+        return values, errors
+
+    def test_integer(self):
+        values, errors = self.validate(
+            {
+                'excel': {
+                    'validate': 'integer',
+                    'criteria': 'between',
+                    'minimum': 1,
+                    'maximum': 10
+                }
+            },
+            [1, 2.0, '3', 11, 'four', None, 2.5])
+
+        # the invalid values are kept, coerced if they could be
+        self.assertEqual(values, [1, 2, 3, 11, 'four', None, 2.5])
+        self.assertEqual(errors, {
+            'out of range': [3],
+            'not an integer': [4, 6]
+        })
+
+    def test_date(self):
+        values, errors = self.validate(
+            {
+                'excel': {
+                    'validate': 'date',
+                    'criteria': '>=',
+                    'value': datetime.date(2020, 1, 1),
+                    'ignore_blank': False
+                }
+            },
+            [datetime.datetime(2020, 1, 2), '2020-01-03', 43831, '', 'soon'])
+
+        # 43831 is 2020-01-01
+        self.assertEqual(values, [
+            datetime.date(2020, 1, 2),
+            datetime.date(2020, 1, 3),
+            datetime.date(2020, 1, 1),
+            None,
+            'soon'
+        ])
+        self.assertEqual(errors, {
+            'blank': [3],
+            'not a date': [4]
+        })
+
+    def test_list_source(self):
+        values, errors = self.validate(
+            {
+                'list_source_func': 'names'
+            },
+            ['Bonzai', 'Cabbage'],
+            list_source=['Bonzai', 'Artichoke'])
+
+        self.assertEqual(values, ['Bonzai', 'Cabbage'])
+        self.assertEqual(errors, {'not in list': [1]})
+
+    def test_formula_criteria(self):
+        values, errors = self.validate(
+            {
+                'excel': {
+                    'validate': 'decimal',
+                    'criteria': '<',
+                    'value': '=B1'
+                }
+            },
+            ['1.5', 1000])
+
+        self.assertEqual(values, [1.5, 1000.0])
+        self.assertEqual(errors, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import datetime
+import operator
+
+from openpyxl.utils.datetime import from_excel
+
+
+# xlsxwriter's data validation criteria => a test of (value, *bounds)
+CRITERIA = {
+    'between': lambda value, minimum, maximum: minimum <= value <= maximum,
+    'not between': lambda value, minimum, maximum: not minimum <= value <= maximum,  # noqa
+    'equal to': operator.eq,
+    'not equal to': operator.ne,
+    'greater than': operator.gt,
+    'less than': operator.lt,
+    'greater than or equal to': operator.ge,
+    'less than or equal to': operator.le,
+}
+CRITERIA.update({
+    '==': CRITERIA['equal to'],
+    '!=': CRITERIA['not equal to'],
+    '<>': CRITERIA['not equal to'],
+    '>': CRITERIA['greater than'],
+    '<': CRITERIA['less than'],
+    '>=': CRITERIA['greater than or equal to'],
+    '<=': CRITERIA['less than or equal to'],
+})
+
+
+def to_integer(value):
+    if isinstance(value, bool):
+        raise TypeError(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(value)
+        return int(value)
+    return int(value)
+
+
+def to_decimal(value):
+    if isinstance(value, bool):
+        raise TypeError(value)
+    return float(value)
+
+
+def to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # a serial date, not formatted as a date.
+        return from_excel(value).date()
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value.strip()[:10])
+    raise TypeError(value)
+
+
+def to_string(value):
+    return str(value)
+
+
+# the `validate` of a xlsxwriter data validation => (coerce, error)
+COERCIONS = {
+    'integer': (to_integer, 'not an integer'),
+    'decimal': (to_decimal, 'not a number'),
+    'date': (to_date, 'not a date'),
+    'length': (to_string, None),
+    'list': (None, None),
+}
+
+
+class ColumnValidator():
+    """
+    Coerce and validate the values of a column of a returned template,
+    according to the `validations` of the column definition:
+        - 'excel': the xlsxwriter data validation of the column, its type
+          (integer, decimal, date, length or list) and its criteria.
+        - 'list_source_func': the allowed values, given by the data model.
+
+    A column is validated a batch of values at a time.
+    """
+
+    def __init__(self, validations, list_source=None):
+        """
+        :param validations: the `validations` of the column definition.
+        :type validations: dict
+
+        :param list_source: the values returned by `list_source_func`.
+        :type list_source: list
+        """
+        excel = validations.get('excel', {})
+
+        self.kind = excel.get('validate')
+        self.coerce, self.coerce_error = COERCIONS.get(self.kind, (None, None))
+        self.ignore_blank = excel.get('ignore_blank', True)
+
+        self.criteria = CRITERIA.get(excel.get('criteria'))
+        if 'minimum' in excel:
+            self.bounds = (excel['minimum'], excel['maximum'])
+        else:
+            self.bounds = (excel.get('value'),)
+
+        if self.criteria is not None and self.coerce is not None:
+            try:
+                self.bounds = tuple(
+                    self.coerce(bound) if self.kind != 'length' else bound
+                    for bound in self.bounds)
+            except (TypeError, ValueError):
+                # a cell reference or a formula: not checked.
+                self.criteria = None
+
+        self.choices = None
+        if list_source is not None:
+            self.choices = frozenset(list_source)
+        elif self.kind == 'list' and not isinstance(excel.get('source'), str):
+            self.choices = frozenset(excel.get('source', []))
+
+    def __call__(self, values, errors):
+        """Return the coerced `values`.
+
+        An invalid value is kept, coerced if it could be, and its index is
+        added to `errors` (reason => indices). A blank value is None.
+        """
+        coerce = self.coerce
+        criteria = self.criteria
+        bounds = self.bounds
+        choices = self.choices
+        is_length = self.kind == 'length'
+
+        coerced = []
+        for index, value in enumerate(values):
+            if value is None or value == '':
+                if not self.ignore_blank:
+                    errors.setdefault('blank', []).append(index)
+                coerced.append(None)
+                continue
+
+            if coerce is not None:
+                try:
+                    value = coerce(value)
+                except (TypeError, ValueError, OverflowError):
+                    errors.setdefault(self.coerce_error, []).append(index)
+                    coerced.append(value)
+                    continue
+
+            if choices is not None and value not in choices:
+                errors.setdefault('not in list', []).append(index)
+                coerced.append(value)
+                continue
+
+            if criteria is not None:
+                try:
+                    valid = criteria(len(value) if is_length else value, *bounds)
+                except TypeError:
+                    valid = False
+
+                if not valid:
+                    errors.setdefault('out of range', []).append(index)
+
+            coerced.append(value)
+
+        return coerced
@@ -0,0 +1,430 @@
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+
+import xlsxwriter
+from xlsxwriter.exceptions import FileCreateError, FileSizeError
+from xlsxwriter.packager import Packager
+
+from .sinks import CHUNK_SIZE
+
+
+# Worksheets of the workbook being packaged. Set before the worker
+# processes are forked, so they inherit them without any pickling.
+_worksheets = []
+
+# Style (xf) indices of the cells, rows and columns of a worksheet part,
+# and shared string indices of its string cells.
+STYLE_RE = re.compile(r'(<(?:c|row) [^>]*?\bs=")([0-9]+)(")')
+COLUMN_STYLE_RE = re.compile(r'(<col [^>]*?\bstyle=")([0-9]+)(")')
+STRING_RE = re.compile(r'(<c [^>]*?\bt="s"[^>]*><v>)([0-9]+)(</v>)')
+
+# The parallel assembly relies on the internals of this version of
+# xlsxwriter (the style indices, the rows of a constant_memory worksheet):
+# the worksheets are assembled serially by any other version.
+XLSXWRITER_VERSION = '3.2.9'
+
+# compression profile: (compression method, deflate level) of the parts.
+# Excel only reads deflated (or stored) parts.
+COMPRESSION_PROFILES = {
+    'fastest': (zipfile.ZIP_DEFLATED, 1),
+    'default': (zipfile.ZIP_DEFLATED, 6),
+    'smallest': (zipfile.ZIP_DEFLATED, 9),
+    'store': (zipfile.ZIP_STORED, None),
+}
+
+# parts already compressed: stored as they are, whatever the profile.
+COMPRESSED_EXTENSIONS = ('.png', '.jpeg', '.jpg', '.gif')
+
+class Workbook(xlsxwriter.Workbook):
+    """
+    A xlsxwriter Workbook used by SmartExcel.
+
+    The worksheet parts (xl/worksheets/sheetN.xml) can be assembled by a
+    pool of worker processes, while the other parts, the shared string
+    table and the styles are written by this process.
+
+    With a `SheetCache`, the parts of the worksheets whose inputs did not
+    change since the previous dump are reused instead of being assembled.
+
+    The parts are compressed according to a profile of
+    `COMPRESSION_PROFILES`.
+    """
+
+    def __init__(self, filename=None, options=None, workers=None,
+                 sheet_cache=None, compression='default'):
+        """
+        :param workers: number of processes assembling the worksheets.
+        None (the default) assembles them in this process, as does a version
+        of xlsxwriter other than XLSXWRITER_VERSION.
+        :type workers: int
+
+        :param sheet_cache: the worksheet parts of the previous dumps.
+        :type sheet_cache: SheetCache
+
+        :param compression: 'fastest', 'default', 'smallest' or 'store'.
+        :type compression: str
+        """
+        if compression not in COMPRESSION_PROFILES:
+            raise ValueError(
+                f'compression must be one of {list(COMPRESSION_PROFILES)}')
+
+        super().__init__(filename, options)
+        self.workers = workers
+        self.sheet_cache = sheet_cache
+        self.compression = compression
+
+        # worksheet name: (fingerprint, cached part or None)
+        self.sheet_parts = {}
+
+    def _prepare_sst_string_data(self):
+        # The cells of the cached worksheets were not written: add their
+        # strings to the table before it is sorted and counted.
+        str_table = self.str_table
+        for fingerprint, part in self.sheet_parts.values():
+            if part is None:
+                continue
+
+            meta = part[1]
+            for string in meta['strings'].values():
+                str_table._get_shared_string_index(string)
+            str_table.count += meta['string_count'] - len(meta['strings'])
+
+        super()._prepare_sst_string_data()
+
+    def _get_packager(self):
+        return WorkbookPackager(self.workers)
+
+    def close(self):
+        """Write the package, compressed according to the profile.
+
+        xlsxwriter writes the package to a temporary file, whose parts are
+        then repacked into the output (see `repack`).
+        """
+        if self.fileclosed:
+            return super().close()
+
+        output = self.filename
+        with tempfile.TemporaryFile(dir=self.tmpdir) as package:
+            self.filename = package
+            try:
+                super().close()
+            finally:
+                self.filename = output
+
+            try:
+                repack(package, output, self.compression, self.tmpdir,
+                       self.allow_zip64)
+            except IOError as e:
+                raise FileCreateError(e)
+            except zipfile.LargeZipFile:
+                raise FileSizeError(
+                    'Filesize would require ZIP64 extensions. '
+                    'Use workbook.use_zip64().')
+
+
+def repack(package, output, profile, tmpdir=None, allow_zip64=False):
+    """Copy the parts of the zip file `package` to a PackageZipFile of
+    `profile`, written to `output`.
+
+    The parts go through temporary files, a chunk at a time, and keep
+    their date.
+    """
+    package.seek(0)
+    with zipfile.ZipFile(package) as source, \
+            PackageZipFile(output, 'w', profile=profile,
+                           allowZip64=allow_zip64) as target:
+        for info in source.infolist():
+            (fd, filename) = tempfile.mkstemp(dir=tmpdir)
+            try:
+                with os.fdopen(fd, 'wb') as part, source.open(info) as data:
+                    shutil.copyfileobj(data, part, CHUNK_SIZE)
+
+                timestamp = time.mktime(info.date_time + (0, 0, -1))
+                os.utime(filename, (timestamp, timestamp))
+                target.write(filename, info.filename)
+            finally:
+                os.remove(filename)
+
+
+class PackageZipFile(zipfile.ZipFile):
+    """The zip file of a xlsx, compressed according to `profile`."""
+
+    def __init__(self, file, mode, profile='default', **kwargs):
+        compression, level = COMPRESSION_PROFILES[profile]
+        kwargs.update({
+            'compression': compression,
+            'compresslevel': level
+        })
+        super().__init__(file, mode, **kwargs)
+
+    def write(self, filename, arcname=None, compress_type=None,
+              compresslevel=None):
+        if is_compressed(arcname):
+            compress_type = zipfile.ZIP_STORED
+        super().write(filename, arcname, compress_type, compresslevel)
+
+
+def is_compressed(arcname):
+    return bool(arcname) and arcname.lower().endswith(COMPRESSED_EXTENSIONS)
+
+
+class WorkbookPackager(Packager):
+    def __init__(self, workers=None):
+        super().__init__()
+        self.workers = workers
+
+    def _write_worksheet_files(self):
+        worksheets = [
+            worksheet
+            for worksheet in self.workbook.worksheets()
+            if not worksheet.is_chartsheet
+        ]
+        sheet_parts = self.workbook.sheet_parts
+        parallel = not self.in_memory \
+            and xlsxwriter.__version__ == XLSXWRITER_VERSION \
+            and can_fork(self.workers, len(worksheets))
+
+        if not sheet_parts and not parallel:
+            return super()._write_worksheet_files()
+
+        self.string_indices = None
+        self.formats_by_key = None
+
+        if parallel:
+            # The style (xf) index of a format is assigned the first time a
+            # cell using it is assembled. Assign the indices of the formats
+            # of the worksheets here, in the order of a serial assembly, so
+            # that every worker uses the indices of the styles written by
+            # this process, and unused formats are left out of the styles.
+            for worksheet in worksheets:
+                part = self.cached_part(worksheet)
+                if part is not None:
+                    formats = self.cached_formats(part[1]).values()
+                else:
+                    formats = worksheet_formats(worksheet)
+                for cell_format in formats:
+                    cell_format._get_xf_index()
+
+            assembled = self.assemble_in_pool([
+                index
+                for index, worksheet in enumerate(worksheets)
+                if self.cached_part(worksheet) is None
+            ], worksheets)
+
+        for index, worksheet in enumerate(worksheets):
+            name = f'xl/worksheets/sheet{index + 1}.xml'
+            part = self.cached_part(worksheet)
+
+            if part is not None:
+                self.write_cached_part(worksheet, name, *part)
+                continue
+
+            if parallel:
+                filename = assembled[index]
+                self.filenames.append((filename, name, False))
+            else:
+                if worksheet.constant_memory:
+                    worksheet._opt_reopen()
+                    worksheet._write_single_row()
+
+                filename = self._filename(name)
+                worksheet._set_xml_writer(filename)
+                worksheet._assemble_xml_file()
+
+            if worksheet.name in sheet_parts:
+                self.store_part(worksheet, filename)
+
+    def cached_part(self, worksheet):
+        return self.workbook.sheet_parts.get(worksheet.name, (None, None))[1]
+
+    def assemble_in_pool(self, indices, worksheets):
+        """Assemble the worksheets at `indices` in a pool of processes.
+
+        Returns the temporary file of each worksheet, by index.
+        """
+        global _worksheets
+        _worksheets = worksheets
+        try:
+            context = multiprocessing.get_context('fork')
+            with context.Pool(self.workers) as pool:
+                results = pool.map(
+                    assemble_worksheet,
+                    [(index, self.tmpdir) for index in indices],
+                    chunksize=max(1, len(indices) // (self.workers * 4)))
+        finally:
+            _worksheets = []
+
+        assembled = {}
+        for index, (filename, hyper_links) in zip(indices, results):
+            # relationships found while assembling, written by this process.
+            worksheets[index].external_hyper_links = hyper_links
+            assembled[index] = filename
+        return assembled
+
+    def store_part(self, worksheet, filename):
+        """Store the part of `worksheet` in the sheet cache.
+
+        The part refers to shared strings and styles by their index in this
+        workbook: the strings and the formats behind the indices are stored
+        with it, so they can be remapped by the next dump.
+        """
+        if isinstance(filename, io.StringIO):
+            xml = filename.getvalue()
+        else:
+            with open(filename, encoding='utf-8') as fd:
+                xml = fd.read()
+
+        string_array = self.workbook.str_table.string_array
+        strings = STRING_RE.findall(xml)
+
+        formats = {}
+        for cell_format in self.workbook.formats:
+            if cell_format.xf_index is not None:
+                formats.setdefault(
+                    str(cell_format.xf_index), cell_format._get_format_key())
+
+        styles = {
+            index: formats[index]
+            for regex in [STYLE_RE, COLUMN_STYLE_RE]
+            for _, index, _ in regex.findall(xml)
+        }
+
+        fingerprint = self.workbook.sheet_parts[worksheet.name][0]
+        self.workbook.sheet_cache.set(fingerprint, xml, {
+            'strings': {
+                index: string_array[int(index)]
+                for _, index, _ in strings
+            },
+            'string_count': len(strings),
+            'styles': styles,
+            'hyper_links': worksheet.external_hyper_links
+        })
+
+    def cached_formats(self, meta):
+        """The formats of this workbook of a part of the sheet cache, by
+        style index in the part."""
+        if self.formats_by_key is None:
+            self.formats_by_key = {}
+            for cell_format in self.workbook.formats:
+                self.formats_by_key.setdefault(
+                    cell_format._get_format_key(), cell_format)
+
+        return {
+            index: self.formats_by_key[key]
+            for index, key in meta['styles'].items()
+        }
+
+    def write_cached_part(self, worksheet, name, xml, meta):
+        """Write a part of the sheet cache, with the indices of this workbook."""
+        styles = {
+            index: str(cell_format._get_xf_index())
+            for index, cell_format in self.cached_formats(meta).items()
+        }
+        strings = {
+            index: str(self.string_index(string))
+            for index, string in meta['strings'].items()
+        }
+
+        def remap(indices):
+            return lambda match: \
+                match.group(1) + indices[match.group(2)] + match.group(3)
+
+        xml = STYLE_RE.sub(remap(styles), xml)
+        xml = COLUMN_STYLE_RE.sub(remap(styles), xml)
+        xml = STRING_RE.sub(remap(strings), xml)
+
+        worksheet.external_hyper_links = meta['hyper_links']
+
+        filename = self._filename(name)
+        if isinstance(filename, io.StringIO):
+            filename.write(xml)
+        else:
+            with open(filename, 'w', encoding='utf-8') as fd:
+                fd.write(xml)
+
+    def string_index(self, string):
+        """Index of `string` in the (sorted) shared string table."""
+        if self.string_indices is None:
+            self.string_indices = {
+                value: index
+                for index, value in enumerate(
+                    self.workbook.str_table.string_array)
+            }
+        return self.string_indices[string]
+
+
+def can_fork(workers, n_worksheets):
+    return bool(workers) \
+        and workers > 1 \
+        and n_worksheets > 1 \
+        and 'fork' in multiprocessing.get_all_start_methods()
+
+
+def worksheet_formats(worksheet):
+    """The formats of the cells, rows and columns of `worksheet`, in the
+    order its assembly gives them a style (xf) index."""
+    def col_format(col):
+        return worksheet.col_info.get(col, (None, None))[1]
+
+    def row_formats(rows):
+        for row in rows:
+            row_format = worksheet.set_rows.get(row, (None, None, None))[1]
+            if row_format:
+                yield row_format
+            cells = worksheet.table.get(row, {})
+            for col in sorted(cells):
+                if cells[col].format:
+                    yield cells[col].format
+                elif not row_format and col_format(col):
+                    # the cell has the style of its column
+                    yield col_format(col)
+
+    col_formats = [
+        col_format(col)
+        for col in sorted(worksheet.col_info)
+        if col_format(col)
+    ]
+
+    if worksheet.constant_memory:
+        # the last row, still to be written, then the columns
+        yield from row_formats(sorted(worksheet.table))
+        yield from col_formats
+        return
+
+    yield from col_formats
+    if worksheet.dim_rowmin is not None:
+        yield from row_formats(
+            row
+            for row in range(worksheet.dim_rowmin, worksheet.dim_rowmax + 1)
+            if row in worksheet.set_rows or worksheet.table.get(row))
+
+
+def assemble_worksheet(task):
+    """Write the XML part of a worksheet (in a worker process).
+
+    :param task: index of the worksheet, directory of the temporary file.
+    :type task: tuple
+
+    Returns the path of the temporary file and the hyperlinks relationships
+    of the worksheet, only known once assembled.
+    """
+    index, tmpdir = task
+    worksheet = _worksheets[index]
+
+    if worksheet.constant_memory:
+        worksheet._opt_reopen()
+        worksheet._write_single_row()
+
+    (fd, filename) = tempfile.mkstemp(dir=tmpdir)
+    os.close(fd)
+
+    worksheet._set_xml_writer(filename)
+    worksheet._assemble_xml_file()
+
+    return filename, worksheet.external_hyper_links